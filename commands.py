@@ -1,14 +1,12 @@
 import fire
 from hydra import initialize
 
-from mlopscourse.infer import Inferencer
-from mlopscourse.train import Trainer
-
 
 def train(
     config_name: str,
     config_path: str = "configs/",
     hydra_version_base: str = "1.3",
+    incremental: bool = False,
     **kwargs: dict,
 ) -> None:
     """
@@ -23,17 +21,85 @@ def train(
         The path to the configuration files.
     hydra_version_base : str
         The compatibility level of hydra to use.
+    incremental : bool
+        Whether to continue the training of the saved checkpoint on the rows appended
+        to the train split since, see `training.incremental`.
+    **kwargs : dict, optional
+        Values of the configuration file to override.
+    """
+    # Each subcommand imports its module itself to only pay for the libraries it uses
+    from mlopscourse.train import Trainer
+
+    with initialize(config_path=config_path, version_base=hydra_version_base):
+        trainer = Trainer(config_name, **kwargs)
+        if incremental:
+            trainer.train_incremental()
+        else:
+            trainer.train()
+
+
+def sweep(
+    config_name: str,
+    config_path: str = "configs/",
+    hydra_version_base: str = "1.3",
+    **kwargs: dict,
+) -> None:
+    """
+    Searches for the best hyperparameters of the chosen model with a pool of processes,
+    stopping poor trials early.
+
+    Parameters
+    ----------
+    config_name : str
+        The name of the configuration file to use for model, training and sweep
+        parameters.
+    config_path : str
+        The path to the configuration files.
+    hydra_version_base : str
+        The compatibility level of hydra to use.
+    **kwargs : dict, optional
+        Values of the configuration file to override.
+    """
+    from mlopscourse.sweep import Sweeper
+
+    with initialize(config_path=config_path, version_base=hydra_version_base):
+        Sweeper(config_name, **kwargs).sweep()
+
+
+def cross_validate(
+    config_name: str,
+    config_path: str = "configs/",
+    hydra_version_base: str = "1.3",
+    **kwargs: dict,
+) -> None:
+    """
+    Cross-validates the chosen model on the train split with time-ordered folds trained
+    by a pool of processes.
+
+    Parameters
+    ----------
+    config_name : str
+        The name of the configuration file to use for model and cross-validation
+        parameters.
+    config_path : str
+        The path to the configuration files.
+    hydra_version_base : str
+        The compatibility level of hydra to use.
     **kwargs : dict, optional
         Values of the configuration file to override.
     """
+    from mlopscourse.cross_validation import CrossValidator
+
     with initialize(config_path=config_path, version_base=hydra_version_base):
-        Trainer(config_name, **kwargs).train()
+        CrossValidator(config_name, **kwargs).cross_validate()
 
 
 def infer(
     config_name: str,
     config_path: str = "configs/",
     hydra_version_base: str = "1.3",
+    stream: bool = False,
+    parallel: bool = False,
     **kwargs: dict,
 ) -> None:
     """
@@ -48,11 +114,52 @@ def infer(
         The path to the configuration files.
     hydra_version_base : str
         The compatibility level of hydra to use.
+    stream : bool
+        Whether to read the input file set in `inference.streaming` by chunks instead of
+        loading the whole test split.
+    parallel : bool
+        Whether to score the test split with the pool of processes configured in
+        `inference.parallel`.
     **kwargs : dict, optional
         Values of the configuration file to override.
     """
+    from mlopscourse.infer import Inferencer
+
+    with initialize(config_path=config_path, version_base=hydra_version_base):
+        inferencer = Inferencer(config_name, **kwargs)
+        if stream:
+            inferencer.infer_stream()
+        elif parallel:
+            inferencer.infer_parallel()
+        else:
+            inferencer.infer()
+
+
+def serve(
+    config_name: str,
+    config_path: str = "configs/",
+    hydra_version_base: str = "1.3",
+    **kwargs: dict,
+) -> None:
+    """
+    Serves the chosen model over HTTP, coalescing concurrent requests into batches.
+
+    Parameters
+    ----------
+    config_name : str
+        The name of the configuration file to use for model, inference and serving
+        parameters.
+    config_path : str
+        The path to the configuration files.
+    hydra_version_base : str
+        The compatibility level of hydra to use.
+    **kwargs : dict, optional
+        Values of the configuration file to override.
+    """
+    from mlopscourse.server import Server
+
     with initialize(config_path=config_path, version_base=hydra_version_base):
-        Inferencer(config_name, **kwargs).infer()
+        Server(config_name, **kwargs).serve()
 
 
 if __name__ == "__main__":
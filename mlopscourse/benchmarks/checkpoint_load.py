@@ -0,0 +1,92 @@
+import multiprocessing as mp
+import os
+import resource
+import time
+from typing import Tuple
+
+import fire
+from omegaconf import open_dict
+
+from ..data.prepare_dataset import load_dataset
+from ..models.models_zoo import load_checkpoint
+
+
+def measure_load(path: str, batch_size: int) -> Tuple[float, float, float, float]:
+    """
+    Returns the load time, the time of the first prediction and the peak RSS in MiB
+    before the load and after the prediction.
+    """
+    X_batch = load_dataset(split="test")[0].iloc[:batch_size]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    model = load_checkpoint(path)
+    load_time = time.perf_counter() - start
+    # A lazily loaded checkpoint pays for the pages it touches here
+    start = time.perf_counter()
+    model(X_batch)
+    predict_time = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return load_time, predict_time, rss_before, rss_after
+
+
+def convert_to_native(checkpoint_name: str) -> None:
+    model = load_checkpoint(f"checkpoints/{checkpoint_name}.p")
+    # Old pickles may lack the field, which is prohibited to add by default
+    with open_dict(model.cfg):
+        model.cfg.training.checkpoint_name = checkpoint_name
+        model.cfg.training.checkpoint_format = "native"
+    model.save_checkpoint("checkpoints/")
+
+
+def benchmark_load(
+    checkpoint_name: str = "cb_model", batch_size: int = 1, n_repeats: int = 5
+) -> None:
+    """
+    Compares loading the pickled checkpoint with loading the native one.
+
+    If only the pickled checkpoint exists, the native one is created from it. Every
+    load runs in a fresh process, like a cold start of a serving instance.
+
+    Parameters
+    ----------
+    checkpoint_name : str
+        The name of the checkpoint in the `checkpoints/` directory without the
+        extension.
+    batch_size : int
+        The number of rows in the first prediction.
+    n_repeats : int
+        The number of loads per format.
+    """
+    path = f"checkpoints/{checkpoint_name}"
+    assert os.path.isfile(path + ".p"), (
+        f"{path}.p is missing, train the model with "
+        "--training.checkpoint_format=pickle first!"
+    )
+    ctx = mp.get_context("spawn")
+    if not os.path.isdir(path):
+        # The peak RSS is inherited by the children, so the pickle isn't loaded here
+        with ctx.Pool(1) as pool:
+            pool.apply(convert_to_native, (checkpoint_name,))
+
+    print(
+        f"{'format':>7} {'load, ms':>10} {'1st predict, ms':>16} "
+        f"{'peak RSS, MiB':>14} {'RSS growth, MiB':>16}"
+    )
+    for checkpoint_format, checkpoint_path in [("pickle", path + ".p"), ("native", path)]:
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            results = [
+                pool.apply(measure_load, (checkpoint_path, batch_size))
+                for _ in range(n_repeats)
+            ]
+        load_time = min(result[0] for result in results)
+        predict_time = min(result[1] for result in results)
+        rss_after = min(result[3] for result in results)
+        rss_growth = min(result[3] - result[2] for result in results)
+        print(
+            f"{checkpoint_format:>7} {load_time * 1e3:>10.1f} {predict_time * 1e3:>16.1f} "
+            f"{rss_after:>14.1f} {rss_growth:>16.1f}"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_load)
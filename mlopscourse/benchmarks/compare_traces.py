@@ -0,0 +1,66 @@
+import json
+import sys
+
+import fire
+
+
+def compare_traces(
+    baseline: str,
+    candidate: str,
+    stat: str = "wall_sec",
+    threshold: float = 0.1,
+    min_value: float = 0.05,
+) -> None:
+    """
+    Compares the spans of two traces saved by `profiling.tracing`, e.g. of the same
+    command at two commits, and exits with 1 if any span regressed.
+
+    Parameters
+    ----------
+    baseline : str
+        The path to the trace to compare with.
+    candidate : str
+        The path to the new trace.
+    stat : str
+        The span statistic to compare: wall_sec, cpu_sec, rss_growth_mb or peak_rss_mb.
+    threshold : float
+        The relative growth of the statistic considered a regression.
+    min_value : float
+        The spans below this value in both traces are too noisy to be flagged.
+    """
+    traces = list()
+    for path in [baseline, candidate]:
+        with open(path) as f:
+            traces.append(json.load(f))
+    print(
+        f"Comparing {stat} of {traces[0]['command']}: "
+        f"{traces[0].get('commit_id')} -> {traces[1].get('commit_id')}"
+    )
+
+    spans = list(traces[0]["spans"])
+    spans += [path for path in traces[1]["spans"] if path not in traces[0]["spans"]]
+    print(f"{'span':<50} {'baseline':>10} {'candidate':>10} {'change':>8}")
+    n_regressions = 0
+    for path in spans:
+        old, new = [trace["spans"].get(path, {}).get(stat) for trace in traces]
+        if old is None or new is None:
+            # The span was added or removed
+            old_str = "-" if old is None else f"{old:.3f}"
+            new_str = "-" if new is None else f"{new:.3f}"
+            print(f"{path:<50} {old_str:>10} {new_str:>10}")
+            continue
+        change = (new - old) / old if old > 0 else 0.0
+        is_regression = change > threshold and max(old, new) >= min_value
+        n_regressions += is_regression
+        print(
+            f"{path:<50} {old:>10.3f} {new:>10.3f} {change:>+8.1%}"
+            + (" REGRESSION" if is_regression else "")
+        )
+
+    if n_regressions > 0:
+        print(f"{n_regressions} spans regressed by more than {threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(compare_traces)
@@ -0,0 +1,58 @@
+import time
+from typing import List
+
+import fire
+import numpy as np
+import pandas as pd
+
+from ..data.prepare_dataset import DATA_DIR, TARGET
+from ..models.models_zoo import load_checkpoint
+
+
+def benchmark_compiled(
+    checkpoint_name: str = "cb_model",
+    batch_sizes: List[int] = (1, 64, 1024, 8192),
+    n_repeats: int = 20,
+) -> None:
+    """
+    Checks that the compiled model predicts bit-exactly as the original one on
+    `test_split.csv` and compares their throughput.
+
+    Parameters
+    ----------
+    checkpoint_name : str
+        The name of the checkpoint in the `checkpoints/` directory.
+    batch_sizes : List[int]
+        The batch sizes to measure the throughput for.
+    n_repeats : int
+        The number of predictions per batch size.
+    """
+    X_test = pd.read_csv(f"{DATA_DIR}/test_split.csv", index_col=0).drop(columns=TARGET)
+    model = load_checkpoint(f"checkpoints/{checkpoint_name}")
+    compiled_model = load_checkpoint(f"checkpoints/{checkpoint_name}")
+    start = time.perf_counter()
+    compiled_model.compile()
+    print(f"Compiled in {time.perf_counter() - start:.1f} sec")
+
+    preds, compiled_preds = model(X_test), compiled_model(X_test)
+    n_mismatches = np.sum(preds != compiled_preds)
+    assert n_mismatches == 0, (
+        f"{n_mismatches} of {len(X_test)} predictions differ, "
+        f"by up to {np.abs(preds - compiled_preds).max()}!"
+    )
+    print(f"The {len(X_test)} predictions are bit-exact")
+
+    print(f"{'batch':>6} {'model':>9} {'rows/sec':>12}")
+    for batch_size in batch_sizes:
+        X_batch = X_test.iloc[np.arange(batch_size) % len(X_test)]
+        for name, predict in [("original", model), ("compiled", compiled_model)]:
+            predict(X_batch)  # Warm up
+            start = time.perf_counter()
+            for _ in range(n_repeats):
+                predict(X_batch)
+            throughput = batch_size * n_repeats / (time.perf_counter() - start)
+            print(f"{batch_size:>6} {name:>9} {throughput:>12.0f}")
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_compiled)
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+from typing import Tuple
+
+import fire
+import numpy as np
+import pandas as pd
+from catboost import Pool
+
+from ..cross_validation import get_time_series_folds
+from ..data.prepare_dataset import load_dataset
+from ..models.encoder import FeatureEncoder
+
+
+def benchmark_fold_data(n_copies: Tuple[int, ...] = (1, 16), n_folds: int = 5) -> None:
+    """
+    Compares the cost of preparing the data of every fold from the frame with preparing
+    it once for all the folds, as `CrossValidator` does, on the train split tiled
+    `n_copies` times.
+
+    Parameters
+    ----------
+    n_copies : Tuple[int, ...]
+        The sizes of the data in copies of the train split.
+    n_folds : int
+        The number of the folds.
+    """
+    X_train, y_train, numerical_features, categorical_features = load_dataset(
+        split="train"
+    )
+    encoder = FeatureEncoder.fit(X_train, numerical_features, categorical_features)
+    print(
+        f"{'rows':>9} {'model':>5} {'per fold, s':>12} {'once, s':>8} "
+        f"{'frame, MiB':>11} {'prepared, MiB':>14}"
+    )
+    for copies in n_copies:
+        X = pd.concat([X_train] * copies, ignore_index=True)
+        y = pd.concat([y_train] * copies, ignore_index=True)
+        folds = get_time_series_folds(len(X), n_folds)
+        frame_mb = X.memory_usage(deep=True).sum() / 2**20
+
+        start = time.perf_counter()
+        for train_end, val_start, val_end in folds:
+            for rows in [slice(0, train_end), slice(val_start, val_end)]:
+                Pool(X[rows], y[rows], cat_features=categorical_features).quantize()
+        per_fold = time.perf_counter() - start
+        start = time.perf_counter()
+        pool = Pool(X, y, cat_features=categorical_features)
+        pool.quantize()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # The workers load the saved pool
+            pool_path = os.path.join(tmp_dir, "train.quantized")
+            pool.save(pool_path)
+            pool_mb = os.path.getsize(pool_path) / 2**20
+        for train_end, val_start, val_end in folds:
+            pool.slice(np.arange(train_end))
+            pool.slice(np.arange(val_start, val_end))
+        once = time.perf_counter() - start
+        print(
+            f"{len(X):>9} {'cb':>5} {per_fold:>12.2f} {once:>8.2f} "
+            f"{frame_mb:>11.1f} {pool_mb:>14.1f}"
+        )
+
+        start = time.perf_counter()
+        for train_end, val_start, val_end in folds:
+            encoder.transform(X.iloc[:train_end])
+            encoder.transform(X.iloc[val_start:val_end])
+        per_fold = time.perf_counter() - start
+        start = time.perf_counter()
+        X_encoded = encoder.transform(X)
+        for train_end, val_start, val_end in folds:
+            # The folds take views, which copy nothing
+            assert np.shares_memory(X_encoded[:train_end], X_encoded)
+            X_encoded[val_start:val_end]
+        once = time.perf_counter() - start
+        print(
+            f"{len(X):>9} {'rf':>5} {per_fold:>12.2f} {once:>8.2f} "
+            f"{frame_mb:>11.1f} {X_encoded.nbytes / 2**20:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_fold_data)
@@ -0,0 +1,73 @@
+from typing import List
+
+import fire
+import numpy as np
+
+from ..data.prepare_dataset import load_dataset
+from ..models.models_zoo import load_checkpoint
+from .predict_latency import measure_latencies
+
+
+def benchmark_ensemble(
+    checkpoint_name: str = "ensemble_model",
+    batch_sizes: List[int] = (1, 64, 1024),
+    n_repeats: int = 100,
+    thread_count: int = -1,
+    compiled: bool = False,
+) -> None:
+    """
+    Compares the latency of the ensemble with its members called one after another,
+    each encoding the batch itself, as two separate models would be served.
+
+    Parameters
+    ----------
+    checkpoint_name : str
+        The name of the ensemble checkpoint in the `checkpoints/` directory.
+    batch_sizes : List[int]
+        The batch sizes to measure the latency for.
+    n_repeats : int
+        The number of predictions per batch size and path.
+    thread_count : int
+        The number of threads of each member, -1 means all the cores.
+    compiled : bool
+        Whether to compile the members.
+    """
+    X_test, _, _, _ = load_dataset(split="test")
+    model = load_checkpoint(f"checkpoints/{checkpoint_name}")
+    if compiled:
+        model.compile()
+    model.set_thread_count(thread_count)
+
+    def predict_separately(X_sample) -> np.ndarray:
+        return sum(
+            weight * member(X_sample)
+            for weight, member in zip(model.weights, model.members)
+        )
+
+    def predict_sequentially(X_sample) -> np.ndarray:
+        model.n_threads = 1
+        try:
+            return model(X_sample)
+        finally:
+            model.n_threads = len(model.members)
+
+    assert np.allclose(
+        model(X_test), predict_separately(X_test)
+    ), "The ensemble differs from the blend of its members!"
+    print(f"{'batch':>6} {'path':>26} {'p50, us':>10} {'p99, us':>10}")
+    for batch_size in batch_sizes:
+        X_batch = X_test.iloc[:batch_size]
+        for path, predict in [
+            ("members one by one", predict_separately),
+            ("ensemble, one thread", predict_sequentially),
+            ("ensemble, thread per member", model),
+        ]:
+            latencies = measure_latencies(predict, X_batch, n_repeats)
+            print(
+                f"{batch_size:>6} {path:>26} "
+                f"{np.percentile(latencies, 50):>10.1f} {np.percentile(latencies, 99):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_ensemble)
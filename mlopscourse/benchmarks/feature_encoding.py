@@ -0,0 +1,100 @@
+from typing import Callable, Dict, List
+
+import fire
+import numpy as np
+import pandas as pd
+from catboost import Pool
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OrdinalEncoder
+
+from ..data.prepare_dataset import load_dataset
+from ..models.encoder import FeatureEncoder
+from .predict_latency import measure_latencies
+
+
+def encode_with_categorical(encoder: FeatureEncoder, X: pd.DataFrame) -> np.ndarray:
+    """The encoding of the native Random Forest before the shared encoder."""
+    columns = [
+        pd.Categorical(X[name], categories=encoder.categories[name]).codes
+        for name in encoder.categorical_features
+    ]
+    columns.extend(X[name].to_numpy() for name in encoder.numerical_features)
+    return np.column_stack(columns).astype(np.float32)
+
+
+def benchmark_encoding(
+    batch_sizes: List[int] = (1, 64, 1024), n_repeats: int = 200
+) -> None:
+    """
+    Compares the per-batch cost of the categorical encodings the models and Triton used
+    with the shared `FeatureEncoder`.
+
+    Parameters
+    ----------
+    batch_sizes : List[int]
+        The batch sizes to measure the cost for.
+    n_repeats : int
+        The number of encodings per batch size and path.
+    """
+    X_train, _, numerical_features, categorical_features = load_dataset(split="train")
+    X_test, _, _, _ = load_dataset(split="test")
+    encoder = FeatureEncoder.fit(X_train, numerical_features, categorical_features)
+    # The preprocessor of the Random Forest pipeline
+    column_transformer = ColumnTransformer(
+        transformers=[
+            ("cat", OrdinalEncoder(dtype=np.int64), categorical_features),
+            ("num", "passthrough", numerical_features),
+        ],
+        verbose_feature_names_out=False,
+    ).set_output(transform="pandas")
+    column_transformer.fit(X_train)
+
+    # The record batch Triton gets: the string tensors as arrays of bytes objects
+    strings = [name for name in X_test.columns if X_test[name].dtype == "category"]
+    triton_batch = {
+        name: (
+            X_test[name].astype(str).str.encode("utf-8").to_numpy()
+            if name in strings
+            else X_test[name].to_numpy()
+        )
+        for name in X_test.columns
+    }
+    X_encoded = encoder.transform(X_test)
+    assert X_encoded.flags.c_contiguous and X_encoded.dtype == np.float32
+    assert np.array_equal(
+        X_encoded, column_transformer.transform(X_test).to_numpy(dtype=np.float32)
+    ), "The encoder differs from the pipeline's one!"
+    assert np.array_equal(X_encoded, encoder.transform(triton_batch))
+    assert np.array_equal(X_encoded, encode_with_categorical(encoder, X_test))
+
+    def decode_with_char(batch: Dict[str, np.ndarray]) -> None:
+        for name in strings:
+            np.char.decode(batch[name].astype(np.bytes_), "utf-8")
+
+    paths: Dict[str, Callable] = {
+        "before: ColumnTransformer": column_transformer.transform,
+        "before: pd.Categorical": lambda X: encode_with_categorical(encoder, X),
+        "before: catboost.Pool": lambda X: Pool(X, cat_features=categorical_features),
+        "before: np.char.decode": decode_with_char,
+        "after: FeatureEncoder": encoder.transform,
+        "after: FeatureEncoder on bytes": encoder.transform,
+    }
+    print(f"{'batch':>6} {'path':>32} {'p50, us':>10} {'p99, us':>10}")
+    for batch_size in batch_sizes:
+        X_batch = X_test.iloc[:batch_size]
+        triton_sample = {
+            name: column[:batch_size] for name, column in triton_batch.items()
+        }
+        for path, encode in paths.items():
+            is_triton = "bytes" in path or "decode" in path
+            latencies = measure_latencies(
+                encode, triton_sample if is_triton else X_batch, n_repeats
+            )
+            print(
+                f"{batch_size:>6} {path:>32} "
+                f"{np.percentile(latencies, 50):>10.1f} {np.percentile(latencies, 99):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_encoding)
@@ -0,0 +1,158 @@
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import fire
+import numpy as np
+import pandas as pd
+from omegaconf import OmegaConf
+
+from ..data.prepare_dataset import load_dataset
+from ..models.encoder import FeatureEncoder
+from ..models.random_forest import RandomForest
+
+
+# The continuous features of every copy of the train split but the first are jittered
+# by this fraction of their standard deviation, like in `benchmarks.regression`
+JITTER = 0.01
+
+
+class MappedSplit:
+    """Stands for the `PreparedSplit` of the copies, only maps their encoded matrix."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def get_encoded(self, encoder: FeatureEncoder) -> np.ndarray:
+        return np.load(self.path, mmap_mode="r")
+
+
+def prepare(copies: int, tmp_dir: str) -> None:
+    """Saves the copies of the train split as a frame, as encoded and their target."""
+    X, y, numerical_features, categorical_features = load_dataset(split="train")
+    encoder = FeatureEncoder.fit(X, numerical_features, categorical_features)
+    rng = np.random.default_rng(0)
+    X_copies = [X]
+    for _ in range(copies - 1):
+        X_copy = X.copy()
+        for name in ["temp", "feel_temp", "humidity", "windspeed"]:
+            noise = rng.normal(0, JITTER * X[name].std(), len(X))
+            X_copy[name] = (X[name] + noise).astype(X[name].dtype)
+        X_copies.append(X_copy)
+    X = pd.concat(X_copies, ignore_index=True)
+    X.to_parquet(os.path.join(tmp_dir, "X.parquet"))
+    np.save(os.path.join(tmp_dir, "X.encoded.npy"), encoder.transform(X))
+    np.save(os.path.join(tmp_dir, "y.npy"), np.tile(y.to_numpy(), copies))
+
+
+def measure(
+    case: str, hyperparams: Dict[str, Any], tmp_dir: str
+) -> Tuple[float, float, int, float]:
+    """
+    Returns the time of fitting the forest of `case`, the RSS growth, the number of the
+    nodes of the trees and the R2 on the test split.
+    """
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import r2_score
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import OrdinalEncoder
+
+    X_test, y_test, numerical_features, categorical_features = load_dataset(split="test")
+    y = pd.Series(np.load(os.path.join(tmp_dir, "y.npy")))
+    if case == "pipeline":
+        # How the Random Forest was trained before the prepared splits
+        X = pd.read_parquet(os.path.join(tmp_dir, "X.parquet"))
+        model = make_pipeline(
+            ColumnTransformer(
+                transformers=[
+                    ("cat", OrdinalEncoder(dtype=np.int64), categorical_features),
+                    ("num", "passthrough", numerical_features),
+                ],
+            ),
+            RandomForestRegressor(**hyperparams),
+        )
+        forest = model.named_steps["randomforestregressor"]
+    else:
+        X = pd.read_parquet(os.path.join(tmp_dir, "X.parquet")).iloc[:1]
+        cfg = OmegaConf.create({"model": {"name": "rf", "hyperparams": hyperparams}})
+        model = RandomForest(cfg, numerical_features, categorical_features)
+        model.encoder = FeatureEncoder.fit(
+            load_dataset(split="train")[0], numerical_features, categorical_features
+        )
+        forest = model.model.named_steps["randomforestregressor"]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    if case == "pipeline":
+        model.fit(X, y)
+    else:
+        model.train(X, y, prepared=MappedSplit(os.path.join(tmp_dir, "X.encoded.npy")))
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    n_nodes = sum(tree.tree_.node_count for tree in forest.estimators_)
+    r2 = r2_score(y_test, model.predict(X_test) if case == "pipeline" else model(X_test))
+    return elapsed, rss_after - rss_before, n_nodes, r2
+
+
+def benchmark_forest_training(
+    n_copies: Tuple[int, ...] = (1, 10),
+    n_estimators: int = 20,
+    n_jobs: int = -1,
+    max_samples: Optional[float] = 0.1,
+    max_bins: Optional[int] = 255,
+) -> None:
+    """
+    Compares the fit time and the peak RSS of the Random Forest trained as before, by
+    its pipeline on the frame, with training on the prepared float32 matrix, as is and
+    with the per-tree samples limited and the features binned. The train split is tiled
+    `n_copies` times with its continuous features jittered, as the data of several years
+    would have many more distinct values. Every fit runs in a fresh process, so that the
+    peak RSS isn't shared.
+
+    Parameters
+    ----------
+    n_copies : Tuple[int, ...]
+        The sizes of the data in copies of the train split.
+    n_estimators : int
+        The number of trees.
+    n_jobs : int
+        The number of threads building the trees.
+    max_samples : float, optional
+        The rows drawn for each tree in the lean training.
+    max_bins : int, optional
+        The maximum number of bins per feature in the lean training.
+    """
+    n_copies = [n_copies] if isinstance(n_copies, int) else n_copies
+    hyperparams = {"n_estimators": n_estimators, "random_state": 0, "n_jobs": n_jobs}
+    cases = {
+        "pipeline": hyperparams,
+        "encoded": hyperparams,
+        "lean": {**hyperparams, "max_samples": max_samples, "max_bins": max_bins},
+    }
+    ctx = mp.get_context("spawn")
+    print(
+        f"{'rows':>9} {'case':>9} {'fit, s':>8} {'RSS growth, MiB':>16} {'nodes':>9} "
+        f"{'test R2':>8}"
+    )
+    for copies in n_copies:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with ctx.Pool(1) as pool:
+                pool.apply(prepare, (copies, tmp_dir))
+            n_rows = len(np.load(os.path.join(tmp_dir, "y.npy"), mmap_mode="r"))
+            for case, params in cases.items():
+                with ctx.Pool(1) as pool:
+                    elapsed, rss_growth, n_nodes, r2 = pool.apply(
+                        measure, (case, params, tmp_dir)
+                    )
+                print(
+                    f"{n_rows:>9} {case:>9} {elapsed:>8.2f} {rss_growth:>16.1f} "
+                    f"{n_nodes:>9} {r2:>8.4f}"
+                )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_forest_training)
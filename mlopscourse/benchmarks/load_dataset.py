@@ -0,0 +1,51 @@
+import multiprocessing as mp
+import resource
+import time
+from typing import Tuple
+
+import fire
+
+from ..data.prepare_dataset import load_dataset
+
+
+def measure_load(split: str, use_cache: bool) -> Tuple[float, float, float]:
+    """Returns the load time and the peak RSS in MiB before and after the load."""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    X, _, _, _ = load_dataset(split, use_cache=use_cache)
+    # Touch every column, since a memory-mapped cache is loaded lazily
+    X.sum(numeric_only=True)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, rss_before, rss_after
+
+
+def benchmark_load(split: str = "train", n_repeats: int = 5) -> None:
+    """
+    Compares loading the split from the CSV with loading it from the Arrow cache.
+
+    Every load runs in a fresh process, so that the peak RSS isn't shared.
+
+    Parameters
+    ----------
+    split : str
+        The split to load.
+    n_repeats : int
+        The number of loads per path.
+    """
+    load_dataset(split)  # Make sure the cache is fresh
+    ctx = mp.get_context("spawn")
+    print(f"{'path':>6} {'time, ms':>10} {'peak RSS, MiB':>14} {'RSS growth, MiB':>16}")
+    for path, use_cache in [("csv", False), ("arrow", True)]:
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            results = [
+                pool.apply(measure_load, (split, use_cache)) for _ in range(n_repeats)
+            ]
+        elapsed = min(result[0] for result in results)
+        rss_after = min(result[2] for result in results)
+        rss_growth = min(result[2] - result[1] for result in results)
+        print(f"{path:>6} {elapsed * 1e3:>10.1f} {rss_after:>14.1f} {rss_growth:>16.1f}")
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_load)
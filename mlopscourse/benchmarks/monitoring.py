@@ -0,0 +1,83 @@
+from typing import List
+
+import fire
+import numpy as np
+from scipy.stats import ks_2samp
+
+from ..data.prepare_dataset import load_dataset
+from ..models.models_zoo import load_checkpoint
+from ..monitoring import FeatureSketches, compute_drift
+from .predict_latency import measure_latencies
+
+
+def benchmark_monitoring(
+    checkpoint_name: str = "cb_model",
+    batch_sizes: List[int] = (1, 64, 1024),
+    n_repeats: int = 200,
+    compiled: bool = False,
+) -> None:
+    """
+    Checks the sketches against the exact statistics of the test split and compares
+    the latency of sketching a batch with predicting on it.
+
+    Parameters
+    ----------
+    checkpoint_name : str
+        The name of the checkpoint in the `checkpoints/` directory, which must have the
+        reference profile.
+    batch_sizes : List[int]
+        The batch sizes to measure the latency for.
+    n_repeats : int
+        The number of measurements per batch size and path.
+    compiled : bool
+        Whether to compile the model.
+    """
+    X_train, _, _, _ = load_dataset(split="train")
+    X_test, _, _, _ = load_dataset(split="test")
+    model = load_checkpoint(f"checkpoints/{checkpoint_name}")
+    assert model.profile is not None, "The checkpoint has no reference profile!"
+    if compiled:
+        model.compile()
+    reference = model.profile
+
+    # The train split against its own sketches drifts nowhere
+    scores = compute_drift(reference, FeatureSketches.fit(X_train, model.encoder))
+    assert all(feature["psi"] < 1e-9 for feature in scores.values())
+
+    sketches = reference.empty_like()
+    for start in range(0, len(X_test), 1000):
+        sketches.update(X_test.iloc[start : start + 1000])
+    scores = compute_drift(reference, sketches)
+    print(f"{'feature':>10} {'PSI':>7} {'KS':>7} {'exact KS':>9}")
+    for name in reference.edges:
+        values = X_test[name].to_numpy(dtype=np.float64)
+        # The moments merged batch by batch are those of the whole split
+        assert np.isclose(scores[name]["mean"], values.mean())
+        assert np.isclose(scores[name]["std"], values.std())
+        assert scores[name]["min"] == values.min() and scores[name]["max"] == values.max()
+        # KS is taken at the edges of the bins only, so it may miss up to a bin's mass
+        exact_ks = ks_2samp(X_train[name], X_test[name]).statistic
+        assert scores[name]["ks"] <= exact_ks + 1e-6
+        assert exact_ks - scores[name]["ks"] < 0.02
+        print(
+            f"{name:>10} {scores[name]['psi']:>7.4f} {scores[name]['ks']:>7.4f} "
+            f"{exact_ks:>9.4f}"
+        )
+    # A warmer test split must drift
+    sketches = reference.empty_like()
+    sketches.update(X_test.assign(temp=X_test["temp"] + 5))
+    assert compute_drift(reference, sketches)["temp"]["psi"] > 0.2
+
+    print(f"{'batch':>6} {'predict p50, us':>16} {'sketch p50, us':>15} {'added':>7}")
+    for batch_size in batch_sizes:
+        X_batch = X_test.iloc[:batch_size]
+        predict = np.percentile(measure_latencies(model, X_batch, n_repeats), 50)
+        sketch = np.percentile(measure_latencies(sketches.update, X_batch, n_repeats), 50)
+        print(
+            f"{batch_size:>6} {predict:>16.1f} {sketch:>15.1f} "
+            f"{sketch / predict:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_monitoring)
@@ -0,0 +1,49 @@
+import os
+import time
+from typing import Optional
+
+import fire
+import pandas as pd
+
+from ..data.prepare_dataset import load_dataset
+from ..parallel_scoring import score_in_parallel
+
+
+def benchmark_scaling(
+    checkpoint_name: str = "cb_model",
+    max_workers: Optional[int] = None,
+    partition_size: Optional[int] = None,
+    n_copies: int = 20,
+) -> None:
+    """
+    Measures the throughput of the parallel scoring from 1 to `max_workers` processes.
+
+    Parameters
+    ----------
+    checkpoint_name : str
+        The name of the checkpoint in the `checkpoints/` directory.
+    max_workers : int, optional
+        The maximum number of workers, the number of cores by default.
+    partition_size : int, optional
+        The number of rows scored by a worker at once, the rows are split evenly
+        between the workers by default.
+    n_copies : int
+        The number of copies of the test split to score, so that the pool start is
+        amortized.
+    """
+    X_test, _, _, _ = load_dataset(split="test")
+    X = pd.concat([X_test] * n_copies, ignore_index=True)
+    max_workers = max_workers or os.cpu_count()
+
+    print(f"{'workers':>8} {'rows/sec':>12} {'speedup':>8}")
+    base_throughput = None
+    for n_workers in range(1, max_workers + 1):
+        start = time.perf_counter()
+        score_in_parallel(f"checkpoints/{checkpoint_name}", X, n_workers, partition_size)
+        throughput = len(X) / (time.perf_counter() - start)
+        base_throughput = base_throughput or throughput
+        print(f"{n_workers:>8} {throughput:>12.0f} {throughput / base_throughput:>8.2f}")
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_scaling)
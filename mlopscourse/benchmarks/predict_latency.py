@@ -0,0 +1,57 @@
+import time
+from typing import Callable, List
+
+import fire
+import numpy as np
+
+from ..data.prepare_dataset import load_dataset
+from ..models.models_zoo import load_checkpoint
+
+
+def measure_latencies(predict: Callable, sample, n_repeats: int) -> np.ndarray:
+    predict(sample)  # Warm up
+    latencies = np.empty(n_repeats)
+    for i in range(n_repeats):
+        start = time.perf_counter()
+        predict(sample)
+        latencies[i] = time.perf_counter() - start
+    return latencies * 1e6
+
+
+def benchmark_predict(
+    checkpoint_name: str = "cb_model",
+    batch_sizes: List[int] = (1, 8, 64, 512),
+    n_repeats: int = 200,
+) -> None:
+    """
+    Compares the latency of `BaseModel.__call__` with the `predict_array` fast path.
+
+    Parameters
+    ----------
+    checkpoint_name : str
+        The name of the checkpoint in the `checkpoints/` directory.
+    batch_sizes : List[int]
+        The batch sizes to measure the latency for.
+    n_repeats : int
+        The number of predictions per batch size.
+    """
+    X_test, _, _, _ = load_dataset(split="test")
+    model = load_checkpoint(f"checkpoints/{checkpoint_name}")
+
+    print(f"{'batch':>6} {'path':>14} {'p50, us':>10} {'p99, us':>10}")
+    for batch_size in batch_sizes:
+        X_batch = X_test.iloc[:batch_size]
+        record_batch = {name: X_batch[name].to_numpy() for name in X_batch.columns}
+        for path, predict, sample in [
+            ("__call__", model, X_batch),
+            ("predict_array", model.predict_array, record_batch),
+        ]:
+            latencies = measure_latencies(predict, sample, n_repeats)
+            print(
+                f"{batch_size:>6} {path:>14} "
+                f"{np.percentile(latencies, 50):>10.1f} {np.percentile(latencies, 99):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_predict)
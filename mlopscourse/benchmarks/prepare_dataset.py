@@ -0,0 +1,91 @@
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+import fire
+import pandas as pd
+
+from ..data.prepare_dataset import RAW_PATH, prepare_dataset
+from ..data.streaming import iter_chunks
+
+
+def make_extract(raw_path: str, path: str, n_copies: int, chunk_size: int) -> int:
+    """
+    Writes `n_copies` of the raw dataset one after another with the years shifted, like
+    an extract of several more years. Returns the number of rows.
+    """
+    n_years = int(pd.read_csv(raw_path, usecols=["year"])["year"].max()) + 1
+    n_rows = 0
+    for copy in range(n_copies):
+        for chunk in iter_chunks(raw_path, chunk_size, index_col=None):
+            chunk["year"] += copy * n_years
+            chunk.to_csv(
+                path, mode="w" if n_rows == 0 else "a", header=n_rows == 0, index=False
+            )
+            n_rows += len(chunk)
+    return n_rows
+
+
+def measure_prepare(raw_path: str, chunk_size: int) -> Tuple[float, float, float]:
+    """Returns the preparation time and the peak RSS in MiB before and after it."""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        prepare_dataset(raw_path, output_dir, chunk_size, print_info=False)
+        elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, rss_before, rss_after
+
+
+def benchmark_prepare(
+    raw_path: str = RAW_PATH,
+    n_copies: Tuple[int, ...] = (16, 64),
+    chunk_size: int = 100_000,
+    max_rss_growth_mb: float = 50.0,
+) -> None:
+    """
+    Prepares extracts of growing size and checks that the memory used stays bounded.
+
+    Every preparation runs in a fresh process, so that the peak RSS isn't shared. The
+    benchmark exits with 1 if the peak RSS of the largest extract exceeds the one of the
+    smallest by more than `max_rss_growth_mb`.
+
+    Parameters
+    ----------
+    raw_path : str
+        The raw dataset to make the extracts of.
+    n_copies : Tuple[int, ...]
+        The sizes of the extracts in copies of the raw dataset, each should take
+        several chunks.
+    chunk_size : int
+        The number of rows processed at once.
+    max_rss_growth_mb : float
+        The allowed growth of the peak RSS from the smallest to the largest extract.
+    """
+    ctx = mp.get_context("spawn")
+    print(f"{'rows':>10} {'time, s':>8} {'rows/sec':>10} {'peak RSS, MiB':>14}")
+    peak_rss = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for copies in n_copies:
+            extract_path = os.path.join(tmp_dir, "extract.csv")
+            n_rows = make_extract(raw_path, extract_path, copies, chunk_size)
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                elapsed, _, rss_after = pool.apply(
+                    measure_prepare, (extract_path, chunk_size)
+                )
+            peak_rss.append(rss_after)
+            print(
+                f"{n_rows:>10} {elapsed:>8.2f} {n_rows / elapsed:>10.0f} {rss_after:>14.1f}"
+            )
+
+    if peak_rss[-1] - peak_rss[0] > max_rss_growth_mb:
+        print(f"The peak RSS grew by more than {max_rss_growth_mb} MiB")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_prepare)
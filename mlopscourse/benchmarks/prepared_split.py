@@ -0,0 +1,104 @@
+import multiprocessing as mp
+import os
+import resource
+import tempfile
+import time
+from typing import Tuple
+
+import fire
+import numpy as np
+import pandas as pd
+
+from ..data.prepare_dataset import load_dataset
+from ..models.encoder import FeatureEncoder
+
+
+def load_copies(copies: int) -> Tuple[pd.DataFrame, pd.Series, FeatureEncoder]:
+    X, y, numerical_features, categorical_features = load_dataset(split="train")
+    encoder = FeatureEncoder.fit(X, numerical_features, categorical_features)
+    X = pd.concat([X] * copies, ignore_index=True)
+    y = pd.concat([y] * copies, ignore_index=True)
+    return X, y, encoder
+
+
+def prepare(copies: int, tmp_dir: str) -> None:
+    """Saves the artifacts of `PreparedSplit` for the train split tiled `copies` times."""
+    from catboost import Pool
+
+    X, y, encoder = load_copies(copies)
+    pool = Pool(X, y, cat_features=encoder.categorical_features)
+    pool.quantize()
+    pool.save(os.path.join(tmp_dir, "train.quantized"))
+    np.save(os.path.join(tmp_dir, "train.encoded.npy"), encoder.transform(X))
+
+
+def measure(case: str, copies: int, tmp_dir: str) -> Tuple[float, float, int]:
+    """
+    Returns the time of preparing the training data of `case`, the RSS growth and the
+    number of rows.
+    """
+    from catboost import Pool
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import OrdinalEncoder
+    from sklearn.utils import check_array
+
+    X, y, encoder = load_copies(copies)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    if case == "cb, frame":
+        # CatBoost quantizes a raw pool when it starts fitting
+        Pool(X, y, cat_features=encoder.categorical_features).quantize()
+    elif case == "cb, prepared":
+        Pool(f"quantized://{os.path.join(tmp_dir, 'train.quantized')}")
+    elif case == "rf, frame":
+        preprocessor = ColumnTransformer(
+            transformers=[
+                ("cat", OrdinalEncoder(dtype=np.int64), encoder.categorical_features),
+                ("num", "passthrough", encoder.numerical_features),
+            ],
+        )
+        # The forest casts the float64 output of the pipeline to float32
+        check_array(preprocessor.fit_transform(X), dtype=np.float32)
+    else:
+        X_encoded = np.load(os.path.join(tmp_dir, "train.encoded.npy"), mmap_mode="r")
+        check_array(X_encoded, dtype=np.float32).sum()
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, rss_after - rss_before, len(X)
+
+
+def benchmark_prepared(
+    n_copies: Tuple[int, ...] = (1, 10, 100), n_repeats: int = 3
+) -> None:
+    """
+    Compares preparing the training data of each model from the frame, as every run did
+    before, with loading the artifacts of `PreparedSplit`, on the train split tiled
+    `n_copies` times. Every measurement runs in a fresh process, so that the peak RSS
+    isn't shared.
+
+    Parameters
+    ----------
+    n_copies : Tuple[int, ...]
+        The sizes of the data in copies of the train split.
+    n_repeats : int
+        The number of measurements per case, the fastest one is reported.
+    """
+    n_copies = [n_copies] if isinstance(n_copies, int) else n_copies
+    ctx = mp.get_context("spawn")
+    print(f"{'rows':>9} {'case':>13} {'time, s':>8} {'RSS growth, MiB':>16}")
+    for copies in n_copies:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with ctx.Pool(1) as pool:
+                pool.apply(prepare, (copies, tmp_dir))
+            for case in ["cb, frame", "cb, prepared", "rf, frame", "rf, prepared"]:
+                with ctx.Pool(1, maxtasksperchild=1) as pool:
+                    results = [
+                        pool.apply(measure, (case, copies, tmp_dir))
+                        for _ in range(n_repeats)
+                    ]
+                elapsed, rss_growth, n_rows = min(results)
+                print(f"{n_rows:>9} {case:>13} {elapsed:>8.3f} {rss_growth:>16.1f}")
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_prepared)
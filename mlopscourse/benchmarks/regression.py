@@ -0,0 +1,349 @@
+import contextlib
+import glob
+import importlib.metadata
+import json
+import multiprocessing as mp
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import fire
+import numpy as np
+
+from ..utils import get_git_revision_hash
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CONFIG_DIR = os.path.join(REPO_DIR, "configs")
+MODELS = ["rf", "cb"]
+# The copies of the splits are jittered by this part of the std of each continuous
+# feature, so that the scaled-up data isn't the same rows over and over
+JITTER = 0.01
+SEED = 0
+# The versions recorded with the results, since an upgrade may explain a change
+PACKAGES = ["numpy", "pandas", "scikit-learn", "catboost", "onnxruntime", "mlflow"]
+
+# The metrics of one scale of the data, e.g. "train.rf_sec" or "predict.cb.b64.p50_us".
+# The ones ending in "R2" regress downwards, the timings upwards.
+Metrics = Dict[str, float]
+
+
+def synthesize_splits(workspace: str, scale: int) -> None:
+    """
+    Writes `scale` copies of the train and the test splits into the data directory of
+    the `workspace`. Every copy but the first has its continuous features jittered
+    within their range, with a fixed seed.
+    """
+    import pandas as pd
+
+    from ..data.prepare_dataset import DATA_DIR, NUMERICAL_FEATURES
+
+    os.makedirs(os.path.join(workspace, DATA_DIR), exist_ok=True)
+    rng = np.random.default_rng(SEED)
+    for split in ["train", "test"]:
+        X = pd.read_csv(
+            os.path.join(REPO_DIR, DATA_DIR, f"{split}_split.csv"), index_col=0
+        )
+        copies = [X]
+        for _ in range(scale - 1):
+            copy = X.copy()
+            for name in NUMERICAL_FEATURES:
+                values = X[name].to_numpy(dtype=np.float64)
+                noise = rng.normal(0, JITTER * values.std(), len(values))
+                copy[name] = np.clip(values + noise, values.min(), values.max()).round(4)
+            copies.append(copy)
+        X = pd.concat(copies) if scale > 1 else X
+        if scale > 1:
+            X = X.reset_index(drop=True)
+        X.to_csv(os.path.join(workspace, DATA_DIR, f"{split}_split.csv"))
+
+
+def read_trace(path: str, prefix: str) -> Metrics:
+    """
+    Returns the wall time of the stages of a command, the top-level spans of its trace,
+    and of the rest of the command, which no span covers.
+    """
+    with open(path) as f:
+        trace = json.load(f)
+    metrics = {
+        f"{prefix}.{span_path.split('/')[1]}_sec": span["wall_sec"]
+        for span_path, span in trace["spans"].items()
+        if span_path.count("/") == 1
+    }
+    metrics[f"{prefix}.other_sec"] = trace["spans"][trace["command"]]["wall_sec"] - sum(
+        metrics.values()
+    )
+    return metrics
+
+
+def measure_scale(
+    workspace: str, n_repeats: int, batch_sizes: Tuple[int, ...]
+) -> Metrics:
+    """
+    Runs the suite in the `workspace` holding the synthesized splits. The commands save
+    their checkpoints, runs and traces there too and print into its `suite.log`.
+    """
+    from hydra import initialize_config_dir
+    from sklearn.metrics import r2_score
+
+    from ..data.prepare_dataset import load_dataset
+    from ..infer import Inferencer
+    from ..models.models_zoo import load_checkpoint
+    from ..train import Trainer
+    from .load_dataset import measure_load
+    from .predict_latency import measure_latencies
+
+    os.chdir(workspace)
+    metrics = dict()
+    # The first loads write the Arrow caches
+    load_dataset(split="train")
+    X_test, y_test, _, _ = load_dataset(split="test")
+    for path, use_cache in [("csv", False), ("cache", True)]:
+        metrics[f"load_dataset.{path}_sec"] = min(
+            measure_load("train", use_cache)[0] for _ in range(n_repeats)
+        )
+
+    # The stages are read from the traces of the commands
+    overrides = {
+        "logging.mlflow.tracking_uri": f"file://{workspace}/mlruns",
+        "profiling.enabled": "true",
+    }
+    for model_name in MODELS:
+        with open("suite.log", "a") as log, contextlib.redirect_stdout(
+            log
+        ), initialize_config_dir(config_dir=CONFIG_DIR, version_base="1.3"):
+            for command, runner in [("train", Trainer), ("infer", Inferencer)]:
+                start = time.perf_counter()
+                getattr(runner(f"{model_name}_config", **overrides), command)()
+                metrics[f"{command}.{model_name}_sec"] = time.perf_counter() - start
+                metrics.update(
+                    read_trace(
+                        f"traces/{command}-{model_name}.json", f"{command}.{model_name}"
+                    )
+                )
+
+        path = f"checkpoints/{model_name}_model"
+        model = load_checkpoint(path)
+        model.cfg.training.checkpoint_format = "pickle"
+        model.save_checkpoint("checkpoints/")
+        for checkpoint_format, checkpoint_path in [
+            ("pickle", path + ".p"),
+            ("native", path),
+        ]:
+            load_times = list()
+            for _ in range(n_repeats):
+                start = time.perf_counter()
+                load_checkpoint(checkpoint_path)
+                load_times.append(time.perf_counter() - start)
+            metrics[f"load_checkpoint.{model_name}.{checkpoint_format}_sec"] = min(
+                load_times
+            )
+
+        metrics[f"quality.{model_name}.R2"] = r2_score(y_test, model(X_test))
+        for batch_size in batch_sizes:
+            latencies = measure_latencies(model, X_test.iloc[:batch_size], n_repeats)
+            for percentile in [50, 99]:
+                metrics[f"predict.{model_name}.b{batch_size}.p{percentile}_us"] = float(
+                    np.percentile(latencies, percentile)
+                )
+    return metrics
+
+
+def get_environment() -> Dict[str, Any]:
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    for package in PACKAGES:
+        try:
+            environment[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            environment[package] = None
+    return environment
+
+
+def is_regression(
+    name: str,
+    old: float,
+    new: float,
+    threshold: float,
+    min_sec: float,
+    min_us: float,
+    r2_drop: float,
+) -> bool:
+    if name.endswith("R2"):
+        return old - new > r2_drop
+    # The short stages and latencies are too noisy to be flagged
+    min_value = min_us if name.endswith("_us") else min_sec
+    return old > 0 and (new - old) / old > threshold and max(old, new) >= min_value
+
+
+def compare_results(
+    baseline: str,
+    candidate: str,
+    threshold: float = 0.2,
+    min_sec: float = 0.05,
+    min_us: float = 50,
+    r2_drop: float = 0.01,
+) -> None:
+    """
+    Compares the results of the suite at two commits, prints the changed metrics and
+    exits with 1 if any of them regressed.
+
+    Parameters
+    ----------
+    baseline : str
+        The path to the results to compare with.
+    candidate : str
+        The path to the new results.
+    threshold : float
+        The relative growth of a timing considered a regression.
+    min_sec : float
+        The timings in seconds below this value in both results are too noisy to be
+        flagged.
+    min_us : float
+        The same for the latencies in microseconds.
+    r2_drop : float
+        The drop of R2 considered a regression.
+    """
+    results = list()
+    for path in [baseline, candidate]:
+        with open(path) as f:
+            results.append(json.load(f))
+    print(f"Comparing {results[0]['commit_id']} -> {results[1]['commit_id']}")
+    for key in ["platform", "cpu_count"]:
+        if results[0]["environment"][key] != results[1]["environment"][key]:
+            print(f"WARNING: the results come from different machines ({key})")
+
+    n_regressions = 0
+    print(f"{'scale':>5} {'metric':<42} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for scale, metrics in results[1]["scales"].items():
+        old_metrics = results[0]["scales"].get(scale, dict())
+        for name, new in metrics.items():
+            old = old_metrics.get(name)
+            if old is None:
+                continue
+            regressed = is_regression(name, old, new, threshold, min_sec, min_us, r2_drop)
+            n_regressions += regressed
+            change = (new - old) / old if old else 0.0
+            if regressed or abs(change) > threshold:
+                print(
+                    f"{scale:>5} {name:<42} {old:>12.4g} {new:>12.4g} {change:>+8.1%}"
+                    + (" REGRESSION" if regressed else "")
+                )
+    if n_regressions > 0:
+        print(f"{n_regressions} metrics regressed by more than the thresholds")
+        sys.exit(1)
+
+
+def find_baseline(output_dir: str, commit_id: str, scales: List[str]) -> Optional[str]:
+    """Returns the latest results of another commit covering the same scales."""
+    candidates = list()
+    for path in glob.glob(os.path.join(output_dir, "*.json")):
+        with open(path) as f:
+            results = json.load(f)
+        if results["commit_id"] != commit_id and set(scales) <= set(results["scales"]):
+            candidates.append((results["created_at"], path))
+    return max(candidates)[1] if candidates else None
+
+
+def run_suite(
+    scales: Tuple[int, ...] = (1, 10, 100),
+    n_repeats: int = 5,
+    batch_sizes: Tuple[int, ...] = (1, 64, 1024),
+    output_dir: str = "benchmark_results",
+    workspace_dir: Optional[str] = None,
+    baseline: Optional[str] = None,
+    threshold: float = 0.2,
+) -> None:
+    """
+    Runs the end-to-end benchmarks on the dataset scaled up by each of `scales`, saves
+    the results to `<output_dir>/<commit_id>.json` and exits with 1 if a metric
+    regressed against the baseline.
+
+    Each scale is measured in a fresh process in a workspace of its own with the
+    synthesized splits: the load of the train split from the CSV and from the cache,
+    the training and the inference of each model with MLflow logging to a local file
+    store and the stages of both from their traces, the load of the native and the
+    pickled checkpoints, R2 on the test split and the latency per batch size.
+
+    Parameters
+    ----------
+    scales : Tuple[int, ...]
+        The sizes of the data in copies of the splits.
+    n_repeats : int
+        The number of measurements of the fast metrics, the best one is reported for
+        the loads.
+    batch_sizes : Tuple[int, ...]
+        The batch sizes to measure the latency for.
+    output_dir : str
+        The directory of the results.
+    workspace_dir : str, optional
+        The directory of the workspaces, a temporary one by default.
+    baseline : str, optional
+        The results to compare with, the latest of another commit covering the same
+        scales by default.
+    threshold : float
+        The relative growth of a timing considered a regression.
+    """
+    # A single value comes from the command line as is
+    scales = [scales] if isinstance(scales, int) else scales
+    batch_sizes = [batch_sizes] if isinstance(batch_sizes, int) else batch_sizes
+    commit_id = get_git_revision_hash()
+    dirty = (
+        subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=REPO_DIR).returncode != 0
+    )
+    results = {
+        "commit_id": commit_id,
+        "dirty": dirty,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": get_environment(),
+        "settings": {"n_repeats": n_repeats, "batch_sizes": list(batch_sizes)},
+        "scales": dict(),
+    }
+    if dirty:
+        print("WARNING: the working tree has uncommitted changes")
+    workspace_dir = workspace_dir or os.path.join(
+        tempfile.gettempdir(), "mlopscourse-benchmarks"
+    )
+    ctx = mp.get_context("spawn")
+    for scale in scales:
+        workspace = os.path.abspath(os.path.join(workspace_dir, f"scale_{scale}"))
+        # Nothing is reused from the previous runs
+        shutil.rmtree(workspace, ignore_errors=True)
+        print(f"Synthesizing {scale}x the splits in {workspace}...")
+        synthesize_splits(workspace, scale)
+        print(f"Running the suite at {scale}x, see {workspace}/suite.log...")
+        with ctx.Pool(1, maxtasksperchild=1) as pool:
+            metrics = pool.apply(
+                measure_scale, (workspace, n_repeats, tuple(batch_sizes))
+            )
+        results["scales"][str(scale)] = metrics
+        for name, value in metrics.items():
+            print(f"{scale:>5} {name:<42} {value:>12.4g}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{commit_id}.json")
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"The results are saved to {output_path}")
+
+    if baseline is None:
+        baseline = find_baseline(output_dir, commit_id, list(results["scales"]))
+        if baseline is None:
+            print("No results of another commit to compare with")
+            return
+    elif not baseline.endswith(".json"):
+        # A commit id
+        baseline = os.path.join(output_dir, f"{baseline}.json")
+    compare_results(baseline, output_path, threshold)
+
+
+if __name__ == "__main__":
+    fire.Fire({"run": run_suite, "compare": compare_results})
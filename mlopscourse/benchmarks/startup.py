@@ -0,0 +1,139 @@
+import subprocess
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+import fire
+
+
+# The imports done by each subcommand before it gets to work, the modules it must
+# not import and the budget of its import time in seconds
+LOAD_MODEL = (
+    "from omegaconf import OmegaConf; "
+    "from mlopscourse.models.models_zoo import prepare_model; "
+    "prepare_model(OmegaConf.load('configs/{}_config.yaml'), [], [])"
+)
+ONNX_MODULES = ["onnx", "onnxruntime", "skl2onnx"]
+STARTUP_CASES: Dict[str, Tuple[str, List[str], float]] = {
+    "cli": (
+        "import commands",
+        ["mlflow", "pandas", "sklearn", "catboost", "aiohttp"] + ONNX_MODULES,
+        0.5,
+    ),
+    "infer": (
+        "import commands, mlopscourse.infer",
+        ["mlflow", "sklearn", "catboost", "aiohttp"] + ONNX_MODULES,
+        1.5,
+    ),
+    "infer-cb": (
+        "import commands, mlopscourse.infer; " + LOAD_MODEL.format("cb"),
+        ["mlflow", "sklearn", "aiohttp"] + ONNX_MODULES,
+        2.5,
+    ),
+    "infer-rf": (
+        "import commands, mlopscourse.infer; " + LOAD_MODEL.format("rf"),
+        ["mlflow", "catboost", "aiohttp"] + ONNX_MODULES,
+        2.5,
+    ),
+    "serve": (
+        "import commands, mlopscourse.server",
+        ["mlflow", "sklearn", "catboost"] + ONNX_MODULES,
+        1.5,
+    ),
+    "train": (
+        "import commands, mlopscourse.train",
+        ["catboost", "sklearn.ensemble", "aiohttp"] + ONNX_MODULES,
+        4.0,
+    ),
+    "sweep": (
+        "import commands, mlopscourse.sweep",
+        ["catboost", "sklearn.ensemble", "aiohttp"] + ONNX_MODULES,
+        4.0,
+    ),
+    "cv": (
+        "import commands, mlopscourse.cross_validation",
+        ["catboost", "sklearn.ensemble", "aiohttp"] + ONNX_MODULES,
+        4.0,
+    ),
+}
+
+
+def measure_imports(code: str) -> Tuple[float, Dict[str, float]]:
+    """
+    Runs `code` in a fresh interpreter with `-X importtime` and returns the total
+    import time in seconds and the cumulative time of each imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total, modules = 0.0, dict()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        seconds = int(cumulative) / 1e6
+        # The nested imports are indented and already counted by their importers
+        if not name.startswith("  "):
+            total += seconds
+        modules[name.strip()] = seconds
+    return total, modules
+
+
+def find_forbidden(modules: Set[str], forbidden: List[str]) -> List[str]:
+    return sorted(
+        name
+        for name in forbidden
+        if any(module == name or module.startswith(f"{name}.") for module in modules)
+    )
+
+
+def benchmark_startup(
+    cases: Optional[List[str]] = None, repeat: int = 3, budget_scale: float = 1.0
+) -> None:
+    """
+    Measures the import time of the CLI subcommands and exits with 1 if a subcommand
+    imports a library it doesn't need or exceeds its import time budget.
+
+    Parameters
+    ----------
+    cases : List[str], optional
+        The cases of `STARTUP_CASES` to run, all of them by default.
+    repeat : int
+        The number of runs of each case, the fastest one is reported.
+    budget_scale : float
+        The factor of the import time budgets, e.g. for a slower machine.
+    """
+    n_failures = 0
+    print(f"{'case':<10} {'import_sec':>10} {'budget_sec':>10}  slowest imports")
+    for case in cases or list(STARTUP_CASES):
+        code, forbidden, budget = STARTUP_CASES[case]
+        runs = [measure_imports(code) for _ in range(repeat)]
+        total, modules = min(runs, key=lambda run: run[0])
+        budget *= budget_scale
+        slowest = sorted(
+            (name for name in modules if "." not in name and name != "commands"),
+            key=modules.get,
+            reverse=True,
+        )[:3]
+        print(
+            f"{case:<10} {total:>10.3f} {budget:>10.3f}  "
+            + ", ".join(f"{name} {modules[name]:.3f}" for name in slowest)
+        )
+        imported = find_forbidden(set(modules), forbidden)
+        if imported:
+            print(f"  REGRESSION: imports {', '.join(imported)}")
+            n_failures += 1
+        if total > budget:
+            print("  REGRESSION: exceeds the import time budget")
+            n_failures += 1
+
+    if n_failures > 0:
+        print(f"{n_failures} startup regressions")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_startup)
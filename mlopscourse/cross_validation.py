@@ -0,0 +1,249 @@
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import fire
+import mlflow
+import numpy as np
+from hydra import compose
+from omegaconf import DictConfig, OmegaConf
+from sklearn.metrics import mean_squared_error, r2_score
+
+from .data.prepare_dataset import load_dataset
+from .data.prepared import PreparedSplit
+from .mlflow_logger import MlflowLogger
+from .models.encoder import FeatureEncoder
+from .models.models_zoo import prepare_model
+from .parallel_scoring import create_shared_array
+from .profiling import Tracer, span, tracing
+from .sweep import QUIET_PARAMS, THREAD_COUNT_PARAMS
+from .utils import get_git_revision_hash
+
+
+# The end of the training rows, the start and the end of the validation rows of a fold
+Fold = Tuple[int, int, int]
+# The name of a shared array, its shape and its dtype
+ArraySpec = Tuple[str, Tuple[int, ...], str]
+
+# Filled by the initializer of each worker process
+_worker: Dict[str, Any] = dict()
+
+
+def get_time_series_folds(n_rows: int, n_folds: int, gap: int = 0) -> List[Fold]:
+    """
+    Splits the rows in the time order like sklearn's `TimeSeriesSplit`: the last
+    `n_folds` blocks of `n_rows // (n_folds + 1)` rows are validated in turn, each on a
+    model trained on all the rows before it but the last `gap` ones.
+    """
+    fold_size = n_rows // (n_folds + 1)
+    assert fold_size > gap, f"{n_rows} rows are too few for {n_folds} folds!"
+    folds = list()
+    for val_start in range(n_rows - n_folds * fold_size, n_rows, fold_size):
+        folds.append((val_start - gap, val_start, val_start + fold_size))
+    return folds
+
+
+def _init_worker(
+    cfg: Dict[str, Any],
+    encoder: FeatureEncoder,
+    prepared: PreparedSplit,
+    arrays: Dict[str, ArraySpec],
+) -> None:
+    _worker["cfg"] = OmegaConf.create(cfg)
+    _worker["encoder"] = encoder
+    # The artifacts are loaded once per worker and sliced per fold
+    _worker["prepared"] = prepared
+    _worker["blocks"] = list()
+    for name, (shm_name, shape, dtype) in arrays.items():
+        shm = SharedMemory(name=shm_name)
+        _worker["blocks"].append(shm)
+        _worker[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _fit_fold(fold: Fold) -> Dict[str, float]:
+    """Trains a model on the training rows of the fold and scores its validation rows."""
+    train_end, val_start, val_end = fold
+    cfg, encoder = _worker["cfg"], _worker["encoder"]
+    model = prepare_model(cfg, encoder.numerical_features, encoder.categorical_features)
+    model.encoder = encoder
+    start = time.perf_counter()
+    prepared = _worker["prepared"]
+    if cfg.model.name == "cb":
+        pool = prepared.get_pool(encoder.categorical_features, cfg.model.hyperparams)
+        # CatBoost can't predict on a quantized pool with categorical features, so the
+        # validation rows are scored as the evaluation set of the training
+        model.model.fit(
+            pool.slice(np.arange(train_end)),
+            eval_set=pool.slice(np.arange(val_start, val_end)),
+            use_best_model=False,
+        )
+        scores = model.model.get_evals_result()["validation"]
+        r2, rmse = scores["R2"][-1], scores["RMSE"][-1]
+    else:
+        # The slices of the memory-mapped matrix are views of the shared pages
+        X_encoded, y = prepared.get_encoded(encoder), _worker["y"]
+        forest = model.model.named_steps["randomforestregressor"]
+        forest.fit(X_encoded[:train_end], y[:train_end])
+        preds = forest.predict(X_encoded[val_start:val_end])
+        r2 = r2_score(y[val_start:val_end], preds)
+        rmse = mean_squared_error(y[val_start:val_end], preds) ** 0.5
+    return {
+        "n_train_rows": train_end,
+        "n_val_rows": val_end - val_start,
+        "R2": r2,
+        "RMSE": rmse,
+        "fit_time_sec": time.perf_counter() - start,
+    }
+
+
+class CrossValidator:
+    """
+    Cross-validates the chosen model on the train split, which is in the time order, with
+    the folds trained in parallel processes.
+
+    The data is preprocessed once for all the folds, and only once per version of the
+    split (see `PreparedSplit`): CatBoost gets the quantized pool, which every worker
+    loads once and slices, and the Random Forest gets the memory-mapped encoded matrix,
+    which the folds take views of.
+
+    Attributes
+    ----------
+    cfg : omegaconf.DictConfig
+        The configuration containing the model type and hyperparameters and the
+        cross-validation parameters.
+    """
+
+    def __init__(self, config_name: str, **kwargs: dict) -> None:
+        self.cfg: DictConfig = compose(
+            config_name=config_name, overrides=[f"{k}={v}" for k, v in kwargs.items()]
+        )
+        self.cfg.logging.commit_id = get_git_revision_hash()
+        print(OmegaConf.to_yaml(self.cfg))
+
+    def cross_validate(self) -> None:
+        assert self.cfg.model.name in THREAD_COUNT_PARAMS, (
+            f"The cross-validation supports only {list(THREAD_COUNT_PARAMS)}, "
+            f"not {self.cfg.model.name}!"
+        )
+        with tracing(self.cfg.profiling, "cross_validate", self.cfg.model.name) as tracer:
+            self._cross_validate(tracer)
+
+    def _cross_validate(self, tracer: Optional[Tracer]) -> None:
+        cv_cfg = self.cfg.cross_validation
+        start = time.perf_counter()
+        with span("load_dataset"):
+            (
+                X,
+                y,
+                numerical_features,
+                categorical_features,
+            ) = load_dataset(split="train")
+        folds = get_time_series_folds(len(X), cv_cfg.n_folds, cv_cfg.gap)
+        # Only the categories are fitted on all the rows, which leaks no target
+        with span("fit_encoder"):
+            encoder = FeatureEncoder.fit(X, numerical_features, categorical_features)
+
+        n_workers = min(cv_cfg.n_workers, len(folds))
+        threads_per_fold = cv_cfg.threads_per_fold or max(os.cpu_count() // n_workers, 1)
+        cfg = OmegaConf.to_container(self.cfg, resolve=True)
+        cfg["model"]["hyperparams"].update(QUIET_PARAMS[self.cfg.model.name])
+        cfg["model"]["hyperparams"][
+            THREAD_COUNT_PARAMS[self.cfg.model.name]
+        ] = threads_per_fold
+
+        blocks: List[SharedMemory] = list()
+        arrays: Dict[str, ArraySpec] = dict()
+        prepared = PreparedSplit("train")
+        try:
+            prepare_start = time.perf_counter()
+            if self.cfg.model.name == "cb":
+                # The borders of the features are unsupervised, so they are found on
+                # all the rows at once, and only once per version of the split
+                with span("quantize"):
+                    prepared.get_pool_path(
+                        categorical_features, cfg["model"]["hyperparams"]
+                    )
+            else:
+                with span("encode"):
+                    prepared.get_encoded_path(encoder)
+                    values = y.to_numpy(dtype=np.float64)
+                    shm, shared_values = create_shared_array(values.shape, values.dtype)
+                    shared_values[:] = values
+                    blocks.append(shm)
+                    arrays["y"] = (shm.name, values.shape, values.dtype.str)
+            prepare_time = time.perf_counter() - prepare_start
+            print(
+                f"Cross-validating the {self.cfg.model.name} model on {len(X)} rows "
+                f"with {len(folds)} folds, {n_workers} workers and "
+                f"{threads_per_fold} threads each..."
+            )
+            with span("fit_folds"), ProcessPoolExecutor(
+                max_workers=n_workers,
+                # Forking a process with running CatBoost or OpenMP threads may deadlock
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(cfg, encoder, prepared, arrays),
+            ) as executor:
+                # The largest folds are started first not to be the last ones
+                futures = {
+                    i: executor.submit(_fit_fold, folds[i])
+                    for i in reversed(range(len(folds)))
+                }
+                results = [futures[i].result() for i in range(len(folds))]
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+        wall_time = time.perf_counter() - start
+
+        print(f"{'fold':>4} {'train':>9} {'val':>8} {'R2':>8} {'RMSE':>9} {'fit, s':>8}")
+        for i, result in enumerate(results):
+            print(
+                f"{i:>4} {result['n_train_rows']:>9} {result['n_val_rows']:>8} "
+                f"{result['R2']:>8.4f} {result['RMSE']:>9.3f} "
+                f"{result['fit_time_sec']:>8.2f}"
+            )
+        summary = {
+            f"cv_{name}_{stat}": func([result[name] for result in results])
+            for name in ["R2", "RMSE"]
+            for stat, func in [("mean", np.mean), ("std", np.std)]
+        }
+        summary["preprocessing_time_sec"] = prepare_time
+        summary["wall_time_sec"] = wall_time
+        print(
+            f"R2 {summary['cv_R2_mean']:.4f} +- {summary['cv_R2_std']:.4f}, "
+            f"RMSE {summary['cv_RMSE_mean']:.3f} +- {summary['cv_RMSE_std']:.3f}. "
+            f"The preprocessing took {prepare_time:.2f} sec, "
+            f"the whole cross-validation {wall_time:.1f} sec"
+        )
+
+        mlflow_cfg = self.cfg.logging.mlflow
+        mlflow.set_tracking_uri(mlflow_cfg.tracking_uri)
+        exp_id = mlflow.set_experiment(mlflow_cfg.exp_name).experiment_id
+        with mlflow.start_run(
+            experiment_id=exp_id, run_name=f"cv-{self.cfg.model.name}"
+        ) as run, MlflowLogger(
+            run.info.run_id, mlflow_cfg.tracking_uri, **mlflow_cfg.batching
+        ) as logger:
+            logger.log_params(self.cfg.model.hyperparams)
+            logger.log_params(
+                {
+                    "commit_id": self.cfg.logging.commit_id,
+                    "n_folds": cv_cfg.n_folds,
+                    "gap": cv_cfg.gap,
+                }
+            )
+            for i, result in enumerate(results):
+                logger.log_metrics(
+                    {f"fold_{name}": value for name, value in result.items()}, step=i
+                )
+            logger.log_metrics(summary)
+            if tracer is not None:
+                tracer.log_metrics(logger)
+
+
+if __name__ == "__main__":
+    fire.Fire(CrossValidator)
@@ -1,48 +1,284 @@
-from typing import List, Tuple
+import glob
+import hashlib
+import os
+import time
+from typing import List, Optional, Sequence, Tuple
 
 import fire
+import numpy as np
 import pandas as pd
-from sklearn.datasets import fetch_openml
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 
+from ..profiling import span
+from .streaming import iter_chunks
+
+
+DATA_DIR = "mlopscourse/data"
+TARGET = "bikes"
+NUMERICAL_FEATURES = [
+    "temp",
+    "feel_temp",
+    "humidity",
+    "windspeed",
+]
+# The raw dataset with the year of each row and the target under its original name
+RAW_PATH = f"{DATA_DIR}/bike_sharing_demand.csv"
+RAW_TARGET = "count"
+# The features stored as "False"/"True" in the raw dataset
+BOOLEAN_FEATURES = ["holiday", "workingday"]
+# The key of the cache metadata with the version of the CSV the cache was built from
+SOURCE_VERSION_KEY = b"source_version"
+
+
+class SplitWriter:
+    """
+    Appends the chunks of a split to its files, a temporary copy of each is written and
+    replaces the previous split once the split is closed, or is removed if the split is
+    aborted.
+
+    Attributes
+    ----------
+    path_prefix : str
+        The path of the split without the extension, e.g. `mlopscourse/data/train_split`.
+    formats : Sequence[str]
+        The formats to write the split in, `csv` and/or `parquet`.
+    n_rows : int
+        The number of rows written so far.
+    """
+
+    def __init__(self, path_prefix: str, formats: Sequence[str]) -> None:
+        self.path_prefix = path_prefix
+        self.formats = formats
+        self.n_rows = 0
+        self._parquet_writer: Optional[pq.ParquetWriter] = None
+        # An empty chunk has no types of its string columns, so it only gives the
+        # schema of a split with no rows at all
+        self._empty_table: Optional[pa.Table] = None
+
+    def write(self, X: pd.DataFrame) -> None:
+        if "csv" in self.formats:
+            X.to_csv(
+                f"{self.path_prefix}.csv.tmp",
+                mode="w" if self.n_rows == 0 else "a",
+                header=self.n_rows == 0,
+            )
+        if "parquet" in self.formats:
+            table = pa.Table.from_pandas(X, preserve_index=True)
+            if len(X) == 0:
+                if self._empty_table is None:
+                    self._empty_table = table
+                return
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(
+                    f"{self.path_prefix}.parquet.tmp", table.schema
+                )
+            # A column may be parsed into another type in a later chunk, e.g. into
+            # integers if all its floats are round
+            self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+        self.n_rows += len(X)
+
+    def close(self) -> None:
+        if self._parquet_writer is None and self._empty_table is not None:
+            pq.write_table(self._empty_table, f"{self.path_prefix}.parquet.tmp")
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        for output_format in self.formats:
+            path = f"{self.path_prefix}.{output_format}"
+            if os.path.exists(f"{path}.tmp"):
+                os.replace(f"{path}.tmp", path)
+
+    def abort(self) -> None:
+        """Removes the temporary files, the previous split is kept."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        for output_format in self.formats:
+            path = f"{self.path_prefix}.{output_format}.tmp"
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def download_raw_dataset(path: str) -> None:
+    """Downloads the dataset from OpenML and saves it as the raw CSV."""
+    # Only the download needs sklearn.datasets, loading the splits doesn't
+    from sklearn.datasets import fetch_openml
 
-def prepare_dataset(print_info: bool = True) -> None:
     bikes = fetch_openml("Bike_Sharing_Demand", version=2, as_frame=True, parser="pandas")
-    # Make an explicit copy to avoid "SettingWithCopyWarning" from pandas
-    X, y = bikes.data.copy(), bikes.target
-
-    # Because of this rare category, we collapse it into "rain".
-    X["weather"].replace(to_replace="heavy_rain", value="rain", inplace=True)
-
-    # Since ONNX LabelEncoder doesn't support booleans, boolean columns must be
-    # converted to integer columns
-    X.replace({"False": 0, "True": 1}, inplace=True)
-
-    # The dataset contains data from two years. We use the first year
-    # to train the model and the second year to test the model.
-    mask_training = X["year"] == 0
-    X = X.drop(columns=["year"])
-    X_train, y_train = X[mask_training], y[mask_training]
-    X_test, y_test = X[~mask_training], y[~mask_training]
+    bikes.frame.to_csv(path, index=False)
+
+
+def to_flags(column: pd.Series) -> pd.Series:
+    """Converts a boolean or a "False"/"True" column to 0/1."""
+    values = column.astype(str)
+    assert values.isin(["False", "True"]).all(), f"{column.name} is not boolean!"
+    return (values == "True").astype(np.int64)
+
+
+def remove_caches(data_dir: str, split: str) -> None:
+    """
+    Removes the Arrow cache and the prepared artifacts of the split (see
+    `PreparedSplit`), which are rebuilt on the next load.
+    """
+    for pattern in ["arrow", "*.quantized", "*.encoded.npy"]:
+        for path in glob.glob(os.path.join(data_dir, f"{split}_split.{pattern}")):
+            os.remove(path)
+
+
+def prepare_dataset(
+    raw_path: Optional[str] = None,
+    output_dir: str = DATA_DIR,
+    chunk_size: int = 100_000,
+    train_years: Sequence[int] = (0,),
+    formats: Sequence[str] = ("csv", "parquet"),
+    print_info: bool = True,
+) -> None:
+    """
+    Splits the raw dataset into the train and test splits by chunks, so that the
+    memory used doesn't depend on the size of the dataset.
+
+    Parameters
+    ----------
+    raw_path : str, optional
+        The raw CSV or Parquet file with the `year` column and the `count` target, like
+        the dataset on OpenML. The OpenML dataset is downloaded by default.
+    output_dir : str
+        The directory to write the `train_split` and `test_split` files to.
+    chunk_size : int
+        The number of rows processed at once.
+    train_years : Sequence[int]
+        The years of the train split, the rest of the rows are the test split.
+    formats : Sequence[str]
+        The formats to write the splits in: `csv`, read by `load_dataset`, and/or
+        `parquet`, which can be read by columns and by chunks.
+    print_info : bool
+        Whether to print the number of rows of each split and the throughput.
+    """
+    if raw_path is None:
+        raw_path = RAW_PATH
+        if not os.path.exists(raw_path):
+            download_raw_dataset(raw_path)
+
+    start = time.perf_counter()
+    writers = {
+        split: SplitWriter(os.path.join(output_dir, f"{split}_split"), formats)
+        for split in ["train", "test"]
+    }
+    n_rows = 0
+    try:
+        for chunk in iter_chunks(raw_path, chunk_size, index_col=None):
+            # The rows are numbered continuously across the chunks
+            chunk.index = pd.RangeIndex(n_rows, n_rows + len(chunk))
+            n_rows += len(chunk)
+            X = chunk.drop(columns=["year", RAW_TARGET])
+
+            # Because of this rare category, we collapse it into "rain".
+            X["weather"] = X["weather"].mask(X["weather"] == "heavy_rain", "rain")
+
+            # Since ONNX LabelEncoder doesn't support booleans, boolean columns must be
+            # converted to integer columns
+            for name in BOOLEAN_FEATURES:
+                X[name] = to_flags(X[name])
+
+            X[TARGET] = chunk[RAW_TARGET]
+            # The dataset contains data from two years. We use the first year
+            # to train the model and the second year to test the model.
+            mask_training = chunk["year"].isin(train_years)
+            writers["train"].write(X[mask_training])
+            writers["test"].write(X[~mask_training])
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+
+    for split, writer in writers.items():
+        writer.close()
+        remove_caches(output_dir, split)
+    elapsed = time.perf_counter() - start
     if print_info:
-        X_train.info()
+        for split, writer in writers.items():
+            print(f"The {split} split has {writer.n_rows} rows")
+        print(
+            f"Prepared {n_rows} rows in {elapsed:.1f}s ({n_rows / elapsed:.0f} rows/sec)"
+        )
+
+
+def get_csv_version(split: str) -> str:
+    """
+    Returns the version of the split CSV: the hash of its size and modification time,
+    which change whenever the file is rewritten or appended to, unlike the md5 in its
+    DVC file. Only a `stat` is needed, so a large CSV isn't read to validate its caches.
+    """
+    stat = os.stat(f"{DATA_DIR}/{split}_split.csv")
+    return hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def write_cache(X: pd.DataFrame, split: str, csv_version: str) -> None:
+    """
+    Saves the split read from the `csv_version` of its CSV as an uncompressed Arrow
+    file, which can be memory-mapped. The file is written to a temporary one first, so
+    a reader never maps a partially written cache.
+
+    String columns are dictionary-encoded, integers are downcast to the smallest type
+    fitting their values and floats are cast to float32, which both models cast the
+    features to anyway.
+    """
+    X = X.copy()
+    for name, dtype in X.dtypes.items():
+        if dtype == np.object_:
+            X[name] = X[name].astype("category")
+        elif dtype.kind == "i":
+            X[name] = pd.to_numeric(X[name], downcast="integer")
+        elif dtype.kind == "f":
+            X[name] = X[name].astype(np.float32)
+
+    table = pa.Table.from_pandas(X)
+    table = table.replace_schema_metadata(
+        {**table.schema.metadata, SOURCE_VERSION_KEY: csv_version.encode()}
+    )
+    path = f"{DATA_DIR}/{split}_split.arrow"
+    # Another process may be writing the same cache
+    feather.write_feather(table, f"{path}.{os.getpid()}.tmp", compression="uncompressed")
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
 
-    X_train = X_train.assign(bikes=y_train.values)
-    X_train.to_csv("mlopscourse/data/train_split.csv")
-    X_test = X_test.assign(bikes=y_test.values)
-    X_test.to_csv("mlopscourse/data/test_split.csv")
+def read_cache(split: str, csv_version: Optional[str] = None) -> Optional[pd.DataFrame]:
+    """
+    Memory-maps the cached split or returns None if it is missing or isn't of the
+    `csv_version` of the CSV, its current version by default.
+    """
+    path = f"{DATA_DIR}/{split}_split.arrow"
+    if not os.path.exists(path):
+        return None
+    table = feather.read_table(path, memory_map=True)
+    if csv_version is None:
+        csv_version = get_csv_version(split)
+    if table.schema.metadata.get(SOURCE_VERSION_KEY) != csv_version.encode():
+        return None
+    # Splitting blocks lets pandas reuse the mapped buffers instead of copying them
+    # into consolidated 2D blocks.
+    return table.to_pandas(split_blocks=True)
 
 
-def load_dataset(split: str) -> Tuple[pd.DataFrame, pd.Series, List[str], List[str]]:
-    X = pd.read_csv(f"mlopscourse/data/{split}_split.csv", index_col=0)
-    y = X["bikes"]
-    X = X.drop(columns=["bikes"])
+def load_dataset(
+    split: str, use_cache: bool = True
+) -> Tuple[pd.DataFrame, pd.Series, List[str], List[str]]:
+    with span("read_cache"):
+        X = read_cache(split) if use_cache else None
+    if X is None:
+        # The version is taken before reading, so a CSV changed meanwhile isn't cached
+        # as the new version
+        csv_version = get_csv_version(split)
+        with span("read_csv"):
+            X = pd.read_csv(f"{DATA_DIR}/{split}_split.csv", index_col=0)
+        if use_cache:
+            with span("write_cache"):
+                write_cache(X, split, csv_version)
+                X = read_cache(split, csv_version)
+    y = X[TARGET]
+    X = X.drop(columns=[TARGET])
 
-    numerical_features = [
-        "temp",
-        "feel_temp",
-        "humidity",
-        "windspeed",
-    ]
+    numerical_features = NUMERICAL_FEATURES.copy()
     categorical_features = X.columns.drop(numerical_features).values.tolist()
 
     return (X, y, numerical_features, categorical_features)
@@ -0,0 +1,141 @@
+import glob
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional
+
+import numpy as np
+
+from ..models.encoder import FeatureEncoder
+from ..profiling import span
+from .prepare_dataset import DATA_DIR, get_csv_version, load_dataset
+
+
+if TYPE_CHECKING:
+    from catboost import Pool
+
+
+# The CatBoost parameters the borders of the features depend on
+QUANTIZATION_PARAMS = [
+    "border_count",
+    "max_bin",
+    "feature_border_type",
+    "per_float_feature_quantization",
+    "nan_mode",
+]
+
+
+class PreparedSplit:
+    """
+    The artifacts of a split of the dataset prepared for the models once per its
+    version and reused by every run on it: the quantized CatBoost pool, which has the
+    borders of the features found and the categories hashed, and the float32 matrix
+    encoded by a `FeatureEncoder`, which the Random Forest fits and predicts on.
+
+    The artifacts are saved next to the Arrow cache of the split and named by the
+    version of its CSV, like the cache (see `get_csv_version`), and by the hash of what
+    they depend on, so a rewritten or appended CSV, other quantization parameters or
+    another encoder get new ones. The artifacts of the previous versions of the split
+    are removed. The pool is loaded from its file and the matrix is memory-mapped, so
+    the processes using them share the pages.
+
+    Attributes
+    ----------
+    split : str
+        The split, `train` or `test`.
+    rows : numpy.ndarray, optional
+        The rows of the split to use, all of them by default.
+    """
+
+    def __init__(self, split: str, rows: Optional[np.ndarray] = None) -> None:
+        self.split = split
+        self.rows = rows
+        # The artifacts loaded by this process by their paths
+        self._loaded: Dict[str, Any] = dict()
+
+    def _get_artifact_path(self, kind: str, dependencies: Dict[str, Any]) -> str:
+        csv_version = get_csv_version(self.split)
+        key = hashlib.md5(json.dumps(dependencies, sort_keys=True).encode()).hexdigest()
+        return os.path.join(
+            DATA_DIR, f"{self.split}_split.{csv_version[:8]}-{key[:8]}.{kind}"
+        )
+
+    def _remove_stale(self, path: str, kind: str) -> None:
+        version = os.path.basename(path).split(".")[1].split("-")[0]
+        for stale_path in glob.glob(
+            os.path.join(DATA_DIR, f"{self.split}_split.*.{kind}")
+        ):
+            if os.path.basename(stale_path).split(".")[1].split("-")[0] != version:
+                os.remove(stale_path)
+
+    def get_pool_path(
+        self, categorical_features: List[str], hyperparams: Mapping[str, Any]
+    ) -> str:
+        """Returns the path to the quantized pool of the split, made if it is missing."""
+        import catboost
+        from catboost import Pool
+
+        params = {
+            name: hyperparams[name] for name in QUANTIZATION_PARAMS if name in hyperparams
+        }
+        path = self._get_artifact_path(
+            "quantized", {"params": params, "catboost": catboost.__version__}
+        )
+        if not os.path.exists(path):
+            X, y, _, _ = load_dataset(self.split)
+            with span("catboost.quantize"):
+                pool = Pool(
+                    data=X,
+                    label=y,
+                    cat_features=categorical_features,
+                    feature_names=list(X.columns),
+                )
+                pool.quantize(**params)
+                # Another process may be saving the same pool
+                pool.save(f"{path}.{os.getpid()}.tmp")
+                os.replace(f"{path}.{os.getpid()}.tmp", path)
+            self._remove_stale(path, "quantized")
+        return path
+
+    def get_pool(
+        self, categorical_features: List[str], hyperparams: Mapping[str, Any]
+    ) -> "Pool":
+        """Returns the quantized pool of the `rows` of the split."""
+        from catboost import Pool
+
+        path = self.get_pool_path(categorical_features, hyperparams)
+        if path not in self._loaded:
+            with span("catboost.load_pool"):
+                pool = Pool(f"quantized://{path}")
+                if self.rows is not None:
+                    pool = pool.slice(self.rows)
+            self._loaded[path] = pool
+        return self._loaded[path]
+
+    def get_encoded_path(self, encoder: FeatureEncoder) -> str:
+        """Returns the path to the matrix of the split encoded by `encoder`."""
+        path = self._get_artifact_path("encoded.npy", encoder.to_dict())
+        if not os.path.exists(path):
+            X, _, _, _ = load_dataset(self.split)
+            with span("encode"):
+                X_encoded = encoder.transform(X)
+            with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+                np.save(f, X_encoded)
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+            self._remove_stale(path, "encoded.npy")
+        return path
+
+    def get_encoded(self, encoder: FeatureEncoder) -> np.ndarray:
+        """Returns the float32 matrix of the `rows` of the split encoded by `encoder`."""
+        path = self.get_encoded_path(encoder)
+        if path not in self._loaded:
+            X_encoded = np.load(path, mmap_mode="r")
+            # A subset of the rows is copied once
+            self._loaded[path] = X_encoded if self.rows is None else X_encoded[self.rows]
+        return self._loaded[path]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The pools can't be pickled, so every process loads the artifacts itself
+        state = self.__dict__.copy()
+        state["_loaded"] = dict()
+        return state
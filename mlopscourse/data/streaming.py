@@ -0,0 +1,97 @@
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def iter_chunks(
+    path: str, chunk_size: int, index_col: Optional[int] = 0
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads a CSV or a Parquet file by chunks of `chunk_size` rows. The index of a CSV is
+    read from its `index_col` column, e.g. None for the raw dataset, which has none.
+    """
+    if path.endswith(".parquet"):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, index_col=index_col, chunksize=chunk_size)
+
+
+class ChunkedWriter:
+    """
+    Appends chunks of predictions to a CSV or a Parquet file.
+
+    Attributes
+    ----------
+    path : str
+        The output file, its extension defines the format.
+    n_rows : int
+        The number of rows written so far.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.n_rows = 0
+        self._parquet_writer: Optional[pq.ParquetWriter] = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, preds: pd.Series) -> None:
+        # The rows are numbered continuously across the chunks
+        preds = preds.set_axis(pd.RangeIndex(self.n_rows, self.n_rows + len(preds)))
+        if self.path.endswith(".parquet"):
+            table = pa.Table.from_pandas(preds.to_frame())
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            preds.to_csv(
+                self.path, mode="w" if self.n_rows == 0 else "a", header=self.n_rows == 0
+            )
+        self.n_rows += len(preds)
+
+    def close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+    def __enter__(self) -> "ChunkedWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class StreamingR2:
+    """
+    Computes the R^2 metric from running sums, so the data is seen only once.
+
+    The variance of the target is accumulated with the Chan's et al. pairwise update,
+    which is stable unlike the difference of the sum of squares and the squared sum.
+    """
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0.0
+        self.total_sum_of_squares = 0.0
+        self.residual_sum_of_squares = 0.0
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray) -> None:
+        y_true = np.asarray(y_true, dtype=np.float64)
+        n_batch = len(y_true)
+        if n_batch == 0:
+            return
+        mean_batch = y_true.mean()
+        delta = mean_batch - self.mean
+        n_total = self.n + n_batch
+        self.total_sum_of_squares += (
+            np.square(y_true - mean_batch).sum() + delta**2 * self.n * n_batch / n_total
+        )
+        self.mean += delta * n_batch / n_total
+        self.n = n_total
+        self.residual_sum_of_squares += np.square(y_true - y_pred).sum()
+
+    def compute(self) -> float:
+        return 1 - self.residual_sum_of_squares / self.total_sum_of_squares
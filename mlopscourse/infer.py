@@ -1,11 +1,18 @@
 import os
-import pickle
+import time
 
 import fire
+import pandas as pd
 from hydra import compose
 from omegaconf import DictConfig, OmegaConf
 
-from .data.prepare_dataset import load_dataset
+from .data.prepare_dataset import TARGET, load_dataset
+from .data.prepared import PreparedSplit
+from .data.streaming import ChunkedWriter, StreamingR2, iter_chunks
+from .models.models_zoo import load_checkpoint
+from .monitoring import create_monitor, format_report
+from .prediction_cache import CachedModel, load_checkpoint_with_cache
+from .profiling import span, tracing
 
 
 class Inferencer:
@@ -26,21 +33,167 @@ class Inferencer:
         print(OmegaConf.to_yaml(self.cfg))
 
     def infer(self) -> None:
-        (
-            X_test,
-            y_test,
-            _,
-            _,
-        ) = load_dataset(split="test")
-
-        with open(f"checkpoints/{self.cfg.inference.checkpoint_name}", "rb") as f:
-            model = pickle.load(f)
-        print(f"Evaluating the {self.cfg.model.name} model...")
-        y_preds = model.eval(X_test, y_test)
-
-        os.makedirs("predictions", exist_ok=True)
-        ckpt_name = self.cfg.inference.checkpoint_name.split(".")[0]
-        y_preds.to_csv(f"predictions/{ckpt_name}_preds.csv")
+        with tracing(self.cfg.profiling, "infer", self.cfg.model.name):
+            with span("load_dataset"):
+                (
+                    X_test,
+                    y_test,
+                    _,
+                    _,
+                ) = load_dataset(split="test")
+
+            with span("load_checkpoint"):
+                model = load_checkpoint_with_cache(
+                    f"checkpoints/{self.cfg.inference.checkpoint_name}",
+                    self.cfg.inference.cache,
+                    self.cfg.inference.compiled,
+                )
+            monitor = create_monitor(
+                model,
+                self.cfg.inference.monitoring,
+                lambda report: print(format_report(report)),
+            )
+            print(f"Evaluating the {self.cfg.model.name} model...")
+            with span("predict"):
+                if isinstance(model, CachedModel):
+                    from sklearn.metrics import r2_score
+
+                    y_preds = pd.Series(
+                        model(X_test), name=f"{self.cfg.model.name}_preds"
+                    )
+                    print("R2: {:.2f}".format(r2_score(y_test, y_preds)))
+                    print(f"Prediction cache: {model.stats()}")
+                else:
+                    y_preds = model.eval(X_test, y_test, PreparedSplit("test"))
+            if monitor is not None:
+                # The test split is a single window however long it took
+                with span("monitor"):
+                    monitor.update(X_test)
+                    monitor.report()
+
+            with span("save_predictions"):
+                os.makedirs("predictions", exist_ok=True)
+                ckpt_name = self.cfg.inference.checkpoint_name.split(".")[0]
+                y_preds.to_csv(f"predictions/{ckpt_name}_preds.csv")
+
+    def infer_parallel(self) -> None:
+        """
+        Runs the model on the test set with a pool of processes sharing the data. The
+        number of workers and the size of the partitions are set in
+        `inference.parallel`. Each worker loads the model as `infer` does, compiled or
+        with a cache of its own if configured, and the drift of the test set is
+        monitored in the main process.
+        """
+        from sklearn.metrics import r2_score
+
+        from .parallel_scoring import score_in_parallel
+
+        parallel_cfg = self.cfg.inference.parallel
+        with tracing(self.cfg.profiling, "infer_parallel", self.cfg.model.name):
+            with span("load_dataset"):
+                (
+                    X_test,
+                    y_test,
+                    _,
+                    _,
+                ) = load_dataset(split="test")
+
+            print(
+                f"Evaluating the {self.cfg.model.name} model "
+                f"with {parallel_cfg.n_workers} workers..."
+            )
+            start = time.perf_counter()
+            # The spans of the workers aren't traced
+            with span("score_in_parallel"):
+                preds = score_in_parallel(
+                    f"checkpoints/{self.cfg.inference.checkpoint_name}",
+                    X_test,
+                    parallel_cfg.n_workers,
+                    parallel_cfg.partition_size,
+                    parallel_cfg.threads_per_worker,
+                    self.cfg.inference.compiled,
+                    self.cfg.inference.cache,
+                )
+            elapsed = time.perf_counter() - start
+            print(f"Scored {len(preds) / elapsed:.0f} rows/sec")
+            print("R2: {:.2f}".format(r2_score(y_test, preds)))
+            if self.cfg.inference.monitoring.enabled:
+                # Only the reference profile of the checkpoint is needed here
+                with span("load_checkpoint"):
+                    model = load_checkpoint(
+                        f"checkpoints/{self.cfg.inference.checkpoint_name}"
+                    )
+                monitor = create_monitor(
+                    model,
+                    self.cfg.inference.monitoring,
+                    lambda report: print(format_report(report)),
+                )
+                if monitor is not None:
+                    with span("monitor"):
+                        monitor.update(X_test)
+                        monitor.report()
+
+            with span("save_predictions"):
+                os.makedirs("predictions", exist_ok=True)
+                ckpt_name = self.cfg.inference.checkpoint_name.split(".")[0]
+                pd.Series(preds, name=f"{self.cfg.model.name}_preds").to_csv(
+                    f"predictions/{ckpt_name}_preds.csv"
+                )
+
+    def infer_stream(self) -> None:
+        """
+        Runs the model on the input file chunk by chunk, so the memory consumption is
+        bounded by the chunk size. The R^2 metric is calculated if the input contains
+        the target column.
+        """
+        stream_cfg = self.cfg.inference.streaming
+        with tracing(self.cfg.profiling, "infer_stream", self.cfg.model.name):
+            with span("load_checkpoint"):
+                model = load_checkpoint_with_cache(
+                    f"checkpoints/{self.cfg.inference.checkpoint_name}",
+                    self.cfg.inference.cache,
+                    self.cfg.inference.compiled,
+                )
+            monitor = create_monitor(
+                model,
+                self.cfg.inference.monitoring,
+                lambda report: print(format_report(report)),
+            )
+
+            ckpt_name = self.cfg.inference.checkpoint_name.split(".")[0]
+            output_path = f"predictions/{ckpt_name}_preds.{stream_cfg.output_format}"
+            r2 = StreamingR2()
+            print(
+                f"Streaming {stream_cfg.input_path} "
+                f"through the {self.cfg.model.name} model..."
+            )
+            chunks = iter_chunks(stream_cfg.input_path, stream_cfg.chunk_size)
+            with ChunkedWriter(output_path) as writer:
+                while True:
+                    with span("read_chunk"):
+                        X_chunk = next(chunks, None)
+                    if X_chunk is None:
+                        break
+                    y_chunk = X_chunk.pop(TARGET) if TARGET in X_chunk else None
+                    with span("predict"):
+                        preds = model(X_chunk)
+                    if monitor is not None:
+                        with span("monitor"):
+                            monitor.update(X_chunk)
+                    with span("write_chunk"):
+                        writer.write(
+                            pd.Series(preds, name=f"{self.cfg.model.name}_preds")
+                        )
+                    if y_chunk is not None:
+                        r2.update(y_chunk, preds)
+            print(f"{writer.n_rows} predictions are saved to {output_path}")
+            if monitor is not None:
+                # The rest of the stream since the last report
+                monitor.report()
+            if r2.n > 0:
+                print(f"Streaming R2: {r2.compute():.2f}")
+            if isinstance(model, CachedModel):
+                print(f"Prediction cache: {model.stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, List, Mapping, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import fire
+from mlflow import MlflowClient
+from mlflow.entities import Metric, Param
+from mlflow.protos.service_pb2 import LogBatch
+from mlflow.store.tracking.rest_store import RestStore
+from mlflow.utils.proto_json_utils import message_to_json
+from mlflow.utils.rest_utils import http_request, verify_rest_response
+from mlflow.utils.time import get_current_time_millis
+
+
+# The endpoint of `MlflowClient.log_batch` in the REST API of the tracking server
+LOG_BATCH_ENDPOINT = "/api/2.0/mlflow/runs/log-batch"
+# The schemes of the tracking URIs served over HTTP, the others are local stores with no
+# requests to time out
+REST_SCHEMES = ["http", "https", "databricks"]
+
+# The limits of the MLflow tracking server on the contents of one `log_batch` request
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+MAX_ENTITIES_PER_BATCH = 1000
+
+Entity = Union[Metric, Param]
+
+
+class MlflowLogger:
+    """
+    Buffers params and metrics of a run and sends them to the tracking server with
+    `MlflowClient.log_batch` from a background thread.
+
+    The buffer is bounded, so producers block when the server can't keep up. A batch
+    that can't be sent after all retries is spilled to a local JSON lines file, as well
+    as all the following batches, and can be replayed later with
+    `replay_spilled_batches`.
+
+    Attributes
+    ----------
+    run_id : str
+        The ID of the run to log to.
+    tracking_uri : str
+        The URI of the tracking server.
+    flush_interval : float
+        The maximum number of seconds an entity waits in the buffer.
+    max_retries : int
+        The number of attempts to send a batch before spilling it.
+    request_timeout : int, optional
+        The timeout of a request to a tracking server over HTTP, in seconds. If set, the
+        requests of the logger aren't retried by MLflow, the other requests of the
+        process keep the MLflow settings.
+    spill_path : str
+        The file the unsent batches are appended to.
+    """
+
+    def __init__(
+        self,
+        run_id: str,
+        tracking_uri: str,
+        max_queue_size: int = 10000,
+        flush_interval: float = 1.0,
+        max_retries: int = 3,
+        request_timeout: Optional[int] = None,
+        spill_dir: str = "mlruns_spill",
+    ) -> None:
+        self.run_id = run_id
+        self.tracking_uri = tracking_uri
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.request_timeout = request_timeout
+        self.spill_path = os.path.join(spill_dir, f"{run_id}.jsonl")
+
+        self._client = MlflowClient(tracking_uri)
+        self._rest_store = self._get_rest_store()
+        self._queue: "queue.Queue[Optional[Entity]]" = queue.Queue(max_queue_size)
+        self._is_spilling = False
+        self._worker = threading.Thread(target=self._run, name="mlflow-logger")
+        self._worker.start()
+
+    def _get_rest_store(self) -> Optional[RestStore]:
+        """Returns the REST store of the client to time out its requests, if it's one."""
+        if self.request_timeout is None:
+            return None
+        if urlparse(self.tracking_uri).scheme not in REST_SCHEMES:
+            return None
+        try:
+            # MLflow has no public accessor of the store of a client
+            store = self._client._tracking_client.store
+        except AttributeError:
+            print("The request timeout isn't supported by this version of MLflow")
+            return None
+        return store if isinstance(store, RestStore) else None
+
+    def log_params(self, params: Mapping[str, Any]) -> None:
+        for key, value in params.items():
+            self._queue.put(Param(key, str(value)))
+
+    def log_metrics(self, metrics: Mapping[str, float], step: int = 0) -> None:
+        timestamp = get_current_time_millis()
+        for key, value in metrics.items():
+            self._queue.put(Metric(key, float(value), timestamp, step))
+
+    def close(self) -> None:
+        """Flushes the buffer and waits for the background thread to finish."""
+        self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self) -> "MlflowLogger":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        is_closed = False
+        while not is_closed:
+            metrics: List[Metric] = list()
+            params: List[Param] = list()
+            deadline = time.monotonic() + self.flush_interval
+            while (
+                len(metrics) < MAX_METRICS_PER_BATCH
+                and len(params) < MAX_PARAMS_PER_BATCH
+                and len(metrics) + len(params) < MAX_ENTITIES_PER_BATCH
+            ):
+                try:
+                    entity = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if entity is None:
+                    is_closed = True
+                    break
+                if isinstance(entity, Metric):
+                    metrics.append(entity)
+                else:
+                    params.append(entity)
+            if metrics or params:
+                self._send(metrics, params)
+
+    def _log_batch(self, metrics: List[Metric], params: List[Param]) -> None:
+        if self.request_timeout is None or self._rest_store is None:
+            self._client.log_batch(self.run_id, metrics=metrics, params=params)
+            return
+        # A slow server should fail fast, the retries are done in `_send`
+        request = LogBatch(
+            run_id=self.run_id,
+            metrics=[metric.to_proto() for metric in metrics],
+            params=[param.to_proto() for param in params],
+        )
+        response = http_request(
+            self._rest_store.get_host_creds(),
+            LOG_BATCH_ENDPOINT,
+            "POST",
+            max_retries=0,
+            timeout=self.request_timeout,
+            json=json.loads(message_to_json(request)),
+        )
+        verify_rest_response(response, LOG_BATCH_ENDPOINT)
+
+    def _send(self, metrics: List[Metric], params: List[Param]) -> None:
+        if not self._is_spilling:
+            for attempt in range(self.max_retries):
+                try:
+                    self._log_batch(metrics, params)
+                    return
+                except Exception as e:
+                    print(f"Failed to log a batch to MLflow (attempt {attempt + 1}): {e}")
+                    if attempt + 1 < self.max_retries:
+                        time.sleep(2**attempt)
+            print(f"The tracking server is unavailable, spilling to {self.spill_path}")
+            self._is_spilling = True
+
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            json.dump(
+                {
+                    "run_id": self.run_id,
+                    "metrics": [(m.key, m.value, m.timestamp, m.step) for m in metrics],
+                    "params": [(p.key, p.value) for p in params],
+                },
+                f,
+            )
+            f.write("\n")
+
+
+def load_spilled_batches(
+    spill_path: str,
+) -> List[Tuple[str, List[Metric], List[Param]]]:
+    batches = list()
+    with open(spill_path) as f:
+        for line in f:
+            batch = json.loads(line)
+            batches.append(
+                (
+                    batch["run_id"],
+                    [Metric(*metric) for metric in batch["metrics"]],
+                    [Param(*param) for param in batch["params"]],
+                )
+            )
+    return batches
+
+
+def replay_spilled_batches(spill_path: str, tracking_uri: str) -> None:
+    """
+    Sends the batches spilled by `MlflowLogger` to the tracking server.
+
+    Parameters
+    ----------
+    spill_path : str
+        The file with the spilled batches.
+    tracking_uri : str
+        The URI of the tracking server.
+    """
+    client = MlflowClient(tracking_uri)
+    for run_id, metrics, params in load_spilled_batches(spill_path):
+        client.log_batch(run_id, metrics=metrics, params=params)
+    os.remove(spill_path)
+
+
+if __name__ == "__main__":
+    fire.Fire(replay_spilled_batches)
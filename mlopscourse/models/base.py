@@ -1,18 +1,59 @@
+import json
+import os
 import pickle
 from abc import ABCMeta, abstractmethod
-from typing import Optional
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Union
 
+import numpy as np
 import pandas as pd
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
+
+from ..profiling import span
+from .encoder import Columns, FeatureEncoder
+
+
+if TYPE_CHECKING:
+    from ..data.prepared import PreparedSplit
+    from ..mlflow_logger import MlflowLogger
+    from ..monitoring import FeatureSketches
+
+
+# Either a 2D array with the columns in the training order or a record batch
+# mapping each feature name to a 1D column.
+ArraySample = Union[np.ndarray, Mapping[str, np.ndarray]]
+
+# Bumped whenever the layout of the native checkpoint directory changes
+CHECKPOINT_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
 
 
 class BaseModel(metaclass=ABCMeta):
     """Represents an interface that any model used must implement."""
 
+    # The attributes added since the first pickled checkpoints and their values for
+    # those, which are filled in when such a checkpoint is unpickled
+    STATE_DEFAULTS: Dict[str, Any] = {
+        "feature_names": None,
+        "encoder": None,
+        "watermark": None,
+        "compiled": None,
+        "profile": None,
+    }
+
     def __init__(self, cfg: DictConfig) -> None:
         self.cfg = cfg
         self.preprocessor = None
         self.model = None
+        # The column order is fixed at the training time
+        self.feature_names: Optional[List[str]] = None
+        # The categorical encoding fitted on the train split by `Trainer`
+        self.encoder: Optional[FeatureEncoder] = None
+        # The training rows the model has seen, see `Trainer.train_incremental`
+        self.watermark: Optional[Dict[str, Any]] = None
+        # The lookup-table evaluator `__call__` uses once the model is compiled
+        self.compiled: Optional[Any] = None
+        # The sketches of the train split the served features are monitored against
+        self.profile: Optional["FeatureSketches"] = None
 
     @abstractmethod
     def train(
@@ -21,21 +62,146 @@ class BaseModel(metaclass=ABCMeta):
         y_train: pd.Series,
         X_test: Optional[pd.DataFrame] = None,
         y_test: Optional[pd.Series] = None,
+        prepared: Optional["PreparedSplit"] = None,
+    ) -> None:
+        """
+        Trains the model on `X_train`. If it's a split of the dataset, the model is
+        trained on the `prepared` artifacts of the split instead of preparing it again.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def train_incremental(
+        self,
+        X_new: pd.DataFrame,
+        y_new: pd.Series,
+        n_estimators: int,
+        X_val: Optional[pd.DataFrame] = None,
+        y_val: Optional[pd.Series] = None,
     ) -> None:
+        """
+        Continues the training on the new rows only, adding up to `n_estimators`
+        boosting rounds or trees to the trained model. The boosting keeps only the
+        rounds improving on the validation rows if they are given.
+        """
         raise NotImplementedError()
 
     @abstractmethod
-    def eval(self, X_test: pd.DataFrame, y_test: pd.Series) -> pd.Series:
+    def eval(
+        self,
+        X_test: pd.DataFrame,
+        y_test: pd.Series,
+        prepared: Optional["PreparedSplit"] = None,
+    ) -> pd.Series:
         raise NotImplementedError()
 
     @abstractmethod
     def __call__(self, X_sample: pd.DataFrame) -> pd.Series:
         raise NotImplementedError()
 
+    def predict_encoded(self, X_sample: Columns, X_encoded: np.ndarray) -> np.ndarray:
+        """
+        Predicts on the sample already encoded by the `encoder`, so that several models
+        sharing it encode a batch once (see `EnsembleModel`). The raw sample, a data
+        frame or a record batch, is for the models that can't predict from the encoded
+        matrix.
+        """
+        return self(X_sample)
+
+    @abstractmethod
+    def predict_array(self, X_sample: ArraySample) -> np.ndarray:
+        """
+        Predicts without pandas in the way, which is meant for the serving hot path.
+
+        Parameters
+        ----------
+        X_sample : numpy.ndarray or Mapping[str, numpy.ndarray]
+            Either a 2D array with the columns in the `feature_names` order or a record
+            batch mapping each feature name to a 1D column.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def compile(self) -> None:
+        """
+        Compiles the trained model into a pure NumPy evaluator over the quantized
+        features, which `__call__` uses from then on. The predictions stay bit-exact.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set_thread_count(self, thread_count: int) -> None:
+        """Limits the number of threads used for prediction, -1 means all the cores."""
+        raise NotImplementedError()
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(self.STATE_DEFAULTS)
+        self.__dict__.update(state)
+
+    def get_columns(self, X_sample: ArraySample) -> List[np.ndarray]:
+        """Splits the sample into 1D columns following the `feature_names` order."""
+        if isinstance(X_sample, np.ndarray):
+            assert X_sample.ndim == 2 and X_sample.shape[1] == len(
+                self.feature_names
+            ), f"Expected a 2D array with {len(self.feature_names)} columns!"
+            return [X_sample[:, i] for i in range(X_sample.shape[1])]
+        return [np.asarray(X_sample[name]).reshape(-1) for name in self.feature_names]
+
     def save_checkpoint(self, path: str) -> None:
-        with open(path + self.cfg.training.checkpoint_name, "wb") as f:
-            pickle.dump(self, f)
+        """
+        Saves the model to `path` + `training.checkpoint_name` in the format set in
+        `training.checkpoint_format`.
+
+        The `pickle` format is a single `.p` file with the whole object. The `native`
+        format is a directory with a small `manifest.json` and the model's own
+        artifacts, which can be loaded without unpickling anything (see
+        `models_zoo.load_checkpoint`).
+        """
+        checkpoint_path = path + self.cfg.training.checkpoint_name
+        if self.cfg.training.checkpoint_format == "pickle":
+            with span("pickle.dump"), open(checkpoint_path + ".p", "wb") as f:
+                pickle.dump(self, f)
+            return
+
+        assert (
+            self.cfg.training.checkpoint_format == "native"
+        ), f"Unknown checkpoint format: {self.cfg.training.checkpoint_format}"
+        os.makedirs(checkpoint_path, exist_ok=True)
+        manifest = {
+            "format_version": CHECKPOINT_FORMAT_VERSION,
+            "model_name": self.cfg.model.name,
+            "config": OmegaConf.to_container(self.cfg, resolve=True),
+            "feature_names": self.feature_names,
+            "numerical_features": self.numerical_features,
+            "categorical_features": self.categorical_features,
+            "watermark": self.watermark,
+            "encoder": None if self.encoder is None else self.encoder.to_dict(),
+            "profile": None if self.profile is None else self.profile.to_dict(),
+        }
+        with span("save_artifacts"):
+            manifest["artifacts"] = self.save_artifacts(checkpoint_path)
+        # The manifest is written last, so a directory without it is an incomplete save
+        with open(os.path.join(checkpoint_path, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    @abstractmethod
+    def save_artifacts(self, path: str) -> Dict[str, Any]:
+        """
+        Saves the trained model in its native format into the `path` directory.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The description of the artifacts to put into the manifest, which is passed
+            to `load_artifacts` as is.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def load_artifacts(self, path: str, artifacts: Dict[str, Any]) -> None:
+        """Restores the trained model from the artifacts saved by `save_artifacts`."""
+        raise NotImplementedError()
 
     @abstractmethod
-    def log_fis_and_metrics(self, exp_id: str) -> None:
+    def log_fis_and_metrics(self, logger: "MlflowLogger") -> None:
         raise NotImplementedError()
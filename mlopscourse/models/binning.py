@@ -0,0 +1,70 @@
+from typing import List, Sequence
+
+import numpy as np
+from sklearn.tree import BaseDecisionTree
+
+
+# The number of rows the edges of the bins are found on, like in sklearn's
+# `HistGradientBoostingRegressor`
+SUBSAMPLE_SIZE = 200_000
+
+
+class FeatureBinner:
+    """
+    Bins the encoded features for the training of the trees, like the histograms of the
+    gradient boosting. For every node, sklearn's splitter sorts the values of each
+    feature and tries a threshold between every two distinct ones, so a few hundred bins
+    instead of the continuous values make both much cheaper. A feature with at most
+    `max_bins` distinct values is binned by them, so it loses nothing.
+
+    The trees fitted on the bins are then mapped back to the encoded values by their
+    thresholds, so they predict on the encoded features exactly as on the bins, and
+    nothing downstream of the training knows about the bins.
+
+    Attributes
+    ----------
+    edges : List[numpy.ndarray]
+        The sorted float32 edges of the bins of each feature: a value falls into the bin
+        numbered by the count of the edges not greater than it.
+    """
+
+    def __init__(self, edges: List[np.ndarray]) -> None:
+        self.edges = edges
+
+    @classmethod
+    def fit(
+        cls, X_encoded: np.ndarray, max_bins: int, random_state: int = 0
+    ) -> "FeatureBinner":
+        rng = np.random.default_rng(random_state)
+        if len(X_encoded) > SUBSAMPLE_SIZE:
+            rows = np.sort(rng.choice(len(X_encoded), SUBSAMPLE_SIZE, replace=False))
+            X_encoded = X_encoded[rows]
+        edges = list()
+        quantiles = np.linspace(0, 1, max_bins + 1)[1:-1]
+        for column in X_encoded.T:
+            values = np.unique(column)
+            if len(values) > max_bins:
+                values = np.unique(np.quantile(column, quantiles).astype(np.float32))
+            edges.append(values[1:].astype(np.float32))
+        return cls(edges)
+
+    def transform(self, X_encoded: np.ndarray) -> np.ndarray:
+        """Returns the float32 matrix of the numbers of the bins, which sklearn takes."""
+        X_binned = np.empty(X_encoded.shape, dtype=np.float32)
+        for i, edges in enumerate(self.edges):
+            X_binned[:, i] = np.searchsorted(edges, X_encoded[:, i], side="right")
+        return X_binned
+
+    def restore_thresholds(self, trees: Sequence[BaseDecisionTree]) -> None:
+        """Maps the thresholds of the `trees` fitted on the bins to the encoded values."""
+        for tree in trees:
+            feature = tree.tree_.feature
+            threshold = tree.tree_.threshold  # A view of the nodes of the tree
+            for i, edges in enumerate(self.edges):
+                is_split = feature == i
+                # The splitter puts a threshold between two bins, so a row goes left
+                # if its bin is at most the one below the threshold, i.e. if its value
+                # is below the edge after that bin. sklearn compares float32 values
+                # with `<=`, so the threshold is the float32 just below that edge.
+                bins = np.floor(threshold[is_split]).astype(np.int64)
+                threshold[is_split] = np.nextafter(edges[bins], np.float32(-np.inf))
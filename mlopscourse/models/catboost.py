@@ -1,18 +1,37 @@
-from typing import List, Optional
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
-import mlflow
 import numpy as np
 import pandas as pd
-from catboost import CatBoostRegressor, Pool
+from catboost import CatBoostRegressor, FeaturesData, Pool
 from omegaconf import DictConfig
-from sklearn.metrics import r2_score
 
-from .base import BaseModel
+from ..profiling import span
+from .base import ArraySample, BaseModel
+from .compiled import CompiledCatboost
+from .encoder import Columns, take_rows
+
+
+if TYPE_CHECKING:
+    from ..data.prepared import PreparedSplit
+    from ..mlflow_logger import MlflowLogger
+
+
+def to_catboost_value(value: Any) -> bytes:
+    """Converts a categorical value into the UTF-8 string CatBoost hashes for it."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        # Categorical values must be integers or strings
+        value = int(value)
+    return str(value).encode("utf-8")
 
 
 class CatboostModel(BaseModel):
     """The Yandex's CatBoost."""
 
+    STATE_DEFAULTS = {**BaseModel.STATE_DEFAULTS, "thread_count": -1, "cat_values": None}
+
     def __init__(
         self,
         cfg: DictConfig,
@@ -24,6 +43,11 @@ class CatboostModel(BaseModel):
         self.model = CatBoostRegressor(**cfg.model.hyperparams)
         self.numerical_features = numerical_features
         self.categorical_features = categorical_features
+        self.cat_indices: List[int] = list()
+        self.thread_count = -1
+        # The values CatBoost hashes for each category of the encoder by its index,
+        # resolved once for `predict_array`
+        self.cat_values: Optional[Dict[str, np.ndarray]] = None
 
     def train(
         self,
@@ -31,51 +55,247 @@ class CatboostModel(BaseModel):
         y_train: pd.Series,
         X_test: Optional[pd.DataFrame] = None,
         y_test: Optional[pd.Series] = None,
+        prepared: Optional["PreparedSplit"] = None,
     ) -> None:
-        train_data = Pool(
-            data=X_train,
-            label=y_train,
-            cat_features=self.categorical_features,
-            feature_names=list(X_train.columns),
-        )
+        self.feature_names = list(X_train.columns)
+        self.cat_indices = [
+            self.feature_names.index(name) for name in self.categorical_features
+        ]
+        if prepared is not None:
+            # The borders and the hashes of the categories are reused
+            train_data = prepared.get_pool(
+                self.categorical_features, self.cfg.model.hyperparams
+            )
+            assert train_data.num_row() == len(X_train), "The pool is of other rows!"
+        else:
+            with span("catboost.pool"):
+                train_data = Pool(
+                    data=X_train,
+                    label=y_train,
+                    cat_features=self.categorical_features,
+                    feature_names=list(X_train.columns),
+                )
         if X_test is not None:
             assert y_test is not None, "For the evaluation, y_test must be provided!"
-            test_data = Pool(
-                data=X_test,
-                label=y_test,
+            with span("catboost.pool"):
+                test_data = Pool(
+                    data=X_test,
+                    label=y_test,
+                    cat_features=self.categorical_features,
+                    feature_names=list(X_test.columns),
+                )
+            with span("catboost.fit"):
+                self.model.fit(train_data, eval_set=test_data, use_best_model=True)
+        else:
+            with span("catboost.fit"):
+                self.model.fit(train_data)
+
+    def train_incremental(
+        self,
+        X_new: pd.DataFrame,
+        y_new: pd.Series,
+        n_estimators: int,
+        X_val: Optional[pd.DataFrame] = None,
+        y_val: Optional[pd.Series] = None,
+    ) -> None:
+        if self.encoder is not None:
+            # The compiled model must know the new categories the new trees split on
+            self.encoder.add_categories(X_new)
+        with span("catboost.pool"):
+            new_data = Pool(
+                data=X_new,
+                label=y_new,
                 cat_features=self.categorical_features,
-                feature_names=list(X_test.columns),
+                feature_names=list(X_new.columns),
             )
-            self.model.fit(train_data, eval_set=test_data, use_best_model=True)
-        else:
-            self.model.fit(train_data)
-
-    def eval(self, X_test: pd.DataFrame, y_test: pd.Series) -> pd.Series:
-        test_data = Pool(
-            data=X_test,
-            label=y_test,
-            cat_features=self.categorical_features,
-            feature_names=list(X_test.columns),
+        fit_params = dict()
+        if X_val is not None:
+            assert y_val is not None, "For the validation, y_val must be provided!"
+            with span("catboost.pool"):
+                fit_params["eval_set"] = Pool(
+                    data=X_val,
+                    label=y_val,
+                    cat_features=self.categorical_features,
+                    feature_names=list(X_val.columns),
+                )
+            # A few rows are easy to overfit, so the rounds past the best are dropped
+            fit_params["use_best_model"] = True
+        # The trees of the trained model are kept and the new ones boost its residuals
+        init_model = self.model
+        self.model = CatBoostRegressor(
+            **{**self.cfg.model.hyperparams, "n_estimators": n_estimators}
         )
-        preds = self.model.predict(test_data)
+        with span("catboost.fit"):
+            self.model.fit(new_data, init_model=init_model, **fit_params)
+        self.compiled = None
+        self.cat_values = None
+
+    def eval(
+        self,
+        X_test: pd.DataFrame,
+        y_test: pd.Series,
+        prepared: Optional["PreparedSplit"] = None,
+    ) -> pd.Series:
+        # sklearn.metrics is slow to import, so only the evaluation imports it
+        from sklearn.metrics import r2_score
+
+        # CatBoost can't predict on a quantized pool with categorical features, so only
+        # the compiled model reuses the prepared matrix
+        if prepared is None or self.compiled is None:
+            preds = self(X_test)
+        else:
+            with span("load_encoded"):
+                X_encoded = prepared.get_encoded(self.encoder)
+            preds = self.predict_encoded(X_test, X_encoded)
         print("CatBoost R2: {:.2f}".format(r2_score(y_test, preds)))
         return pd.Series(preds, name="cb_preds")
 
     def __call__(self, X_sample: pd.DataFrame) -> np.ndarray:
-        sample_data = Pool(
-            data=X_sample,
-            label=None,
-            cat_features=self.categorical_features,
-            feature_names=list(X_sample.columns),
+        if self.compiled is None:
+            return self._predict(X_sample)
+        with span("encode"):
+            X_encoded = self.encoder.transform(X_sample)
+        return self.predict_encoded(X_sample, X_encoded)
+
+    def predict_encoded(self, X_sample: Columns, X_encoded: np.ndarray) -> np.ndarray:
+        if self.compiled is None:
+            return self._predict_raw(X_sample, X_encoded)
+        with span("compiled.predict"):
+            preds = self.compiled.predict(X_encoded)
+        unknown = np.flatnonzero(np.isnan(preds))
+        if len(unknown) > 0:
+            # CatBoost itself handles the unseen categories and the missing values
+            preds[unknown] = self._predict_raw(
+                take_rows(X_sample, unknown), X_encoded[unknown]
+            )
+        return preds
+
+    def _predict_raw(self, X_sample: Columns, X_encoded: np.ndarray) -> np.ndarray:
+        """
+        Lets CatBoost hash the raw values of the categorical features, of a frame or of
+        a record batch, whose known categories are taken from `X_encoded`.
+        """
+        if isinstance(X_sample, pd.DataFrame):
+            return self._predict(X_sample)
+        if self.cat_values is None:
+            self.resolve_categories()
+        columns = {
+            name: np.asarray(X_sample[name]).reshape(-1) for name in self.feature_names
+        }
+        return self.predict_features(columns, X_encoded)
+
+    def _predict(self, X_sample: pd.DataFrame) -> np.ndarray:
+        with span("catboost.pool"):
+            sample_data = Pool(
+                data=X_sample,
+                label=None,
+                cat_features=self.categorical_features,
+                feature_names=list(X_sample.columns),
+            )
+        with span("catboost.predict"):
+            return self.model.predict(sample_data, thread_count=self.thread_count)
+
+    def resolve_categories(self) -> None:
+        """Resolves the categories of the encoder into the values CatBoost hashes."""
+        self.cat_values = {
+            name: np.array(
+                [to_catboost_value(value) for value in self.encoder.categories[name]]
+                + [None],  # Stands for the unknown values, see `predict_array`
+                dtype=object,
+            )
+            for name in self.categorical_features
+        }
+        # The order of the features in the matrices of `FeaturesData`
+        self.features_data_names = (
+            [
+                name
+                for name in self.feature_names
+                if name not in self.categorical_features
+            ],
+            [name for name in self.feature_names if name in self.categorical_features],
         )
-        return self.model.predict(sample_data)
 
-    def log_fis_and_metrics(self, exp_id: str, col_names: List[str]) -> None:
+    def predict_array(self, X_sample: ArraySample) -> np.ndarray:
+        if isinstance(X_sample, np.ndarray) and X_sample.dtype == np.object_:
+            return self.model.predict(X_sample, thread_count=self.thread_count)
+
+        columns = self.get_columns(X_sample)
+        if self.encoder is not None:
+            if self.cat_values is None:
+                self.resolve_categories()
+            return self.predict_features(dict(zip(self.feature_names, columns)))
+        # The checkpoints saved before the shared encoder have no categories to resolve
+        # CatBoost accepts a mixed-type matrix only as an object array
+        data = np.empty((len(columns[0]), len(columns)), dtype=object)
+        for i, column in enumerate(columns):
+            if i in self.cat_indices and column.dtype.kind == "f":
+                # Categorical values must be integers or strings
+                column = column.astype(np.int64)
+            data[:, i] = column
+        return self.model.predict(data, thread_count=self.thread_count)
+
+    def predict_features(
+        self, columns: Dict[str, np.ndarray], X_encoded: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Predicts with CatBoost's `FeaturesData`: the numerical features as a float32
+        matrix and the categorical ones as the resolved values of their indices, so
+        no object is built per row. The indices are taken from `X_encoded` if the
+        columns are already encoded.
+        """
+        numerical_features, categorical_features = self.features_data_names
+        n_rows = len(columns[self.feature_names[0]])
+        num_data = np.empty((n_rows, len(numerical_features)), dtype=np.float32)
+        for i, name in enumerate(numerical_features):
+            num_data[:, i] = columns[name]
+        cat_data = np.empty((n_rows, len(categorical_features)), dtype=object)
+        for i, name in enumerate(categorical_features):
+            if X_encoded is None:
+                codes = self.encoder.encode_column(name, columns[name])
+            else:
+                codes = X_encoded[:, self.encoder.columns.index(name)].astype(np.intp)
+            cat_data[:, i] = self.cat_values[name].take(codes)
+            if len(codes) > 0 and codes.min() < 0:
+                # CatBoost hashes the unseen categories itself
+                unknown = np.flatnonzero(codes < 0)
+                cat_data[unknown, i] = [
+                    to_catboost_value(value) for value in columns[name][unknown]
+                ]
+        data = FeaturesData(
+            num_feature_data=num_data,
+            cat_feature_data=cat_data,
+            num_feature_names=numerical_features,
+            cat_feature_names=categorical_features,
+        )
+        return self.model.predict(data, thread_count=self.thread_count)
+
+    def compile(self) -> None:
+        assert (
+            self.encoder is not None
+        ), "The encoder is saved only by the models trained with it!"
+        self.compiled = CompiledCatboost(self.model, self.feature_names, self.encoder)
+
+    def set_thread_count(self, thread_count: int) -> None:
+        self.thread_count = thread_count
+
+    def save_artifacts(self, path: str) -> Dict[str, Any]:
+        self.model.save_model(os.path.join(path, "model.cbm"), format="cbm")
+        return {"model": "model.cbm"}
+
+    def load_artifacts(self, path: str, artifacts: Dict[str, Any]) -> None:
+        self.model.load_model(os.path.join(path, artifacts["model"]), format="cbm")
+        self.cat_indices = [
+            self.feature_names.index(name) for name in self.categorical_features
+        ]
+        if self.encoder is not None:
+            self.resolve_categories()
+
+    def log_fis_and_metrics(self, logger: "MlflowLogger", col_names: List[str]) -> None:
         # Log the model's hyperparameters and the code version
-        mlflow.log_params(self.cfg.model.hyperparams)
-        mlflow.log_param("commit_id", self.cfg.logging.commit_id)
+        logger.log_params(self.cfg.model.hyperparams)
+        logger.log_params({"commit_id": self.cfg.logging.commit_id})
         # Log feature importances
-        mlflow.log_metrics(
+        logger.log_metrics(
             {
                 f"fi_of_{col_name}": self.model.feature_importances_[i]
                 for i, col_name in enumerate(col_names)
@@ -85,7 +305,7 @@ class CatboostModel(BaseModel):
         rmse_scores = self.model.evals_result_["learn"]["RMSE"]
         assert len(r2_scores) == len(rmse_scores), "Something wrong with metrics!"
         for i in range(len(r2_scores)):
-            mlflow.log_metrics(
+            logger.log_metrics(
                 {"R2_metric": r2_scores[i], "RMSE_loss": rmse_scores[i]},
                 step=i * self.cfg.model.hyperparams.metric_period,
             )
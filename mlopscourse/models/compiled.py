@@ -0,0 +1,377 @@
+import json
+import os
+import tempfile
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .encoder import FeatureEncoder
+from .packed_forest import PackedForest
+
+
+if TYPE_CHECKING:
+    from catboost import CatBoostRegressor
+
+
+# The features a split depends on: None for a categorical feature and the sorted
+# borders of a float feature
+SplitInputs = Dict[str, Optional[np.ndarray]]
+
+
+def rebin(fine_borders: np.ndarray, coarse_borders: np.ndarray) -> np.ndarray:
+    """Maps the bins between `fine_borders` to the bins between their subset."""
+    return np.concatenate([[0], np.searchsorted(coarse_borders, fine_borders, "right")])
+
+
+def get_bin_values(borders: np.ndarray) -> np.ndarray:
+    """Returns a float32 value from each bin: the border isn't greater than itself."""
+    return np.append(borders, np.nextafter(borders[-1], np.float32(np.inf)))
+
+
+class CompiledCatboost:
+    """
+    A CatBoost model compiled into lookup tables evaluated with NumPy.
+
+    The categorical features are replaced by their codes from the shared encoder and the
+    float features by the indices of the bins between the model's borders. An oblivious
+    tree depends on a handful of these columns, so its leaf values are tabulated over
+    all their combinations. Each column then contributes its code times the stride to
+    the row's position in every table, and the prediction is a gather per column plus a
+    gather of the leaf values. The leaf values are summed in the order of the trees, as
+    CatBoost does, so the predictions are bit-exact.
+
+    Attributes
+    ----------
+    feature_names : List[str]
+        The features in the training order.
+    encoder : FeatureEncoder
+        The encoder of the features `predict` takes. The rows with the categories
+        unknown to it can't be looked up.
+    borders : Dict[str, numpy.ndarray]
+        The sorted float32 borders of each float feature.
+    groups : List[List[str]]
+        The features looked up together: the small categorical features are merged,
+        so that a row costs fewer gathers.
+    strides : List[numpy.ndarray]
+        For each group, the contribution of each combination of its codes to the
+        position in the tables, of shape (n_combinations, n_trees).
+    tree_offsets : numpy.ndarray
+        The start of each tree's table in `leaf_values`.
+    leaf_values : numpy.ndarray
+        The tables of all the trees one after another.
+    """
+
+    def __init__(
+        self,
+        model: "CatBoostRegressor",
+        feature_names: List[str],
+        encoder: FeatureEncoder,
+        max_group_size: int = 256,
+    ) -> None:
+        self.feature_names = feature_names
+        self.encoder = encoder
+        self.categories = encoder.categories
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model.save_model(os.path.join(tmp_dir, "model.json"), format="json")
+            with open(os.path.join(tmp_dir, "model.json")) as f:
+                model_json = json.load(f)
+        info = model_json["features_info"]
+        self.cat_features = [
+            feature_names[feature["flat_feature_index"]]
+            for feature in info.get("categorical_features", list())
+        ]
+        self.float_features = [
+            feature_names[feature["flat_feature_index"]]
+            for feature in info.get("float_features", list())
+        ]
+        self.scale, (self.bias,) = model_json["scale_and_bias"]
+
+        trees = model_json["oblivious_trees"]
+        split_inputs = [
+            [self._get_split_inputs(split, info) for split in tree["splits"]]
+            for tree in trees
+        ]
+        self.borders = {
+            name: self._merge_borders(
+                inputs[name]
+                for tree in split_inputs
+                for inputs in tree
+                if inputs.get(name) is not None
+            )
+            for name in self.float_features
+        }
+        strides = {
+            name: np.zeros((self._get_n_codes(name), len(trees)), dtype=np.int32)
+            for name in self.cat_features + self.float_features
+        }
+
+        leaf_counts = model.get_tree_leaf_counts().astype(np.int64)
+        tree_leaf_values = np.split(model.get_leaf_values(), np.cumsum(leaf_counts)[:-1])
+        tables = list()
+        for tree_index, inputs in enumerate(split_inputs):
+            tables.append(
+                self._tabulate_tree(
+                    model, tree_index, inputs, tree_leaf_values[tree_index], strides
+                )
+            )
+        self.tree_offsets = np.cumsum([0] + [len(table) for table in tables[:-1]])
+        self.leaf_values = np.concatenate(tables)
+        self._group_features(strides, max_group_size)
+
+    @staticmethod
+    def _merge_borders(borders: Iterable[Iterable[float]]) -> np.ndarray:
+        return np.unique(
+            np.concatenate([np.float32(list(b)) for b in borders] + [np.float32([])])
+        )
+
+    def _get_n_codes(self, name: str, borders: Optional[np.ndarray] = None) -> int:
+        if name in self.categories:
+            return len(self.categories[name])
+        return len(self.borders[name] if borders is None else borders) + 1
+
+    def _get_split_inputs(
+        self, split: Dict[str, Any], info: Dict[str, Any]
+    ) -> SplitInputs:
+        if split["split_type"] == "FloatFeature":
+            name = self.float_features[split["float_feature_index"]]
+            return {name: self._merge_borders([[split["border"]]])}
+        if split["split_type"] == "OneHotFeature":
+            return {self.cat_features[split["cat_feature_index"]]: None}
+        assert split["split_type"] == "OnlineCtr", f"Unknown split: {split['split_type']}"
+        # The CTR splits follow the float borders and the one-hot values
+        ctr_index = split["split_index"] - sum(
+            len(feature.get("borders") or list()) for feature in info["float_features"]
+        )
+        ctr_index -= sum(
+            len(feature.get("values", list()))
+            for feature in info.get("categorical_features", list())
+        )
+        for ctr in info["ctrs"]:
+            if ctr_index < len(ctr["borders"]):
+                break
+            ctr_index -= len(ctr["borders"])
+        # A CTR is calculated over a combination of the categorical features and
+        # the binarized float features, a float feature may be binarized several times
+        inputs: Dict[str, Any] = dict()
+        for element in ctr["elements"]:
+            if element["combination_element"] == "float_feature":
+                name = self.float_features[element["float_feature_index"]]
+                inputs.setdefault(name, list()).append(element["border"])
+            else:
+                inputs[self.cat_features[element["cat_feature_index"]]] = None
+        return {
+            name: None if borders is None else self._merge_borders([borders])
+            for name, borders in inputs.items()
+        }
+
+    def _probe_splits(
+        self, model: "CatBoostRegressor", tree_index: int, split_inputs: List[SplitInputs]
+    ) -> List[np.ndarray]:
+        """
+        Evaluates the tree on all the combinations of the codes of each split's inputs,
+        the other features being fixed. The result of the split at depth `d` is the
+        bit `d` of the leaf index.
+        """
+        if not split_inputs:
+            return list()
+        frames, sizes = list(), list()
+        for inputs in split_inputs:
+            grid = np.indices(
+                [self._get_n_codes(name, borders) for name, borders in inputs.items()]
+            ).reshape(len(inputs), -1)
+            frame = {
+                name: np.full(grid.shape[1], self.categories[name][0], dtype=object)
+                for name in self.cat_features
+            }
+            frame.update(
+                {
+                    name: np.zeros(grid.shape[1], dtype=np.float32)
+                    for name in self.float_features
+                }
+            )
+            for codes, (name, borders) in zip(grid, inputs.items()):
+                if borders is None:
+                    frame[name] = np.array(self.categories[name], dtype=object)[codes]
+                else:
+                    frame[name] = get_bin_values(borders)[codes]
+            frames.append(pd.DataFrame(frame)[self.feature_names])
+            sizes.append(grid.shape[1])
+        from catboost import Pool
+
+        leaf_indices = model.calc_leaf_indexes(
+            Pool(pd.concat(frames, ignore_index=True), cat_features=self.cat_features),
+            ntree_start=tree_index,
+            ntree_end=tree_index + 1,
+        )[:, 0].astype(np.int64)
+        return np.split(leaf_indices, np.cumsum(sizes)[:-1])
+
+    def _tabulate_tree(
+        self,
+        model: "CatBoostRegressor",
+        tree_index: int,
+        split_inputs: List[SplitInputs],
+        leaf_values: np.ndarray,
+        strides: Dict[str, np.ndarray],
+    ) -> np.ndarray:
+        # The dimensions of the table: the categorical features and the bins between
+        # the borders of the float features the tree uses
+        tree_inputs: SplitInputs = dict()
+        for name in self.cat_features + self.float_features:
+            borders = [inputs[name] for inputs in split_inputs if name in inputs]
+            if borders:
+                tree_inputs[name] = (
+                    None if borders[0] is None else self._merge_borders(borders)
+                )
+        sizes = [
+            self._get_n_codes(name, borders) for name, borders in tree_inputs.items()
+        ]
+        grid = dict(zip(tree_inputs, np.indices(sizes).reshape(len(sizes), -1)))
+        for name, stride in zip(tree_inputs, np.cumprod([1] + sizes[::-1])[-2::-1]):
+            if tree_inputs[name] is None:
+                codes = np.arange(len(self.categories[name]))
+            else:
+                codes = rebin(self.borders[name], tree_inputs[name])
+            strides[name][:, tree_index] = codes * stride
+
+        def get_codes(inputs: SplitInputs) -> Dict[str, np.ndarray]:
+            """Returns the codes of the split's inputs for each cell of the table."""
+            return {
+                name: grid[name]
+                if borders is None
+                else rebin(tree_inputs[name], borders)[grid[name]]
+                for name, borders in inputs.items()
+            }
+
+        categorical_splits = [
+            depth
+            for depth, inputs in enumerate(split_inputs)
+            if any(borders is None for borders in inputs.values())
+        ]
+        probed_leaf_indices = self._probe_splits(
+            model, tree_index, [split_inputs[depth] for depth in categorical_splits]
+        )
+        leaf_indices = np.zeros(int(np.prod(sizes)), dtype=np.int64)
+        for depth, inputs in enumerate(split_inputs):
+            codes = get_codes(inputs)
+            if depth not in categorical_splits:
+                # The only input is a float feature with a single border
+                bits = next(iter(codes.values()))
+            else:
+                # The position of each cell in the grid of the probed combinations
+                position = np.zeros_like(leaf_indices)
+                for name, borders in inputs.items():
+                    position = position * self._get_n_codes(name, borders) + codes[name]
+                probed = probed_leaf_indices[categorical_splits.index(depth)]
+                bits = (probed[position] >> depth) & 1
+            leaf_indices |= bits.astype(np.int64) << depth
+        return leaf_values[leaf_indices]
+
+    def _group_features(
+        self, strides: Dict[str, np.ndarray], max_group_size: int
+    ) -> None:
+        """
+        Merges the neighbouring categorical features into groups of at most
+        `max_group_size` combinations, each group costs a single gather per row.
+        """
+        self.groups: List[List[str]] = list()
+        group_size = 0
+        for name in self.cat_features:
+            group_size *= len(self.categories[name])
+            if not self.groups or group_size > max_group_size:
+                self.groups.append(list())
+                group_size = len(self.categories[name])
+            self.groups[-1].append(name)
+        self.groups.extend([name] for name in self.float_features)
+        self.strides: List[np.ndarray] = list()
+        for group in self.groups:
+            # The strides of a group are the sums over the combinations of its codes
+            group_strides = np.zeros((1, len(self.tree_offsets)), dtype=np.int32)
+            for name in group:
+                group_strides = (group_strides[:, None] + strides[name][None]).reshape(
+                    -1, len(self.tree_offsets)
+                )
+            self.strides.append(group_strides)
+
+    def quantize(self, X_encoded: np.ndarray) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """Returns the codes of the features and the mask of the rows that are known."""
+        codes, is_known = dict(), np.ones(len(X_encoded), dtype=bool)
+        for name in self.cat_features:
+            codes[name] = X_encoded[:, self.encoder.columns.index(name)].astype(np.int64)
+            is_known &= codes[name] >= 0
+        for name in self.float_features:
+            values = X_encoded[:, self.encoder.columns.index(name)]
+            codes[name] = np.searchsorted(self.borders[name], values, "left")
+            is_known &= ~np.isnan(values)
+        return codes, is_known
+
+    def predict(self, X_encoded: np.ndarray, chunk_size: int = 256) -> np.ndarray:
+        """
+        Predicts like `CatBoostRegressor.predict` on the features encoded by `encoder`.
+        The rows with unknown categories or missing values get NaN.
+        """
+        codes, is_known = self.quantize(X_encoded)
+        group_codes = list()
+        for group in self.groups:
+            group_codes.append(np.zeros(len(X_encoded), dtype=np.int64))
+            for name in group:
+                group_codes[-1] *= self._get_n_codes(name)
+                group_codes[-1] += np.where(is_known, codes[name], 0)
+        preds = np.empty(len(X_encoded), dtype=np.float64)
+        for start in range(0, len(X_encoded), chunk_size):
+            end = start + chunk_size
+            positions = np.zeros(
+                (min(end, len(X_encoded)) - start, len(self.tree_offsets)), dtype=np.int32
+            )
+            for strides, group_code in zip(self.strides, group_codes):
+                positions += strides[group_code[start:end]]
+            # The trees must be the outer axis for the sum to go tree by tree
+            positions = np.ascontiguousarray(positions.T) + self.tree_offsets[:, None]
+            preds[start:end] = self.leaf_values[positions].sum(axis=0)
+        preds = preds * self.scale + self.bias
+        preds[~is_known] = np.nan
+        return preds
+
+
+class CompiledForest:
+    """
+    A packed forest evaluated on the quantized features.
+
+    A node only tells whether a feature is greater than its threshold, so a feature can
+    be replaced by the number of the thresholds of this feature it is greater than, and
+    each threshold by its index among them. The comparisons, and thus the predictions,
+    stay exact, while the features shrink to 1 or 2 bytes.
+
+    Attributes
+    ----------
+    borders : List[numpy.ndarray]
+        The sorted thresholds of each encoded feature.
+    forest : PackedForest
+        The forest with the thresholds replaced by their indices in `borders`.
+    """
+
+    def __init__(self, forest: PackedForest) -> None:
+        feature = np.asarray(forest.arrays["feature"])
+        threshold = np.asarray(forest.arrays["threshold"])
+        self.borders = [
+            np.unique(threshold[feature == i]) for i in range(feature.max() + 1)
+        ]
+        self.dtype = np.min_scalar_type(max(len(borders) for borders in self.borders))
+        bin_threshold = np.zeros(len(threshold), dtype=self.dtype)
+        for i, borders in enumerate(self.borders):
+            nodes = feature == i
+            bin_threshold[nodes] = np.searchsorted(borders, threshold[nodes])
+        self.forest = PackedForest({**forest.arrays, "threshold": bin_threshold})
+
+    def quantize(self, X: np.ndarray) -> np.ndarray:
+        """Returns the bins of the encoded features."""
+        X = np.asarray(X, dtype=np.float32)
+        codes = np.empty((len(X), len(self.borders)), dtype=self.dtype)
+        for i, borders in enumerate(self.borders):
+            # A feature is greater than the thresholds strictly to the left of it
+            codes[:, i] = np.searchsorted(borders, X[:, i], "left")
+        return codes
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predicts like `RandomForestRegressor.predict` on the encoded features."""
+        return self.forest.predict(self.quantize(X))
@@ -0,0 +1,190 @@
+from typing import Any, Dict, List, Mapping, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+# A data frame or a record batch mapping each feature name to a 1D column
+Columns = Union[pd.DataFrame, Mapping[str, np.ndarray]]
+# The columns up to this size are looked up value by value, which is faster than
+# finding their distinct values first
+SMALL_COLUMN_SIZE = 16
+
+
+def decode_strings(values: np.ndarray) -> np.ndarray:
+    """Decodes an array of UTF-8 bytes into strings, each distinct value only once."""
+    if len(values) <= SMALL_COLUMN_SIZE:
+        return np.array(
+            [value.decode("utf-8") for value in values.tolist()], dtype=object
+        )
+    value_codes, uniques = pd.factorize(values.astype(object, copy=False))
+    decoded = np.array([value.decode("utf-8") for value in uniques] + [None])
+    return decoded[value_codes]
+
+
+def take_rows(X: Columns, rows: np.ndarray) -> Columns:
+    """Returns the `rows` of a data frame or a record batch, like `X.iloc[rows]`."""
+    if isinstance(X, pd.DataFrame):
+        return X.iloc[rows]
+    return {name: np.asarray(column).reshape(-1)[rows] for name, column in X.items()}
+
+
+class FeatureEncoder:
+    """
+    Encodes the categorical features into the indices of their categories, fitted once
+    on the train split and saved with the checkpoint, so that the training and every
+    serving path encode the same way.
+
+    The categories are looked up for the distinct values of a column only, or through a
+    table for integer columns, and a string category is also found by its UTF-8 bytes,
+    so that the string tensors of Triton can be encoded as they come.
+
+    Attributes
+    ----------
+    numerical_features : List[str]
+        The features passed through as float32.
+    categorical_features : List[str]
+        The features replaced by the indices of their categories, -1 for unknown values.
+    categories : Dict[str, List[Any]]
+        The sorted categories of each categorical feature, new ones are appended.
+    columns : List[str]
+        The order of the encoded columns: the categorical features, then the numerical
+        ones, like the `ColumnTransformer` of `RandomForest`.
+    """
+
+    def __init__(
+        self,
+        numerical_features: List[str],
+        categorical_features: List[str],
+        categories: Dict[str, List[Any]],
+    ) -> None:
+        self.numerical_features = numerical_features
+        self.categorical_features = categorical_features
+        self.categories = categories
+        self.columns = categorical_features + numerical_features
+        self._build_lookups()
+
+    @classmethod
+    def fit(
+        cls,
+        X: pd.DataFrame,
+        numerical_features: List[str],
+        categorical_features: List[str],
+    ) -> "FeatureEncoder":
+        categories = {
+            name: sorted(pd.unique(X[name].dropna()).tolist())
+            for name in categorical_features
+        }
+        return cls(numerical_features, categorical_features, categories)
+
+    def add_categories(self, X: pd.DataFrame) -> None:
+        """Appends the unseen categories of `X`, the known ones keep their indices."""
+        for name in self.categorical_features:
+            known = set(self.categories[name])
+            self.categories[name].extend(
+                sorted(
+                    value
+                    for value in pd.unique(X[name].dropna()).tolist()
+                    if value not in known
+                )
+            )
+        self._build_lookups()
+
+    def _build_lookups(self) -> None:
+        self._codes: Dict[str, Dict[Any, int]] = dict()
+        # The offset and the table of the indices of the integer categories, padded
+        # with -1 on both sides for the values out of their range
+        self._tables: Dict[str, Tuple[int, np.ndarray]] = dict()
+        # The categories of the last categorical column seen and their indices, the
+        # slices of the same frame share them
+        self._recoded: Dict[str, Tuple[pd.Index, np.ndarray]] = dict()
+        for name, values in self.categories.items():
+            codes = {value: code for code, value in enumerate(values)}
+            codes.update(
+                {
+                    value.encode("utf-8"): code
+                    for value, code in list(codes.items())
+                    if isinstance(value, str)
+                }
+            )
+            self._codes[name] = codes
+            if values and all(isinstance(value, int) for value in values):
+                offset = min(values) - 1
+                table = np.full(max(values) - offset + 2, -1, dtype=np.int32)
+                table[np.array(values) - offset] = np.arange(len(values))
+                self._tables[name] = (offset, table)
+
+    def encode_column(
+        self, name: str, column: Union[pd.Series, np.ndarray]
+    ) -> np.ndarray:
+        """Returns the indices of the categories of the column, -1 for unknown values."""
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Only the categories of the column are looked up, NaN has the code -1
+            categories = column.dtype.categories
+            cached = self._recoded.get(name)
+            if cached is None or cached[0] is not categories:
+                recoded = self._lookup(name, categories.to_numpy())
+                cached = self._recoded[name] = (categories, np.append(recoded, -1))
+            return cached[1][column.array.codes]
+        values = column.to_numpy() if isinstance(column, pd.Series) else column
+        if values.dtype.kind in "iu" and name in self._tables:
+            offset, table = self._tables[name]
+            index = np.clip(values.astype(np.intp) - offset, 0, len(table) - 1)
+            return table.take(index)
+        return self._lookup(name, values)
+
+    def _lookup(self, name: str, values: np.ndarray) -> np.ndarray:
+        codes = self._codes[name]
+        if len(values) <= SMALL_COLUMN_SIZE:
+            return np.array(
+                [codes.get(value, -1) for value in values.tolist()], dtype=np.int32
+            )
+        # Only the distinct values of a large column are looked up
+        value_codes, uniques = pd.factorize(values.astype(object, copy=False))
+        recoded = [codes.get(value, -1) for value in uniques.tolist()]
+        return np.array(recoded + [-1], dtype=np.int32)[value_codes]
+
+    def transform(self, X: Columns) -> np.ndarray:
+        """
+        Returns the C-contiguous float32 matrix of the encoded `columns`, which holds
+        the indices of the categories exactly.
+        """
+        columns = dict()
+        for name in self.columns:
+            column = X[name]
+            # The record batches may hold the columns as (n, 1) tensors
+            columns[name] = (
+                column
+                if isinstance(column, pd.Series)
+                else np.asarray(column).reshape(-1)
+            )
+        X_encoded = np.empty(
+            (len(columns[self.columns[0]]), len(self.columns)), np.float32
+        )
+        for i, name in enumerate(self.categorical_features):
+            X_encoded[:, i] = self.encode_column(name, columns[name])
+        for i, name in enumerate(self.numerical_features, len(self.categorical_features)):
+            column = columns[name]
+            X_encoded[:, i] = (
+                column.to_numpy() if isinstance(column, pd.Series) else column
+            )
+        return X_encoded
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the JSON-serializable description for the checkpoint's manifest."""
+        return {
+            "numerical_features": self.numerical_features,
+            "categorical_features": self.categorical_features,
+            "categories": self.categories,
+        }
+
+    @classmethod
+    def from_dict(cls, description: Dict[str, Any]) -> "FeatureEncoder":
+        return cls(**description)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The lookups are rebuilt after unpickling rather than stored
+        return self.to_dict()
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(**state)
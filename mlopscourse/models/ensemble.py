@@ -0,0 +1,200 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from omegaconf import DictConfig, OmegaConf
+
+from ..profiling import span
+from .base import ArraySample, BaseModel
+from .encoder import Columns
+from .models_zoo import load_checkpoint, prepare_model
+
+
+if TYPE_CHECKING:
+    from ..data.prepared import PreparedSplit
+    from ..mlflow_logger import MlflowLogger
+
+
+class EnsembleModel(BaseModel):
+    """
+    The weighted sum of the predictions of several models, e.g. the Random Forest and
+    CatBoost, which share one encoder of the features.
+
+    A batch is encoded once and the members predict on it concurrently in a thread
+    pool, since both sklearn and CatBoost release the GIL while predicting. The members
+    are set in `model.members` by their `name`, `weight` and `hyperparams`, or by the
+    `checkpoint` of an already trained model of the same split.
+    """
+
+    def __init__(
+        self,
+        cfg: DictConfig,
+        numerical_features: List[str],
+        categorical_features: List[str],
+    ) -> None:
+        super().__init__(cfg)
+
+        self.numerical_features = numerical_features
+        self.categorical_features = categorical_features
+        self.weights = [float(member.weight) for member in cfg.model.members]
+        self.members: List[BaseModel] = [
+            prepare_model(
+                self.get_member_config(i), numerical_features, categorical_features
+            )
+            for i in range(len(cfg.model.members))
+        ]
+        self.n_threads = cfg.model.get("n_threads") or len(self.members)
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get_member_config(self, index: int) -> DictConfig:
+        """The ensemble's configuration with the model replaced by the member."""
+        cfg = OmegaConf.to_container(self.cfg, resolve=True)
+        member = cfg["model"]["members"][index]
+        cfg["model"] = {"name": member["name"], "hyperparams": member["hyperparams"]}
+        return OmegaConf.create(cfg)
+
+    def train(
+        self,
+        X_train: pd.DataFrame,
+        y_train: pd.Series,
+        X_test: Optional[pd.DataFrame] = None,
+        y_test: Optional[pd.Series] = None,
+        prepared: Optional["PreparedSplit"] = None,
+    ) -> None:
+        assert self.encoder is not None, "The encoder must be fitted before the training!"
+        self.feature_names = list(X_train.columns)
+        for i, member_cfg in enumerate(self.cfg.model.members):
+            if member_cfg.get("checkpoint"):
+                with span("load_checkpoint"):
+                    member = load_checkpoint(member_cfg.checkpoint)
+                if (
+                    member.encoder is None
+                    or member.encoder.to_dict() != self.encoder.to_dict()
+                ):
+                    raise ValueError(
+                        f"The checkpoint {member_cfg.checkpoint} was trained on other "
+                        "categories than the ensemble, it must be retrained!"
+                    )
+                self.members[i] = member
+            else:
+                print(f"Training the {member_cfg.name} member...")
+                self.members[i].encoder = self.encoder
+                with span(f"fit_{member_cfg.name}"):
+                    self.members[i].train(X_train, y_train, prepared=prepared)
+            self.members[i].encoder = self.encoder
+        if X_test is not None:
+            assert y_test is not None, "For the evaluation, y_test must be provided!"
+            self.eval(X_test, y_test)
+
+    def train_incremental(
+        self,
+        X_new: pd.DataFrame,
+        y_new: pd.Series,
+        n_estimators: int,
+        X_val: Optional[pd.DataFrame] = None,
+        y_val: Optional[pd.Series] = None,
+    ) -> None:
+        # The members share the encoder, so the categories added by one are known to
+        # the rest
+        for member in self.members:
+            with span(f"fit_{member.cfg.model.name}"):
+                member.train_incremental(X_new, y_new, n_estimators, X_val, y_val)
+
+    def export_onnx(self, X_sample: pd.DataFrame) -> None:
+        """Exports the Random Forest members having the sklearn pipeline to ONNX."""
+        for member in self.members:
+            if member.cfg.model.name == "rf" and member.model is not None:
+                member.export_onnx(X_sample)
+
+    def eval(
+        self,
+        X_test: pd.DataFrame,
+        y_test: pd.Series,
+        prepared: Optional["PreparedSplit"] = None,
+    ) -> pd.Series:
+        from sklearn.metrics import r2_score
+
+        if prepared is None:
+            preds = self(X_test)
+        else:
+            with span("load_encoded"):
+                X_encoded = prepared.get_encoded(self.encoder)
+            preds = self.predict_encoded(X_test, X_encoded)
+        print(f"Ensemble R2: {r2_score(y_test, preds):.2f}")
+        return pd.Series(preds, name="ensemble_preds")
+
+    def __call__(self, X_sample: pd.DataFrame) -> np.ndarray:
+        with span("encode"):
+            X_encoded = self.encoder.transform(X_sample)
+        return self.predict_encoded(X_sample, X_encoded)
+
+    def predict_encoded(self, X_sample: Columns, X_encoded: np.ndarray) -> np.ndarray:
+        return self._blend(lambda member: member.predict_encoded(X_sample, X_encoded))
+
+    def predict_array(self, X_sample: ArraySample) -> np.ndarray:
+        return self._blend(lambda member: member.predict_array(X_sample))
+
+    def _blend(self, predict: Callable[[BaseModel], np.ndarray]) -> np.ndarray:
+        with span("members.predict"):
+            if self.n_threads > 1:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.n_threads, thread_name_prefix="ensemble"
+                    )
+                # The spans of the members are traced in the threads of the pool,
+                # outside of this one
+                members_preds = list(self._executor.map(predict, self.members))
+            else:
+                members_preds = [predict(member) for member in self.members]
+        preds = np.zeros(len(members_preds[0]), dtype=np.float64)
+        for weight, member_preds in zip(self.weights, members_preds):
+            preds += weight * np.asarray(member_preds, dtype=np.float64).reshape(-1)
+        return preds
+
+    def compile(self) -> None:
+        for member in self.members:
+            with span(f"compile_{member.cfg.model.name}"):
+                member.compile()
+
+    def set_thread_count(self, thread_count: int) -> None:
+        for member in self.members:
+            member.set_thread_count(thread_count)
+
+    def save_artifacts(self, path: str) -> Dict[str, Any]:
+        # Each member is saved as a native checkpoint of its own in a subdirectory
+        members = list()
+        for i, member in enumerate(self.members):
+            member.cfg.training.checkpoint_name = f"member_{i}_{member.cfg.model.name}"
+            member.cfg.training.checkpoint_format = "native"
+            member.watermark = self.watermark
+            member.save_checkpoint(os.path.join(path, ""))
+            members.append(member.cfg.training.checkpoint_name)
+        return {"members": members}
+
+    def load_artifacts(self, path: str, artifacts: Dict[str, Any]) -> None:
+        self.members = [
+            load_checkpoint(os.path.join(path, member)) for member in artifacts["members"]
+        ]
+        for member in self.members:
+            member.encoder = self.encoder
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The thread pool can't be pickled, so it is started again after loading
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
+    def log_fis_and_metrics(self, logger: "MlflowLogger") -> None:
+        # Log the members' weights and hyperparameters and the code version
+        logger.log_params({"commit_id": self.cfg.logging.commit_id})
+        for i, (weight, member) in enumerate(zip(self.weights, self.members)):
+            prefix = f"member_{i}_{member.cfg.model.name}"
+            logger.log_params({f"{prefix}.weight": weight})
+            logger.log_params(
+                {
+                    f"{prefix}.{name}": value
+                    for name, value in member.cfg.model.hyperparams.items()
+                }
+            )
@@ -1,10 +1,23 @@
+import importlib
+import json
+import os
+import pickle
 from typing import List
 
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 
-from .base import BaseModel
-from .catboost import CatboostModel
-from .random_forest import RandomForest
+from ..profiling import span
+from .base import CHECKPOINT_FORMAT_VERSION, MANIFEST_NAME, BaseModel
+from .encoder import FeatureEncoder
+
+
+# The module and the class of each model. The backends are slow to import, so a
+# model's module is only imported once the model is used.
+MODELS = {
+    "rf": ("random_forest", "RandomForest"),
+    "cb": ("catboost", "CatboostModel"),
+    "ensemble": ("ensemble", "EnsembleModel"),
+}
 
 
 def prepare_model(
@@ -12,9 +25,65 @@ def prepare_model(
     numerical_features: List[str],
     categorical_features: List[str],
 ) -> BaseModel:
-    if cfg.model.name == "rf":
-        return RandomForest(cfg, numerical_features, categorical_features)
-    elif cfg.model.name == "cb":
-        return CatboostModel(cfg, numerical_features, categorical_features)
-    else:
+    if cfg.model.name not in MODELS:
         raise AssertionError(f"Unknown model name: {cfg.model.name}")
+    module_name, class_name = MODELS[cfg.model.name]
+    module = importlib.import_module(f".{module_name}", __package__)
+    model_class = getattr(module, class_name)
+    return model_class(cfg, numerical_features, categorical_features)
+
+
+def resolve_checkpoint_path(path: str) -> str:
+    """Returns the manifest of a native checkpoint or the pickled model file."""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if os.path.isfile(manifest_path):
+        return manifest_path
+    return path if os.path.isfile(path) else path + ".p"
+
+
+def get_checkpoint_version(path: str) -> str:
+    """
+    Identifies the saved checkpoint by the modification time and the size of its main
+    file, since the manifest of a native checkpoint is rewritten on every save.
+    """
+    stat = os.stat(resolve_checkpoint_path(path))
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def load_checkpoint(path: str) -> BaseModel:
+    """
+    Loads a checkpoint saved by `BaseModel.save_checkpoint` in either format.
+
+    Parameters
+    ----------
+    path : str
+        The path to a native checkpoint directory or to a pickled model. The `.p`
+        extension of the latter may be omitted.
+    """
+    checkpoint_file = resolve_checkpoint_path(path)
+    if os.path.basename(checkpoint_file) != MANIFEST_NAME:
+        with span("pickle.load"), open(checkpoint_file, "rb") as f:
+            return pickle.load(f)
+
+    with open(checkpoint_file) as f:
+        manifest = json.load(f)
+    assert manifest["format_version"] == CHECKPOINT_FORMAT_VERSION, (
+        f"The checkpoint format version {manifest['format_version']} is not supported, "
+        f"expected {CHECKPOINT_FORMAT_VERSION}!"
+    )
+    model = prepare_model(
+        OmegaConf.create(manifest["config"]),
+        manifest["numerical_features"],
+        manifest["categorical_features"],
+    )
+    model.feature_names = manifest["feature_names"]
+    model.watermark = manifest.get("watermark")
+    if manifest.get("encoder") is not None:
+        model.encoder = FeatureEncoder.from_dict(manifest["encoder"])
+    if manifest.get("profile") is not None:
+        from ..monitoring import FeatureSketches
+
+        model.profile = FeatureSketches.from_dict(manifest["profile"], model.encoder)
+    with span("load_artifacts"):
+        model.load_artifacts(path, manifest["artifacts"])
+    return model
@@ -0,0 +1,141 @@
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
+
+
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestRegressor
+
+
+# The node arrays of a forest, each saved to a file of its own
+FOREST_ARRAYS = ["children", "feature", "threshold", "value", "roots"]
+
+
+class PackedForest:
+    """
+    The trees of a fitted sklearn forest packed into flat node arrays.
+
+    The arrays are stored as separate .npy files, so they can be memory-mapped: the
+    pages are loaded on demand and shared by all the processes serving the same
+    checkpoint.
+
+    Attributes
+    ----------
+    arrays : Dict[str, numpy.ndarray]
+        The node arrays of all the trees one after another, with the children indices
+        shifted accordingly, and the indices of the roots.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        self.arrays = arrays
+
+    @classmethod
+    def from_sklearn(cls, forest: "RandomForestRegressor") -> "PackedForest":
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+
+        arrays = {
+            # The left and the right child of a node are next to each other, so that
+            # the next node is `children[2 * node + go_right]`. The children of the
+            # leaves are never followed.
+            "children": np.concatenate(
+                [
+                    np.stack([tree.children_left, tree.children_right], axis=1)
+                    + offsets[i]
+                    for i, tree in enumerate(trees)
+                ]
+            ).reshape(-1),
+            "feature": np.concatenate([tree.feature for tree in trees]),
+            "threshold": np.concatenate([tree.threshold for tree in trees]),
+            "value": np.concatenate([tree.value[:, 0, 0] for tree in trees]),
+            "roots": offsets[:-1],
+        }
+        return cls(arrays)
+
+    @classmethod
+    def concatenate(cls, forests: List["PackedForest"]) -> "PackedForest":
+        """Packs the trees of several forests into one averaging all of them."""
+        offsets = np.cumsum([0] + [len(forest.arrays["feature"]) for forest in forests])
+        arrays = {
+            name: np.concatenate([np.asarray(forest.arrays[name]) for forest in forests])
+            for name in ["feature", "threshold", "value"]
+        }
+        # The node indices are shifted by the nodes of the preceding forests
+        for name in ["children", "roots"]:
+            arrays[name] = np.concatenate(
+                [
+                    np.asarray(forest.arrays[name]) + offset
+                    for forest, offset in zip(forests, offsets)
+                ]
+            )
+        return cls(arrays)
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        for name in FOREST_ARRAYS:
+            # The arrays may be memory-mapped from the files being replaced, which are
+            # kept alive by the mappings only if they are replaced instead of rewritten
+            array_path = os.path.join(path, f"{name}.npy")
+            with open(array_path + ".tmp", "wb") as f:
+                np.save(f, self.arrays[name])
+            os.replace(array_path + ".tmp", array_path)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> "PackedForest":
+        return cls(
+            {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                for name in FOREST_ARRAYS
+            }
+        )
+
+    def predict(self, X: np.ndarray, chunk_size: int = 4096) -> np.ndarray:
+        """
+        Predicts like `RandomForestRegressor.predict` by descending all the trees at
+        once for a chunk of rows.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            The encoded features in the order the forest was fitted on, or their bins
+            for the forest of a `CompiledForest`.
+        chunk_size : int
+            The number of rows descended at once, bounds the (trees, rows) buffers.
+        """
+        X = np.asarray(X)
+        # sklearn compares float32 features with float64 thresholds, while the bins of
+        # a quantized forest are compared with the bin thresholds as is
+        if X.dtype.kind not in "iu":
+            X = X.astype(np.float32)
+        preds = np.empty(len(X), dtype=np.float64)
+        for start in range(0, len(X), chunk_size):
+            preds[start : start + chunk_size] = self._predict_chunk(
+                X[start : start + chunk_size]
+            )
+        return preds
+
+    def _predict_chunk(self, X: np.ndarray) -> np.ndarray:
+        children = self.arrays["children"]
+        feature = self.arrays["feature"]
+        threshold = self.arrays["threshold"]
+        roots = np.asarray(self.arrays["roots"])
+
+        n_rows, n_features = X.shape
+        # The (tree, row) pairs are flattened, the row is addressed by its offset in X
+        nodes = np.repeat(roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows) * n_features, len(roots))
+        # sklearn marks the leaves with a negative feature index
+        active = np.nonzero(feature[nodes] >= 0)[0]
+        X = X.reshape(-1)
+        while len(active) > 0:
+            active_nodes = nodes[active]
+            go_right = X[row_offsets[active] + feature[active_nodes]] > (
+                threshold[active_nodes]
+            )
+            next_nodes = children[2 * active_nodes + go_right]
+            nodes[active] = next_nodes
+            active = active[feature[next_nodes] >= 0]
+        # Summing the trees one by one, as sklearn does
+        values = self.arrays["value"][nodes].reshape(len(roots), n_rows)
+        return values.sum(axis=0) / len(roots)
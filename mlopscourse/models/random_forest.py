@@ -1,22 +1,53 @@
-from typing import List, Optional
+import os
+import shutil
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
-import mlflow
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
 from omegaconf import DictConfig
 from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import OrdinalEncoder
-from tqdm import tqdm
 
-from .base import BaseModel
+from ..profiling import span
+from .base import ArraySample, BaseModel
+from .binning import FeatureBinner
+from .compiled import CompiledForest
+from .encoder import Columns, FeatureEncoder
+from .packed_forest import PackedForest
+
+
+if TYPE_CHECKING:
+    import onnx
+    import onnxruntime as ort
+
+    from ..data.prepared import PreparedSplit
+    from ..mlflow_logger import MlflowLogger
+
+
+ONNX_TO_NUMPY_DTYPES = {
+    "tensor(string)": np.str_,
+    "tensor(int64)": np.int64,
+    "tensor(double)": np.float64,
+    "tensor(float)": np.float32,
+}
+# The hyperparameters of `RandomForest` itself, the rest are of the sklearn forest
+MODEL_PARAMS = ["max_bins"]
 
 
 class RandomForest(BaseModel):
     """A basic Random Forest model from sklearn."""
 
+    STATE_DEFAULTS = {
+        **BaseModel.STATE_DEFAULTS,
+        "max_bins": None,
+        "onnx_model": None,
+        "_session": None,
+        "forest": None,
+    }
+
     def __init__(
         self,
         cfg: DictConfig,
@@ -25,6 +56,8 @@ class RandomForest(BaseModel):
     ) -> None:
         super().__init__(cfg)
 
+        self.numerical_features = numerical_features
+        self.categorical_features = categorical_features
         self.preprocessor = ColumnTransformer(
             transformers=[
                 ("cat", OrdinalEncoder(dtype=np.int64), categorical_features),
@@ -32,10 +65,19 @@ class RandomForest(BaseModel):
             ],
             sparse_threshold=1,
             verbose_feature_names_out=False,
-        ).set_output(transform="pandas")
+        )
         self.model = make_pipeline(
-            self.preprocessor, RandomForestRegressor(**cfg.model.hyperparams)
+            self.preprocessor, RandomForestRegressor(**self.get_forest_params())
         )
+        # The number of the bins the features are binned into for the training, if set
+        self.max_bins: Optional[int] = cfg.model.hyperparams.get("max_bins")
+        # The serialized ONNX export (or the path to it in a native checkpoint) and the
+        # session for the fast inference path
+        self.onnx_model: Optional[Union[bytes, str]] = None
+        self._session: Optional["ort.InferenceSession"] = None
+        # A native checkpoint is loaded without the sklearn pipeline, the trees are
+        # memory-mapped
+        self.forest: Optional[PackedForest] = None
 
     def train(
         self,
@@ -43,27 +85,256 @@ class RandomForest(BaseModel):
         y_train: pd.Series,
         X_test: Optional[pd.DataFrame] = None,
         y_test: Optional[pd.Series] = None,
+        prepared: Optional["PreparedSplit"] = None,
     ) -> None:
-        self.model.fit(X_train, y_train)
+        assert self.encoder is not None, "The encoder must be fitted before the training!"
+        self.feature_names = list(X_train.columns)
+        # The pipeline encodes the categories as the shared encoder does for the export
+        self.preprocessor.set_params(
+            cat__categories=[
+                self.encoder.categories[name] for name in self.categorical_features
+            ]
+        )
+        if prepared is None:
+            X_encoded = self.encode(X_train)
+        else:
+            with span("load_encoded"):
+                X_encoded = prepared.get_encoded(self.encoder)
+        # The categories are set, so the encoding of the pipeline is fitted on a row,
+        # and the trees on the float32 encoded matrix instead of its float64 output
+        self.preprocessor.fit(X_train.iloc[:1])
+        self.fit_forest(
+            self.model.named_steps["randomforestregressor"], X_encoded, y_train
+        )
         if X_test is not None:
             assert y_test is not None, "For the evaluation, y_test must be provided!"
             self.eval(X_test, y_test)
 
-    def eval(self, X_test: pd.DataFrame, y_test: pd.Series) -> pd.Series:
-        print(f"Test R2 score: {self.model.score(X_test, y_test):.2f}")
-        return pd.Series(self.model.predict(X_test), name="rf_preds")
+    def train_incremental(
+        self,
+        X_new: pd.DataFrame,
+        y_new: pd.Series,
+        n_estimators: int,
+        X_val: Optional[pd.DataFrame] = None,
+        y_val: Optional[pd.Series] = None,
+    ) -> None:
+        if self.model is not None:
+            # The encoder keeps its categories, so only the forest is fitted further
+            forest = self.model.named_steps["randomforestregressor"]
+            forest.set_params(
+                warm_start=True, n_estimators=forest.n_estimators + n_estimators
+            )
+            self.fit_forest(forest, self.encode(X_new), y_new)
+        else:
+            # A native checkpoint has no sklearn trees to warm-start, so the new trees
+            # are packed after the old ones, which averages them all the same way
+            forest = RandomForestRegressor(
+                **{**self.get_forest_params(), "n_estimators": n_estimators}
+            )
+            self.fit_forest(forest, self.encode(X_new), y_new)
+            self.forest = PackedForest.concatenate(
+                [self.forest, PackedForest.from_sklearn(forest)]
+            )
+            # The export lacks the new trees and can't be redone without the pipeline
+            self.onnx_model, self._session = None, None
+        self.compiled = None
+        if X_val is not None:
+            assert y_val is not None, "For the evaluation, y_val must be provided!"
+            self.eval(X_val, y_val)
+
+    def get_forest_params(self) -> Dict[str, Any]:
+        """Returns the hyperparameters of the sklearn forest."""
+        return {
+            name: value
+            for name, value in self.cfg.model.hyperparams.items()
+            if name not in MODEL_PARAMS
+        }
+
+    def fit_forest(
+        self, forest: RandomForestRegressor, X_encoded: np.ndarray, y: pd.Series
+    ) -> None:
+        """
+        Fits the new trees of the `forest`, on the bins of the features if `max_bins`
+        is set. The trees are built by sklearn's threads, which share the matrix, so a
+        prepared one is only mapped once.
+        """
+        if self.max_bins is None:
+            with span("sklearn.fit"):
+                forest.fit(X_encoded, y)
+            return
+        n_fitted = len(forest.estimators_) if hasattr(forest, "estimators_") else 0
+        with span("fit_bins"):
+            binner = FeatureBinner.fit(X_encoded, self.max_bins, forest.random_state or 0)
+            X_binned = binner.transform(X_encoded)
+        with span("sklearn.fit"):
+            forest.fit(X_binned, y)
+        binner.restore_thresholds(forest.estimators_[n_fitted:])
+
+    def eval(
+        self,
+        X_test: pd.DataFrame,
+        y_test: pd.Series,
+        prepared: Optional["PreparedSplit"] = None,
+    ) -> pd.Series:
+        from sklearn.metrics import r2_score
+
+        if prepared is None:
+            preds = self(X_test)
+        else:
+            with span("load_encoded"):
+                X_encoded = prepared.get_encoded(self.encoder)
+            preds = self.predict_encoded(X_test, X_encoded)
+        print(f"Test R2 score: {r2_score(y_test, preds):.2f}")
+        return pd.Series(preds, name="rf_preds")
 
     def __call__(self, X_sample: pd.DataFrame) -> np.ndarray:
-        return self.model.predict(X_sample)
+        if self.encoder is None:
+            # The checkpoints pickled before the shared encoder have only the pipeline
+            with span("sklearn.predict"):
+                return self.model.predict(X_sample)
+        # Every path predicts on the features encoded by the shared encoder, which
+        # the trees of the pipeline were fitted on as well
+        with span("encode"):
+            X_encoded = self.encoder.transform(X_sample)
+        return self.predict_encoded(X_sample, X_encoded)
+
+    def predict_encoded(self, X_sample: Columns, X_encoded: np.ndarray) -> np.ndarray:
+        self.check_categories(X_encoded)
+        if self.compiled is not None:
+            with span("compiled.predict"):
+                return self.compiled.predict(X_encoded)
+        if self.model is None:
+            with span("packed_forest.predict"):
+                return self.forest.predict(X_encoded)
+        with span("sklearn.predict"):
+            return self.model.named_steps["randomforestregressor"].predict(X_encoded)
+
+    def encode(self, X_sample: pd.DataFrame) -> np.ndarray:
+        """Does what the fitted `preprocessor` does with the shared encoder."""
+        with span("encode"):
+            X_encoded = self.encoder.transform(X_sample)
+        self.check_categories(X_encoded)
+        return X_encoded
+
+    def check_categories(self, X_encoded: np.ndarray) -> None:
+        """Raises like the fitted `OrdinalEncoder` if a category is unknown."""
+        is_unknown = (X_encoded[:, : len(self.categorical_features)] < 0).any(axis=0)
+        if is_unknown.any():
+            name = self.categorical_features[int(np.argmax(is_unknown))]
+            raise ValueError(f"Found unknown categories in the column {name}!")
+
+    def compile(self) -> None:
+        forest = self.forest
+        if forest is None:
+            forest = PackedForest.from_sklearn(
+                self.model.named_steps["randomforestregressor"]
+            )
+        # The compiled forest is fed by `encode` just as the packed one
+        self.compiled = CompiledForest(forest)
+
+    def set_thread_count(self, thread_count: int) -> None:
+        # The packed forest of a native checkpoint always predicts in one thread
+        if self.model is not None:
+            self.model.named_steps["randomforestregressor"].set_params(
+                n_jobs=thread_count
+            )
+
+    def save_artifacts(self, path: str) -> Dict[str, Any]:
+        artifacts: Dict[str, Any] = {"forest": "forest"}
+        forest = self.forest
+        if self.model is not None:
+            with span("pack_forest"):
+                forest = PackedForest.from_sklearn(
+                    self.model.named_steps["randomforestregressor"]
+                )
+        forest.save(os.path.join(path, artifacts["forest"]))
+        if self.onnx_model is not None:
+            artifacts["onnx_model"] = "model.onnx"
+            onnx_path = os.path.join(path, artifacts["onnx_model"])
+            if isinstance(self.onnx_model, str):
+                # A loaded native checkpoint keeps only the path to its export
+                if os.path.abspath(self.onnx_model) != os.path.abspath(onnx_path):
+                    shutil.copyfile(self.onnx_model, onnx_path)
+            else:
+                with open(onnx_path, "wb") as f:
+                    f.write(self.onnx_model)
+        return artifacts
+
+    def load_artifacts(self, path: str, artifacts: Dict[str, Any]) -> None:
+        self.model = None
+        if self.encoder is None:
+            # The checkpoints saved before the shared encoder kept the categories here
+            self.encoder = FeatureEncoder(
+                self.numerical_features,
+                self.categorical_features,
+                artifacts["categories"],
+            )
+        self.forest = PackedForest.load(os.path.join(path, artifacts["forest"]))
+        if "onnx_model" in artifacts:
+            # ONNX Runtime reads the file itself once the session is needed
+            self.onnx_model = os.path.join(path, artifacts["onnx_model"])
+
+    def export_onnx(self, X_sample: pd.DataFrame) -> "onnx.ModelProto":
+        # skl2onnx is only needed to export, so inference doesn't import it
+        from skl2onnx import to_onnx
+
+        # ONNX LabelEncoder supports neither the compact integers of the cached
+        # dataset nor categorical columns, so the sample is converted to the wider types
+        X_sample = X_sample.astype(
+            {
+                name: str if dtype == "category" else np.int64
+                for name, dtype in X_sample.dtypes.items()
+                if dtype == "category" or dtype.kind == "i"
+            }
+        )
+        with span("to_onnx"):
+            model_onnx = to_onnx(self.model, X=X_sample, verbose=1)
+        self.onnx_model = model_onnx.SerializeToString()
+        self._session = None
+        return model_onnx
+
+    def _get_session(self) -> "ort.InferenceSession":
+        if self._session is None:
+            import onnxruntime as ort
+
+            assert self.onnx_model is not None, "The model must be exported to ONNX!"
+            self._session = ort.InferenceSession(
+                self.onnx_model, providers=["CPUExecutionProvider"]
+            )
+            # The inputs are resolved once, so that feeding is just a cast per column
+            self._inputs = [
+                (inp.name, ONNX_TO_NUMPY_DTYPES[inp.type])
+                for inp in self._session.get_inputs()
+            ]
+        return self._session
+
+    def predict_array(self, X_sample: ArraySample) -> np.ndarray:
+        columns = dict(zip(self.feature_names, self.get_columns(X_sample)))
+        if self.onnx_model is None:
+            # A native checkpoint trained further has no export, its packed forest has
+            # all the trees
+            return self.predict_encoded(columns, self.encoder.transform(columns))
+        session = self._get_session()
+        feed = {
+            name: columns[name].astype(dtype, copy=False).reshape(-1, 1)
+            for name, dtype in self._inputs
+        }
+        return session.run(None, feed)[0].reshape(-1)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # ONNX Runtime sessions can't be pickled, so it is rebuilt after loading
+        state = self.__dict__.copy()
+        state["_session"] = None
+        return state
 
     def log_fis_and_metrics(
-        self, exp_id: str, X_train: pd.DataFrame, y_train: pd.Series
+        self, logger: "MlflowLogger", X_train: pd.DataFrame, y_train: pd.Series
     ) -> None:
         # Log the model's hyperparameters and the code version
-        mlflow.log_params(self.cfg.model.hyperparams)
-        mlflow.log_param("commit_id", self.cfg.logging.commit_id)
+        logger.log_params(self.cfg.model.hyperparams)
+        logger.log_params({"commit_id": self.cfg.logging.commit_id})
         # Log feature importances
-        mlflow.log_metrics(
+        logger.log_metrics(
             {
                 f"fi_of_{col_name}": self.model.named_steps[
                     "randomforestregressor"
@@ -71,18 +342,27 @@ class RandomForest(BaseModel):
                 for i, col_name in enumerate(X_train.columns)
             }
         )
-        # Log R2 and RMSE metrics
-        for i in tqdm(range(0, self.cfg.model.hyperparams.n_estimators)):
-            model_i = make_pipeline(
-                self.preprocessor, RandomForestRegressor(**self.cfg.model.hyperparams)
-            )
-            model_i.named_steps["randomforestregressor"].n_estimators = i + 1
-            model_i.fit(X_train, y_train)
-            y_pred = model_i.predict(X_train)
-            mlflow.log_metrics(
-                {
-                    "R2_metric": r2_score(y_train, y_pred),
-                    "RMSE_metric": mean_squared_error(y_train, y_pred, squared=False),
-                },
-                step=i,
-            )
+        # Log R2 and RMSE metrics of the forests consisting of the first i + 1 trees.
+        # Since sklearn seeds the trees sequentially, such a forest is exactly the
+        # prefix of the trained one, so the trees' predictions are just accumulated.
+        forest = self.model.named_steps["randomforestregressor"]
+        X_encoded = self.encode(X_train)
+        # The predictions of the trees are accumulated as they come, since all of
+        # them would take as much memory as the forest on a large split
+        tree_preds = Parallel(
+            n_jobs=forest.n_jobs, prefer="threads", return_as="generator"
+        )(delayed(tree.predict)(X_encoded) for tree in forest.estimators_)
+        y_true = y_train.to_numpy(dtype=np.float64)
+        total_sum_of_squares = np.sum((y_true - y_true.mean()) ** 2)
+        preds_sum = np.zeros_like(y_true)
+        with span("tree_predictions"):
+            for i, tree_pred in enumerate(tree_preds):
+                preds_sum += tree_pred
+                residual_sum_of_squares = np.sum((y_true - preds_sum / (i + 1)) ** 2)
+                logger.log_metrics(
+                    {
+                        "R2_metric": 1 - residual_sum_of_squares / total_sum_of_squares,
+                        "RMSE_metric": np.sqrt(residual_sum_of_squares / len(y_true)),
+                    },
+                    step=i,
+                )
@@ -0,0 +1,395 @@
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from omegaconf import DictConfig
+
+from .models.encoder import Columns, FeatureEncoder
+
+
+# The bins between the percentiles of the reference sketching a continuous feature,
+# PSI is computed on their groups between the deciles, since it's biased upwards by
+# the sparse bins of a small window
+N_QUANTILE_BINS = 100
+N_PSI_BINS = 10
+# The integer features with a wider range are sketched as continuous ones
+MAX_DISCRETE_RANGE = 1000
+# Replaces the empty fractions in PSI, which would be infinite
+PSI_EPSILON = 1e-4
+# The small batches are buffered and sketched together once they have this many rows,
+# since sketching a batch costs about the same for a row and for a thousand
+BUFFER_SIZE = 1024
+
+# The drift scores of the features in a window of the stream, see `DriftMonitor`
+DriftReport = Dict[str, Any]
+
+
+class FeatureSketches:
+    """
+    Constant-memory sketches of the features of a stream of batches, laid out by a
+    reference sample, the train split:
+
+    - a discrete feature, a categorical or an integer one, is counted by its value, with
+      a bucket for the unknown, missing or lesser values first and one for the greater
+      values and new categories last;
+    - a continuous feature is counted by the bins between the percentiles of the
+      reference and the missing values, which makes a quantile sketch relative to the
+      reference, and its running mean, variance, minimum and maximum are kept.
+
+    All the counts of a batch are a single `bincount` of its encoded matrix. The
+    batches of less than `BUFFER_SIZE` rows are only encoded into a buffer until it's
+    full, so the counts and the moments are up to date after `flush`.
+
+    Attributes
+    ----------
+    encoder : FeatureEncoder
+        The encoder of the checkpoint, which isn't saved with the sketches.
+    discrete : Dict[str, Tuple[int, int]]
+        The lowest value and the number of the values of each discrete feature.
+    edges : Dict[str, List[float]]
+        The edges between the bins of each continuous feature.
+    counts : numpy.ndarray
+        The counts of the buckets of all the features one after another.
+    """
+
+    def __init__(
+        self,
+        encoder: FeatureEncoder,
+        discrete: Dict[str, Tuple[int, int]],
+        edges: Dict[str, List[float]],
+    ) -> None:
+        self.encoder = encoder
+        self.discrete = discrete
+        self.edges = edges
+        columns = encoder.columns
+        self._discrete_indices = [columns.index(name) for name in discrete]
+        self._lows = np.array([low for low, _ in discrete.values()], dtype=np.float64)
+        self._highs = np.array(
+            [size + 1 for _, size in discrete.values()], dtype=np.float64
+        )
+        self._continuous_indices = [columns.index(name) for name in edges]
+        self._edges = [np.asarray(values, dtype=np.float32) for values in edges.values()]
+        # Each discrete feature has its values and 2 more buckets, each continuous one
+        # its bins and the missing values
+        sizes = [size + 2 for _, size in discrete.values()]
+        sizes.extend(len(values) + 2 for values in edges.values())
+        self._offsets = np.cumsum([0] + sizes)
+        self._names = list(discrete) + list(edges)
+        self.counts = np.zeros(self._offsets[-1], dtype=np.int64)
+        # Including the buffered rows
+        self.n_rows = 0
+        self._buffer = np.empty((BUFFER_SIZE, len(columns)), dtype=np.float32)
+        self._n_buffered = 0
+        # The running moments of the continuous features, which are merged batch by
+        # batch as in Chan et al.
+        n_continuous = len(edges)
+        self.n_values = np.zeros(n_continuous, dtype=np.int64)
+        self.mean = np.zeros(n_continuous)
+        self.m2 = np.zeros(n_continuous)
+        self.min = np.full(n_continuous, np.nan)
+        self.max = np.full(n_continuous, np.nan)
+
+    @classmethod
+    def fit(
+        cls, X: pd.DataFrame, encoder: FeatureEncoder, n_bins: int = N_QUANTILE_BINS
+    ) -> "FeatureSketches":
+        """Lays the sketches out by the reference sample `X` and sketches it."""
+        discrete = {
+            name: (0, len(encoder.categories[name]))
+            for name in encoder.categorical_features
+        }
+        edges = dict()
+        for name in encoder.numerical_features:
+            values = X[name].dropna().to_numpy()
+            if values.dtype.kind in "iub":
+                low, high = int(values.min()), int(values.max())
+                if high - low < MAX_DISCRETE_RANGE:
+                    discrete[name] = (low, high - low + 1)
+                    continue
+            # The edges are unique, so the ties don't make empty bins
+            percentiles = np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1])
+            edges[name] = np.unique(percentiles.astype(np.float32)).tolist()
+        sketches = cls(encoder, discrete, edges)
+        sketches.update(X)
+        return sketches
+
+    def empty_like(self) -> "FeatureSketches":
+        """Returns the empty sketches of the same layout."""
+        return FeatureSketches(self.encoder, self.discrete, self.edges)
+
+    def update(self, X: Columns, X_encoded: Optional[np.ndarray] = None) -> None:
+        """
+        Adds a data frame or a record batch to the sketches, already encoded by the
+        `encoder` as `X_encoded` if it's given.
+        """
+        if X_encoded is None:
+            X_encoded = self.encoder.transform(X)
+        n_rows = X_encoded.shape[0]
+        self.n_rows += n_rows
+        if self._n_buffered + n_rows > BUFFER_SIZE:
+            self.flush()
+        if n_rows >= BUFFER_SIZE:
+            self._add(X_encoded)
+        else:
+            self._buffer[self._n_buffered : self._n_buffered + n_rows] = X_encoded
+            self._n_buffered += n_rows
+
+    def flush(self) -> None:
+        """Sketches the buffered rows."""
+        if self._n_buffered > 0:
+            self._add(self._buffer[: self._n_buffered])
+            self._n_buffered = 0
+
+    def _add(self, X_encoded: np.ndarray) -> None:
+        n_rows = X_encoded.shape[0]
+        buckets = np.empty((n_rows, len(self._names)), dtype=np.intp)
+        n_discrete = len(self._discrete_indices)
+        # The codes of the unknown categories are -1 and the missing values are NaN,
+        # both go to the first bucket
+        values = X_encoded[:, self._discrete_indices] - self._lows + 1
+        np.clip(np.nan_to_num(values, nan=0), 0, self._highs, out=values)
+        buckets[:, :n_discrete] = values
+        continuous = X_encoded[:, self._continuous_indices]
+        is_missing = np.isnan(continuous)
+        for i, edges in enumerate(self._edges):
+            bins = np.searchsorted(edges, continuous[:, i], side="right")
+            bins[is_missing[:, i]] = len(edges) + 1
+            buckets[:, n_discrete + i] = bins
+        buckets += self._offsets[:-1]
+        self.counts += np.bincount(buckets.ravel(), minlength=len(self.counts))
+
+        n_values = n_rows - is_missing.sum(axis=0)
+        has_values = n_values > 0
+        if not has_values.any():
+            return
+        continuous = continuous.astype(np.float64)
+        # NaN is neither the minimum nor the maximum with fmin and fmax
+        self.min = np.fmin(self.min, np.fmin.reduce(continuous, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(continuous, axis=0))
+        batch_mean = np.where(
+            has_values, np.nansum(continuous, axis=0) / np.maximum(n_values, 1), 0
+        )
+        batch_m2 = np.nansum((continuous - batch_mean) ** 2, axis=0)
+        total = self.n_values + n_values
+        delta = batch_mean - self.mean
+        self.mean += np.where(has_values, delta * n_values / np.maximum(total, 1), 0)
+        self.m2 += batch_m2 + delta**2 * self.n_values * n_values / np.maximum(total, 1)
+        self.n_values = total
+
+    def get_counts(self, name: str) -> np.ndarray:
+        i = self._names.index(name)
+        return self.counts[self._offsets[i] : self._offsets[i + 1]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the JSON-serializable description for the checkpoint's manifest."""
+        self.flush()
+        return {
+            "discrete": {name: list(value) for name, value in self.discrete.items()},
+            "edges": self.edges,
+            "counts": self.counts.tolist(),
+            "n_rows": self.n_rows,
+            "n_values": self.n_values.tolist(),
+            "mean": self.mean.tolist(),
+            "m2": self.m2.tolist(),
+            "min": self.min.tolist(),
+            "max": self.max.tolist(),
+        }
+
+    @classmethod
+    def from_dict(
+        cls, description: Dict[str, Any], encoder: FeatureEncoder
+    ) -> "FeatureSketches":
+        sketches = cls(
+            encoder,
+            {name: tuple(value) for name, value in description["discrete"].items()},
+            description["edges"],
+        )
+        sketches.counts = np.array(description["counts"], dtype=np.int64)
+        sketches.n_rows = description["n_rows"]
+        sketches.n_values = np.array(description["n_values"], dtype=np.int64)
+        for name in ["mean", "m2", "min", "max"]:
+            setattr(sketches, name, np.array(description[name], dtype=np.float64))
+        return sketches
+
+
+def psi(reference: np.ndarray, current: np.ndarray) -> float:
+    """The population stability index of the counts of the same buckets."""
+    reference = np.maximum(reference / max(reference.sum(), 1), PSI_EPSILON)
+    current = np.maximum(current / max(current.sum(), 1), PSI_EPSILON)
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+
+def compute_drift(
+    reference: FeatureSketches, current: FeatureSketches
+) -> Dict[str, Dict[str, float]]:
+    """
+    Compares the sketches of a window of the stream with the reference ones. Each
+    feature gets its PSI and the rate of the values unseen in the reference, the
+    continuous ones also get the KS statistic at the bin edges, which is off by at most
+    the mass of a bin, and their moments.
+    """
+    reference.flush()
+    current.flush()
+    scores = dict()
+    for name in reference.discrete:
+        reference_counts = reference.get_counts(name)
+        counts = current.get_counts(name)
+        scores[name] = {
+            "psi": psi(reference_counts, counts),
+            "unseen_rate": (counts[0] + counts[-1]) / max(counts.sum(), 1),
+        }
+    for i, name in enumerate(reference.edges):
+        # The missing values are the last bucket
+        reference_counts = reference.get_counts(name)[:-1]
+        counts = current.get_counts(name)[:-1]
+        n_values, n_reference = max(counts.sum(), 1), max(reference_counts.sum(), 1)
+        # The bins are grouped by the deciles of the reference, which they don't cross
+        start_fraction = (np.cumsum(reference_counts) - reference_counts) / n_reference
+        groups = np.minimum(start_fraction * N_PSI_BINS + 1e-9, N_PSI_BINS - 1)
+        groups = groups.astype(np.intp)
+        ks = np.abs(
+            np.cumsum(counts) / n_values - np.cumsum(reference_counts) / n_reference
+        )
+        scores[name] = {
+            "psi": psi(
+                np.bincount(groups, reference_counts, N_PSI_BINS),
+                np.bincount(groups, counts, N_PSI_BINS),
+            ),
+            "ks": float(ks.max()),
+            "missing_rate": current.get_counts(name)[-1] / max(current.n_rows, 1),
+            "mean": float(current.mean[i]),
+            "reference_mean": float(reference.mean[i]),
+            "std": float(np.sqrt(current.m2[i] / max(current.n_values[i], 1))),
+            "reference_std": float(
+                np.sqrt(reference.m2[i] / max(reference.n_values[i], 1))
+            ),
+            "min": float(current.min[i]),
+            "max": float(current.max[i]),
+        }
+    return scores
+
+
+class DriftMonitor:
+    """
+    Sketches the served batches and compares them with the reference sketches of the
+    train split saved with the checkpoint. Every `interval_sec`, once the window since
+    the last report has `min_rows`, its drift scores are reported to `on_report` and
+    the window starts over, so the memory stays constant however long the stream is.
+
+    Attributes
+    ----------
+    reference : FeatureSketches
+        The sketches of the train split.
+    interval_sec : float
+        The minimum time between the reports.
+    min_rows : int
+        The minimum number of the rows of a window, a shorter one is extended.
+    psi_threshold : float
+        The PSI beyond which a feature is reported as drifted.
+    ks_threshold : float
+        The KS statistic beyond which a continuous feature is reported as drifted.
+    on_report : Callable[[DriftReport], None], optional
+        Called with every report.
+    last_report : DriftReport, optional
+        The latest report.
+    """
+
+    def __init__(
+        self,
+        reference: FeatureSketches,
+        interval_sec: float,
+        min_rows: int,
+        psi_threshold: float,
+        ks_threshold: float,
+        on_report: Optional[Callable[[DriftReport], None]] = None,
+    ) -> None:
+        self.reference = reference
+        self.interval_sec = interval_sec
+        self.min_rows = min_rows
+        self.psi_threshold = psi_threshold
+        self.ks_threshold = ks_threshold
+        self.on_report = on_report
+        self.last_report: Optional[DriftReport] = None
+        self._window = reference.empty_like()
+        self._window_start = time.monotonic()
+
+    def update(
+        self, X: Columns, X_encoded: Optional[np.ndarray] = None
+    ) -> Optional[DriftReport]:
+        """
+        Sketches the batch, already encoded as `X_encoded` if it's given, and returns
+        the report if it's time for one.
+        """
+        self._window.update(X, X_encoded)
+        if (
+            self._window.n_rows >= self.min_rows
+            and time.monotonic() - self._window_start >= self.interval_sec
+        ):
+            return self.report()
+        return None
+
+    def report(self) -> Optional[DriftReport]:
+        """Reports the window so far unless it's empty and starts a new one."""
+        if self._window.n_rows == 0:
+            return None
+        features = compute_drift(self.reference, self._window)
+        report = {
+            "n_rows": self._window.n_rows,
+            "window_sec": time.monotonic() - self._window_start,
+            "drifted": [
+                name
+                for name, scores in features.items()
+                if scores["psi"] > self.psi_threshold
+                or scores.get("ks", 0) > self.ks_threshold
+            ],
+            "features": features,
+        }
+        self._window = self.reference.empty_like()
+        self._window_start = time.monotonic()
+        self.last_report = report
+        if self.on_report is not None:
+            self.on_report(report)
+        return report
+
+
+def format_report(report: DriftReport) -> str:
+    lines = [
+        f"Drift of {report['n_rows']} rows over {report['window_sec']:.0f} sec, "
+        f"drifted: {', '.join(report['drifted']) or 'none'}",
+        f"{'feature':>12} {'PSI':>7} {'KS':>7} {'unseen/missing':>15} "
+        f"{'mean':>9} {'ref. mean':>9}",
+    ]
+    for name, scores in report["features"].items():
+        lines.append(
+            f"{name:>12} {scores['psi']:>7.3f} {scores.get('ks', np.nan):>7.3f} "
+            f"{scores.get('unseen_rate', scores.get('missing_rate')):>15.3f} "
+            f"{scores.get('mean', np.nan):>9.3f} "
+            f"{scores.get('reference_mean', np.nan):>9.3f}"
+        )
+    return "\n".join(lines)
+
+
+def create_monitor(
+    model: Any,
+    monitoring_cfg: DictConfig,
+    on_report: Optional[Callable[[DriftReport], None]] = None,
+) -> Optional[DriftMonitor]:
+    """
+    Creates the monitor of the model's inputs configured by `inference.monitoring`, or
+    returns None if it's disabled or the checkpoint has no reference sketches.
+    """
+    if not monitoring_cfg.enabled:
+        return None
+    # The models pickled before the profiles were saved have none
+    if getattr(model, "profile", None) is None:
+        print("The checkpoint has no reference profile to monitor the drift against")
+        return None
+    return DriftMonitor(
+        model.profile,
+        monitoring_cfg.interval_sec,
+        monitoring_cfg.min_rows,
+        monitoring_cfg.psi_threshold,
+        monitoring_cfg.ks_threshold,
+        on_report,
+    )
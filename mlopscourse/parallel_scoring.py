@@ -0,0 +1,156 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from omegaconf import DictConfig
+
+from .prediction_cache import load_checkpoint_with_cache
+
+
+# The name of a column, the name of its shared memory block, its dtype and, for the
+# categorical columns stored as codes, the categories
+ColumnSpec = Tuple[str, str, str, Optional[List[Any]]]
+
+# Filled by the initializer of each worker process
+_worker: Dict[str, Any] = dict()
+
+
+def create_shared_array(
+    shape: Tuple[int, ...], dtype: np.dtype
+) -> Tuple[SharedMemory, np.ndarray]:
+    dtype = np.dtype(dtype)
+    # Zero-sized blocks are not allowed
+    shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def share_frame(X: pd.DataFrame) -> Tuple[List[SharedMemory], List[ColumnSpec]]:
+    """
+    Copies the columns of the frame into shared memory blocks. String columns are
+    stored as categorical codes, since Python objects can't be shared.
+    """
+    blocks, specs = list(), list()
+    for name in X.columns:
+        column = X[name]
+        categories = None
+        if column.dtype == np.object_ or isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.astype("category")
+            categories = column.cat.categories.tolist()
+            values = column.cat.codes.to_numpy()
+        else:
+            values = column.to_numpy()
+        shm, shared_values = create_shared_array(values.shape, values.dtype)
+        shared_values[:] = values
+        blocks.append(shm)
+        specs.append((name, shm.name, values.dtype.str, categories))
+    return blocks, specs
+
+
+def attach_frame(
+    specs: List[ColumnSpec], n_rows: int
+) -> Tuple[List[SharedMemory], pd.DataFrame]:
+    """Builds a frame on top of the shared memory blocks created by `share_frame`."""
+    blocks, columns = list(), dict()
+    for name, shm_name, dtype, categories in specs:
+        shm = SharedMemory(name=shm_name)
+        values = np.ndarray((n_rows,), dtype=dtype, buffer=shm.buf)
+        if categories is not None:
+            values = pd.Categorical.from_codes(values, categories=categories)
+        blocks.append(shm)
+        columns[name] = values
+    return blocks, pd.DataFrame(columns, copy=False)
+
+
+def _init_worker(
+    checkpoint_path: str,
+    specs: List[ColumnSpec],
+    n_rows: int,
+    preds_name: str,
+    threads_per_worker: int,
+    compiled: bool,
+    cache_cfg: Optional[DictConfig],
+) -> None:
+    # Each worker predicts as `infer` does, with a cache of its own
+    _worker["model"] = load_checkpoint_with_cache(checkpoint_path, cache_cfg, compiled)
+    # Otherwise each worker would spawn a thread per core
+    _worker["model"].set_thread_count(threads_per_worker)
+    _worker["blocks"], _worker["X"] = attach_frame(specs, n_rows)
+    preds_shm = SharedMemory(name=preds_name)
+    _worker["blocks"].append(preds_shm)
+    _worker["preds"] = np.ndarray((n_rows,), dtype=np.float64, buffer=preds_shm.buf)
+
+
+def _score_partition(start: int, end: int) -> int:
+    _worker["preds"][start:end] = _worker["model"](_worker["X"].iloc[start:end])
+    return end - start
+
+
+def score_in_parallel(
+    checkpoint_path: str,
+    X: pd.DataFrame,
+    n_workers: int,
+    partition_size: Optional[int] = None,
+    threads_per_worker: int = 1,
+    compiled: bool = False,
+    cache_cfg: Optional[DictConfig] = None,
+) -> np.ndarray:
+    """
+    Scores the frame with a pool of processes, each of which loads the checkpoint once.
+
+    The input and the predictions are passed through shared memory, and each partition
+    writes its predictions to its own slice, so the original order is kept.
+
+    Parameters
+    ----------
+    checkpoint_path : str
+        The path to the checkpoint, see `models_zoo.load_checkpoint`.
+    X : pandas.DataFrame
+        The features to score.
+    n_workers : int
+        The number of worker processes.
+    partition_size : int, optional
+        The number of rows scored by a worker at once. By default, the rows are split
+        evenly between the workers, so all of them are busy whatever the number of
+        rows.
+    threads_per_worker : int
+        The number of threads a worker's model may use.
+    compiled : bool
+        Whether the workers compile the model, see `BaseModel.compile`.
+    cache_cfg : omegaconf.DictConfig, optional
+        The prediction cache of each worker, see `load_checkpoint_with_cache`.
+    """
+    n_rows = len(X)
+    if partition_size is None:
+        partition_size = max(-(-n_rows // n_workers), 1)
+    blocks, specs = share_frame(X)
+    preds_shm, preds = create_shared_array((n_rows,), np.float64)
+    blocks.append(preds_shm)
+    try:
+        # Forking a process with running CatBoost or OpenMP threads may deadlock
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(
+                checkpoint_path,
+                specs,
+                n_rows,
+                preds_shm.name,
+                threads_per_worker,
+                compiled,
+                cache_cfg,
+            ),
+        ) as executor:
+            starts = range(0, n_rows, partition_size)
+            ends = [min(start + partition_size, n_rows) for start in starts]
+            n_scored = sum(executor.map(_score_partition, starts, ends))
+        assert n_scored == n_rows, "Some partitions weren't scored!"
+        return preds.copy()
+    finally:
+        del preds
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,285 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from omegaconf import DictConfig
+
+from .models.base import BaseModel
+from .models.encoder import Columns, FeatureEncoder, take_rows
+from .models.models_zoo import get_checkpoint_version, load_checkpoint
+from .profiling import span
+
+
+if TYPE_CHECKING:
+    from .monitoring import FeatureSketches
+
+
+def hash_rows(X: Columns, feature_names: List[str]) -> np.ndarray:
+    """
+    Hashes every row into a uint64 key. The floats are rounded to float32, as the Arrow
+    cache stores them and both models cast them anyway, the integers are hashed as
+    float64, which is lossless, and the categories as strings, whose UTF-8 bytes from
+    Triton hash the same. So a row gets the same key whether it comes from the CSV, the
+    Arrow cache or a request, and the rows which differ only beyond float32 precision
+    get the same prediction.
+    """
+    columns = dict()
+    for name in feature_names:
+        column = X[name]
+        if not isinstance(column, pd.Series):
+            # The record batches may hold the columns as (n, 1) tensors
+            column = pd.Series(np.asarray(column).reshape(-1), copy=False)
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.cat.rename_categories(column.cat.categories.astype(str))
+        elif column.dtype.kind == "f":
+            column = column.astype(np.float32).astype(np.float64)
+        elif column.dtype.kind in "biu":
+            column = column.astype(np.float64)
+        elif pd.api.types.infer_dtype(column, skipna=True) not in ("string", "bytes"):
+            column = column.astype(str)
+        columns[name] = column
+    return pd.util.hash_pandas_object(
+        pd.DataFrame(columns, copy=False), index=False
+    ).to_numpy()
+
+
+# The number of new keys gathered before they are merged into the sorted entries
+RECENT_SIZE = 4096
+
+# The arrays of cached entries: the sorted row keys, their predictions, the times they
+# expire at and the ticks they were last used at
+Entries = Dict[str, np.ndarray]
+
+
+def empty_entries() -> Entries:
+    return {
+        "keys": np.empty(0, dtype=np.uint64),
+        "preds": np.empty(0, dtype=np.float64),
+        "expires_at": np.empty(0, dtype=np.float64),
+        "last_used": np.empty(0, dtype=np.int64),
+    }
+
+
+def find_keys(entries: Entries, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the positions of the `keys` in the `entries` and the mask of found."""
+    positions = np.searchsorted(entries["keys"], keys)
+    found = np.zeros(len(keys), dtype=bool)
+    in_range = positions < len(entries["keys"])
+    found[in_range] = entries["keys"][positions[in_range]] == keys[in_range]
+    return positions, found
+
+
+def insert_entries(entries: Entries, other: Entries) -> Entries:
+    """Merges the sorted `other` entries with distinct keys into the `entries`."""
+    positions = np.searchsorted(entries["keys"], other["keys"])
+    return {name: np.insert(entries[name], positions, other[name]) for name in entries}
+
+
+def remove_entries(entries: Entries, positions: np.ndarray) -> Entries:
+    keep = np.ones(len(entries["keys"]), dtype=bool)
+    keep[positions] = False
+    return {name: values[keep] for name, values in entries.items()}
+
+
+class PredictionCache:
+    """
+    An LRU cache of predictions with an optional time to live.
+
+    The entries are kept in arrays sorted by their keys, so a batch of keys is looked
+    up with `numpy.searchsorted` instead of a loop over a dict. Inserting into large
+    arrays copies them, so the new keys are gathered in small sorted arrays first and
+    merged into the rest once there are `RECENT_SIZE` of them. Every lookup and store
+    is a tick of a clock, and the merge evicts the entries used at the oldest ticks,
+    leaving room for the next new keys.
+
+    Attributes
+    ----------
+    max_size : int
+        The maximum number of cached rows, the least recently used ones are evicted.
+    ttl_seconds : float, optional
+        The time after which a prediction is computed again.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: Optional[float] = None) -> None:
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+        self.n_expirations = 0
+        # A key is either in the merged entries or in the recent ones
+        self._merged = empty_entries()
+        self._recent = empty_entries()
+        self._tick = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._merged["keys"]) + len(self._recent["keys"])
+
+    def lookup(
+        self, keys: np.ndarray, counts: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the cached predictions (NaN for the misses) and the mask of hits.
+        `counts` are the numbers of rows behind each key for the hit rate.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        preds = np.full(len(keys), np.nan)
+        hits = np.zeros(len(keys), dtype=bool)
+        now = time.monotonic()
+        with self._lock:
+            self._tick += 1
+            for level in ["_merged", "_recent"]:
+                entries = getattr(self, level)
+                positions, found = find_keys(entries, keys)
+                positions = positions[found]
+                expired = entries["expires_at"][positions] < now
+                preds[found] = np.where(expired, np.nan, entries["preds"][positions])
+                hits[found] = ~expired
+                entries["last_used"][positions] = self._tick
+                if expired.any():
+                    expired_positions = np.unique(positions[expired])
+                    setattr(self, level, remove_entries(entries, expired_positions))
+                    self.n_expirations += len(expired_positions)
+            counts = np.ones(len(keys), dtype=np.int64) if counts is None else counts
+            self.n_hits += int(counts[hits].sum())
+            self.n_misses += int(counts[~hits].sum())
+        return preds, hits
+
+    def store(self, keys: np.ndarray, preds: np.ndarray) -> None:
+        expires_at = (
+            time.monotonic() + self.ttl_seconds if self.ttl_seconds else float("inf")
+        )
+        # The last prediction of a repeated key wins
+        keys, last = np.unique(np.asarray(keys, dtype=np.uint64)[::-1], return_index=True)
+        preds = np.asarray(preds, dtype=np.float64)[::-1][last]
+        with self._lock:
+            self._tick += 1
+            for entries in [self._merged, self._recent]:
+                positions, found = find_keys(entries, keys)
+                entries["preds"][positions[found]] = preds[found]
+                entries["expires_at"][positions[found]] = expires_at
+                entries["last_used"][positions[found]] = self._tick
+                keys, preds = keys[~found], preds[~found]
+            new = {
+                "keys": keys,
+                "preds": preds,
+                "expires_at": np.full(len(keys), expires_at),
+                "last_used": np.full(len(keys), self._tick, dtype=np.int64),
+            }
+            self._recent = insert_entries(self._recent, new)
+            if len(self._recent["keys"]) >= RECENT_SIZE or len(self) > self.max_size:
+                self._merge()
+
+    def _merge(self) -> None:
+        merged = insert_entries(self._merged, self._recent)
+        self._recent = empty_entries()
+        # The room left for the next new keys, so that most stores don't merge
+        n_evicted = len(merged["keys"]) - (
+            self.max_size - min(RECENT_SIZE, self.max_size // 16)
+        )
+        if n_evicted > 0:
+            oldest = np.argpartition(merged["last_used"], n_evicted - 1)[:n_evicted]
+            merged = remove_entries(merged, oldest)
+            self.n_evictions += n_evicted
+        self._merged = merged
+
+    def stats(self) -> Dict[str, Any]:
+        n_lookups = self.n_hits + self.n_misses
+        return {
+            "size": len(self),
+            "hits": self.n_hits,
+            "misses": self.n_misses,
+            "hit_rate": self.n_hits / n_lookups if n_lookups else 0.0,
+            "evictions": self.n_evictions,
+            "expirations": self.n_expirations,
+        }
+
+
+class CachedModel:
+    """
+    Puts a `PredictionCache` in front of `BaseModel.__call__`. A batch is split into
+    the cached rows and the rest, and only the distinct uncached rows reach the model.
+
+    The keys are mixed with the checkpoint version, so the predictions of another
+    checkpoint sharing the cache are never hit.
+
+    Attributes
+    ----------
+    model : BaseModel
+        The model to predict the misses with.
+    cache : PredictionCache
+        The cached predictions.
+    version : str
+        The version of the model's checkpoint.
+    """
+
+    def __init__(self, model: BaseModel, cache: PredictionCache, version: str) -> None:
+        self.model = model
+        self.cache = cache
+        self.version = version
+        self._version_key = pd.util.hash_array(np.array([version], dtype=object))[0]
+
+    @property
+    def feature_names(self) -> List[str]:
+        return self.model.feature_names
+
+    @property
+    def profile(self) -> Optional["FeatureSketches"]:
+        return getattr(self.model, "profile", None)
+
+    @property
+    def encoder(self) -> Optional[FeatureEncoder]:
+        return self.model.encoder
+
+    def __call__(self, X_sample: pd.DataFrame) -> np.ndarray:
+        return self._predict(X_sample, lambda rows: self.model(X_sample.iloc[rows]))
+
+    def predict_encoded(self, X_sample: Columns, X_encoded: np.ndarray) -> np.ndarray:
+        """See `BaseModel.predict_encoded`, only the missed rows reach the model."""
+        return self._predict(
+            X_sample,
+            lambda rows: self.model.predict_encoded(
+                take_rows(X_sample, rows), X_encoded[rows]
+            ),
+        )
+
+    def _predict(
+        self, X_sample: Columns, predict: Callable[[np.ndarray], np.ndarray]
+    ) -> np.ndarray:
+        keys = hash_rows(X_sample, self.model.feature_names) ^ self._version_key
+        # The repeated rows of the batch are looked up and predicted once
+        unique_keys, first_rows, inverse, counts = np.unique(
+            keys, return_index=True, return_inverse=True, return_counts=True
+        )
+        preds, hits = self.cache.lookup(unique_keys, counts)
+        if not hits.all():
+            misses = np.nonzero(~hits)[0]
+            preds[misses] = predict(first_rows[misses])
+            self.cache.store(unique_keys[misses], preds[misses])
+        return preds[inverse]
+
+    def set_thread_count(self, thread_count: int) -> None:
+        self.model.set_thread_count(thread_count)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"version": self.version, **self.cache.stats()}
+
+
+def load_checkpoint_with_cache(
+    checkpoint_path: str, cache_cfg: Optional[DictConfig], compiled: bool = False
+) -> Union[BaseModel, CachedModel]:
+    """
+    Loads the checkpoint, compiles the model if `compiled` and puts a cache in front of
+    it if `cache_cfg.enabled`.
+    """
+    model = load_checkpoint(checkpoint_path)
+    if compiled:
+        with span("compile"):
+            model.compile()
+    if cache_cfg is None or not cache_cfg.enabled:
+        return model
+    cache = PredictionCache(cache_cfg.max_size, cache_cfg.ttl_seconds)
+    return CachedModel(model, cache, get_checkpoint_version(checkpoint_path))
@@ -0,0 +1,193 @@
+import cProfile
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, ContextManager, Dict, Iterator, List, Optional
+
+from omegaconf import DictConfig
+
+from .utils import get_git_revision_hash
+
+
+if TYPE_CHECKING:
+    from .mlflow_logger import MlflowLogger
+
+
+# The statistics of a span summed over its occurrences, except the peak RSS
+SPAN_STATS = ["count", "wall_sec", "cpu_sec", "rss_growth_mb", "peak_rss_mb"]
+
+# The tracer of the running command, the spans are no-ops without it
+_tracer: Optional["Tracer"] = None
+_NO_SPAN = nullcontext()
+
+
+def get_peak_rss_mb() -> float:
+    # Linux reports the peak RSS in KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Tracer:
+    """
+    Collects the wall time, the CPU time and the peak RSS of the named spans of a
+    command. The spans nest, a span is named by the path of the spans it is in, like
+    `train/fit/pool` with `train` for the whole command, and the occurrences of the
+    same span are summed.
+
+    The CPU time is the one of the whole process, so it exceeds the wall time while
+    several threads are busy. The peak RSS never decreases, so `rss_growth_mb` is
+    the memory a span needed beyond everything before it.
+
+    Attributes
+    ----------
+    command : str
+        The name of the traced command, the root of the span paths.
+    spans : Dict[str, Dict[str, float]]
+        The statistics of each span, see `SPAN_STATS`.
+    """
+
+    def __init__(self, command: str) -> None:
+        self.command = command
+        self.spans: Dict[str, Dict[str, float]] = dict()
+        self._lock = threading.Lock()
+        # Each thread has its own stack of the open spans
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        stack: List[str] = getattr(self._local, "stack", list())
+        self._local.stack = stack + [name]
+        path = "/".join(self._local.stack)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        start_rss = get_peak_rss_mb()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+            peak_rss = get_peak_rss_mb()
+            self._local.stack = stack
+            with self._lock:
+                stats = self.spans.setdefault(path, dict.fromkeys(SPAN_STATS, 0))
+                stats["count"] += 1
+                stats["wall_sec"] += wall
+                stats["cpu_sec"] += cpu
+                stats["rss_growth_mb"] += peak_rss - start_rss
+                stats["peak_rss_mb"] = max(stats["peak_rss_mb"], peak_rss)
+
+    def log_metrics(self, logger: "MlflowLogger") -> None:
+        """Logs the statistics of the finished spans as `span/<path>/<stat>`."""
+        with self._lock:
+            logger.log_metrics(
+                {
+                    f"span/{path}/{name}": value
+                    for path, stats in self.spans.items()
+                    for name, value in stats.items()
+                }
+            )
+
+    def save(self, path: str, metadata: Dict[str, Any]) -> None:
+        """Saves the spans into a JSON trace, see `benchmarks/compare_traces.py`."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._lock:
+            trace = {"command": self.command, **metadata, "spans": self.spans}
+        with open(path, "w") as f:
+            json.dump(trace, f, indent=2)
+
+
+def install_tracer(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    """Makes `tracer` collect the spans of the process and returns the previous one."""
+    global _tracer
+    previous_tracer, _tracer = _tracer, tracer
+    return previous_tracer
+
+
+def span(name: str) -> ContextManager[None]:
+    """Times the enclosed code as the span `name` of the running command if traced."""
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name)
+
+
+class _Profiler:
+    """Dumps the profile of the whole command with cProfile or pyinstrument."""
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        if kind == "cprofile":
+            self._profiler = cProfile.Profile()
+        elif kind == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                raise ImportError(
+                    "Install pyinstrument to use it as the profiler!"
+                ) from None
+            self._profiler = Profiler()
+        else:
+            raise ValueError(f"Unknown profiler: {kind}")
+
+    def start(self) -> None:
+        if self.kind == "cprofile":
+            self._profiler.enable()
+        else:
+            self._profiler.start()
+
+    def stop(self, path_prefix: str) -> str:
+        """Stops the profiler and returns the path of the dump."""
+        if self.kind == "cprofile":
+            self._profiler.disable()
+            path = f"{path_prefix}.prof"
+            self._profiler.dump_stats(path)
+        else:
+            self._profiler.stop()
+            path = f"{path_prefix}.html"
+            with open(path, "w") as f:
+                f.write(self._profiler.output_html())
+        return path
+
+
+@contextmanager
+def tracing(
+    profiling_cfg: DictConfig, command: str, model_name: str
+) -> Iterator[Optional[Tracer]]:
+    """
+    Traces the enclosed command if `profiling_cfg.enabled`, saving the trace to
+    `<trace_dir>/<command>-<model_name>.json` when it finishes, and profiles it with
+    `profiling_cfg.profiler` if set.
+    """
+    if not profiling_cfg.enabled:
+        yield None
+        return
+
+    os.makedirs(profiling_cfg.trace_dir, exist_ok=True)
+    path_prefix = os.path.join(profiling_cfg.trace_dir, f"{command}-{model_name}")
+    tracer, profiler = Tracer(command), None
+    if profiling_cfg.profiler is not None:
+        profiler = _Profiler(profiling_cfg.profiler)
+        profiler.start()
+    previous_tracer = install_tracer(tracer)
+    try:
+        # The root span is the whole command
+        with tracer.span(command):
+            yield tracer
+    finally:
+        install_tracer(previous_tracer)
+        if profiler is not None:
+            print(f"The profile is saved to {profiler.stop(path_prefix)}")
+        try:
+            commit_id = get_git_revision_hash()
+        except (OSError, subprocess.CalledProcessError):
+            commit_id = None
+        tracer.save(
+            f"{path_prefix}.json",
+            {
+                "model_name": model_name,
+                "commit_id": commit_id,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            },
+        )
+        print(f"The trace is saved to {path_prefix}.json")
@@ -0,0 +1,287 @@
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+import fire
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from hydra import compose
+from omegaconf import DictConfig, OmegaConf
+
+from .models.base import BaseModel
+from .monitoring import DriftMonitor, create_monitor, format_report
+from .prediction_cache import CachedModel, load_checkpoint_with_cache
+from .profiling import span, tracing
+
+
+# A record batch of one request and the future to resolve with its predictions
+PendingRequest = Tuple[Dict[str, np.ndarray], int, asyncio.Future]
+
+
+class ServingStats:
+    """Counters of the served requests, kept in memory."""
+
+    def __init__(self, latency_window: int = 10000) -> None:
+        self.start_time = time.monotonic()
+        self.n_requests = 0
+        self.n_rows = 0
+        self.n_batches = 0
+        self.n_errors = 0
+        self.queue_depth = 0
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        self.batch_sizes: Deque[int] = deque(maxlen=latency_window)
+
+    def to_dict(self) -> Dict[str, Any]:
+        uptime = time.monotonic() - self.start_time
+        latencies = np.array(self.latencies) * 1e3 if self.latencies else np.zeros(1)
+        return {
+            "uptime_sec": uptime,
+            "requests": self.n_requests,
+            "rows": self.n_rows,
+            "batches": self.n_batches,
+            "errors": self.n_errors,
+            "queue_depth": self.queue_depth,
+            "rows_per_sec": self.n_rows / uptime,
+            "mean_batch_size": float(np.mean(self.batch_sizes))
+            if self.batch_sizes
+            else 0,
+            "latency_ms_p50": float(np.percentile(latencies, 50)),
+            "latency_ms_p95": float(np.percentile(latencies, 95)),
+            "latency_ms_p99": float(np.percentile(latencies, 99)),
+        }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent requests into batches like Triton's dynamic batching: a batch
+    is run as soon as it has `max_batch_size` rows or its first request has waited for
+    `max_queue_delay_microseconds`.
+
+    Attributes
+    ----------
+    model : BaseModel or CachedModel
+        The model to run the batches with.
+    max_batch_size : int
+        The maximum number of rows in a batch, a larger request forms a batch on its own.
+    max_queue_delay : float
+        The maximum number of seconds a request waits for the others.
+    stats : ServingStats
+        The counters to update.
+    monitor : DriftMonitor, optional
+        The monitor of the drift of the served features.
+    """
+
+    def __init__(
+        self,
+        model: Union[BaseModel, CachedModel],
+        max_batch_size: int,
+        max_queue_delay_microseconds: int,
+        stats: ServingStats,
+        monitor: Optional[DriftMonitor] = None,
+    ) -> None:
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay_microseconds / 1e6
+        self.stats = stats
+        self.monitor = monitor
+        self._queue: "asyncio.Queue[PendingRequest]" = asyncio.Queue()
+        # The model runs in its own thread, so the event loop keeps accepting requests
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = asyncio.create_task(self._run())
+
+    async def predict(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        n_rows = len(next(iter(columns.values())))
+        future = asyncio.get_running_loop().create_future()
+        self.stats.queue_depth += n_rows
+        await self._queue.put((columns, n_rows, future))
+        return await future
+
+    async def close(self) -> None:
+        self._task.cancel()
+        self._executor.shutdown()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_rows = batch[0][1]
+            deadline = loop.time() + self.max_queue_delay
+            while n_rows < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(pending)
+                n_rows += pending[1]
+            self.stats.queue_depth -= n_rows
+            try:
+                await self._run_batch(batch, n_rows)
+            except Exception as e:
+                # A failed batch mustn't stop the serving of the next ones
+                print(f"Failed to run a batch of {n_rows} rows: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _predict(self, frame: pd.DataFrame) -> np.ndarray:
+        # The batches run in the executor's thread, so their spans are top-level
+        with span("predict_batch"):
+            return self.model(frame)
+
+    def _monitor(self, frame: pd.DataFrame) -> None:
+        with span("monitor"):
+            self.monitor.update(frame)
+
+    async def _run_batch(self, batch: List[PendingRequest], n_rows: int) -> None:
+        try:
+            frame = pd.DataFrame(
+                {
+                    name: np.concatenate([columns[name] for columns, _, _ in batch])
+                    for name in batch[0][0]
+                },
+                copy=False,
+            )
+            preds = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._predict, frame
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.stats.n_batches += 1
+        self.stats.batch_sizes.append(n_rows)
+        offset = 0
+        for _, request_rows, future in batch:
+            # The request may have been cancelled, e.g. if its client disconnected
+            if not future.done():
+                future.set_result(preds[offset : offset + request_rows])
+            offset += request_rows
+        if self.monitor is not None:
+            # The requests are answered by now, and the sketches are only touched by
+            # the model's thread
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._monitor, frame
+            )
+
+
+def parse_dataframe_split(
+    payload: Dict[str, Any], feature_names: List[str]
+) -> Dict[str, np.ndarray]:
+    """Converts the MLflow's `dataframe_split` payload into NumPy columns."""
+    split = payload["dataframe_split"]
+    columns = split["columns"]
+    missing = set(feature_names) - set(columns)
+    if missing:
+        raise ValueError(f"The columns {sorted(missing)} are missing!")
+    if len(split["data"]) == 0:
+        raise ValueError("The request contains no rows!")
+    values = list(zip(*split["data"]))
+    return {name: np.array(values[columns.index(name)]) for name in feature_names}
+
+
+def create_app(
+    model: Union[BaseModel, CachedModel],
+    serving_cfg: DictConfig,
+    monitor: Optional[DriftMonitor] = None,
+) -> web.Application:
+    stats = ServingStats()
+    app = web.Application()
+
+    async def start_batcher(app: web.Application) -> None:
+        app["batcher"] = MicroBatcher(
+            model,
+            serving_cfg.max_batch_size,
+            serving_cfg.max_queue_delay_microseconds,
+            stats,
+            monitor,
+        )
+
+    async def stop_batcher(app: web.Application) -> None:
+        await app["batcher"].close()
+
+    async def invocations(request: web.Request) -> web.Response:
+        start = time.perf_counter()
+        stats.n_requests += 1
+        try:
+            columns = parse_dataframe_split(await request.json(), model.feature_names)
+        except (ValueError, KeyError, TypeError) as e:
+            stats.n_errors += 1
+            return web.json_response({"error": f"Bad request: {e}"}, status=400)
+        try:
+            preds = await app["batcher"].predict(columns)
+        except Exception as e:
+            stats.n_errors += 1
+            return web.json_response({"error": str(e)}, status=500)
+        stats.n_rows += len(preds)
+        stats.latencies.append(time.perf_counter() - start)
+        return web.json_response({"predictions": preds.tolist()})
+
+    async def metrics(request: web.Request) -> web.Response:
+        metrics = stats.to_dict()
+        if isinstance(model, CachedModel):
+            metrics["cache"] = model.stats()
+        if monitor is not None:
+            metrics["drift"] = monitor.last_report
+        return web.json_response(metrics)
+
+    async def ping(request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    app.on_startup.append(start_batcher)
+    app.on_cleanup.append(stop_batcher)
+    app.router.add_post("/invocations", invocations)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/ping", ping)
+    return app
+
+
+class Server:
+    """
+    Serves the chosen model over HTTP with micro-batching of concurrent requests.
+
+    Attributes
+    ----------
+    cfg : omegaconf.DictConfig
+        The configuration containing the model type and hyperparameters, training,
+        inference and serving parameters.
+    """
+
+    def __init__(self, config_name: str, **kwargs: dict) -> None:
+        self.cfg: DictConfig = compose(
+            config_name=config_name, overrides=[f"{k}={v}" for k, v in kwargs.items()]
+        )
+        print(OmegaConf.to_yaml(self.cfg))
+
+    def serve(self) -> None:
+        # The trace is saved once the server is stopped
+        with tracing(self.cfg.profiling, "serve", self.cfg.model.name):
+            with span("load_checkpoint"):
+                model = load_checkpoint_with_cache(
+                    f"checkpoints/{self.cfg.inference.checkpoint_name}",
+                    self.cfg.inference.cache,
+                    self.cfg.inference.compiled,
+                )
+            monitor = create_monitor(
+                model,
+                self.cfg.inference.monitoring,
+                lambda report: print(format_report(report)),
+            )
+            serving_cfg = self.cfg.serving
+            print(f"Serving the {self.cfg.model.name} model...")
+            web.run_app(
+                create_app(model, serving_cfg, monitor),
+                host=serving_cfg.host,
+                port=serving_cfg.port,
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(Server)
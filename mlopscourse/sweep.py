@@ -0,0 +1,326 @@
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import fire
+import mlflow
+import numpy as np
+from hydra import compose
+from mlflow.tracking import MlflowClient
+from omegaconf import DictConfig, OmegaConf
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+
+from .data.prepare_dataset import load_dataset
+from .data.prepared import PreparedSplit
+from .mlflow_logger import MlflowLogger
+from .models.encoder import FeatureEncoder
+from .models.models_zoo import prepare_model
+from .parallel_scoring import ColumnSpec, attach_frame, share_frame
+from .utils import get_git_revision_hash
+
+
+# The hyperparameter limiting the number of threads a model trains with
+THREAD_COUNT_PARAMS = {"cb": "thread_count", "rf": "n_jobs"}
+# The hyperparameters silencing the model and its side outputs during a sweep
+QUIET_PARAMS = {
+    "cb": {"logging_level": "Silent", "allow_writing_files": False},
+    "rf": {"verbose": 0},
+}
+
+# Filled by the initializer of each worker process
+_worker: Dict[str, Any] = dict()
+
+
+def sample_hyperparams(
+    search_space: DictConfig, rng: np.random.Generator
+) -> Dict[str, Any]:
+    """
+    Samples a point of the search space. Each hyperparameter is described either by
+    `choices` or by `low` and `high` with optional `log: true` and `type: int`.
+    """
+    hyperparams = dict()
+    for name, space in search_space.items():
+        if "choices" in space:
+            value = space.choices[rng.integers(len(space.choices))]
+        elif space.get("log", False):
+            value = np.exp(rng.uniform(np.log(space.low), np.log(space.high)))
+        else:
+            value = rng.uniform(space.low, space.high)
+        if space.get("type", "float") == "int":
+            value = int(round(value))
+        hyperparams[name] = value.item() if isinstance(value, np.generic) else value
+    return hyperparams
+
+
+def _init_worker(
+    cfg: Dict[str, Any],
+    encoder: FeatureEncoder,
+    prepared: Dict[str, PreparedSplit],
+    specs: Dict[str, Tuple[List[ColumnSpec], int]],
+) -> None:
+    _worker["cfg"] = OmegaConf.create(cfg)
+    _worker["encoder"] = encoder
+    # The artifacts of the split are loaded once per worker
+    _worker["prepared"] = prepared
+    _worker["blocks"] = list()
+    for name, (frame_specs, n_rows) in specs.items():
+        blocks, _worker[name] = attach_frame(frame_specs, n_rows)
+        _worker["blocks"].extend(blocks)
+
+
+def _run_trial(hyperparams: Dict[str, Any], n_estimators: int) -> Tuple[float, float]:
+    """Trains a model with `n_estimators` and returns its validation R^2 and time."""
+    cfg = _worker["cfg"].copy()
+    cfg.model.hyperparams = OmegaConf.merge(
+        cfg.model.hyperparams, hyperparams, {"n_estimators": n_estimators}
+    )
+    encoder = _worker["encoder"]
+    model = prepare_model(cfg, encoder.numerical_features, encoder.categorical_features)
+    model.encoder = encoder
+    start = time.perf_counter()
+    model.train(
+        _worker["X_train"],
+        _worker["y_train"]["target"],
+        prepared=_worker["prepared"]["train"],
+    )
+    fit_time = time.perf_counter() - start
+    X_val_encoded = _worker["prepared"]["val"].get_encoded(encoder)
+    score = r2_score(
+        _worker["y_val"]["target"], model.predict_encoded(_worker["X_val"], X_val_encoded)
+    )
+    return score, fit_time
+
+
+class SuccessiveHalving:
+    """
+    Schedules the trials with the asynchronous successive halving: each trial starts
+    with the smallest number of estimators, and it is retrained with `reduction_factor`
+    times more as soon as its score is in the top `1 / reduction_factor` of the scores
+    seen at its rung. No rung waits for the slowest trial, so the workers never idle
+    while there are trials to run.
+
+    Attributes
+    ----------
+    budgets : List[int]
+        The number of estimators at each rung, the last one is the configured one.
+    scores : List[Dict[int, float]]
+        The scores of the trials finished at each rung.
+    """
+
+    def __init__(
+        self, n_trials: int, max_estimators: int, n_rungs: int, reduction_factor: int
+    ) -> None:
+        self.n_trials = n_trials
+        self.reduction_factor = reduction_factor
+        self.budgets = [
+            max(max_estimators // reduction_factor**i, 1)
+            for i in reversed(range(n_rungs))
+        ]
+        self.scores: List[Dict[int, float]] = [dict() for _ in self.budgets]
+        self._promoted: List[Set[int]] = [set() for _ in self.budgets]
+        self._n_started = 0
+
+    def next_job(self) -> Optional[Tuple[int, int]]:
+        """Returns the next trial and its rung or None if there is nothing to run."""
+        for rung in reversed(range(len(self.budgets) - 1)):
+            n_promotable = len(self.scores[rung]) // self.reduction_factor
+            ranked = sorted(self.scores[rung], key=self.scores[rung].get, reverse=True)
+            for trial_id in ranked[:n_promotable]:
+                if trial_id not in self._promoted[rung]:
+                    self._promoted[rung].add(trial_id)
+                    return trial_id, rung + 1
+        if self._n_started < self.n_trials:
+            self._n_started += 1
+            return self._n_started - 1, 0
+        return None
+
+    def report(self, trial_id: int, rung: int, score: float) -> None:
+        self.scores[rung][trial_id] = score
+
+    def best_trial(self) -> Tuple[int, int]:
+        """Returns the best trial of the highest rung reached and that rung."""
+        rung = max(rung for rung, scores in enumerate(self.scores) if scores)
+        return max(self.scores[rung], key=self.scores[rung].get), rung
+
+
+class Sweeper:
+    """
+    Searches for the best hyperparameters of the chosen model on a validation part of
+    the train split with a pool of processes.
+
+    Attributes
+    ----------
+    cfg : omegaconf.DictConfig
+        The configuration containing the model type and hyperparameters, training,
+        inference and sweep parameters.
+    """
+
+    def __init__(self, config_name: str, **kwargs: dict) -> None:
+        self.cfg: DictConfig = compose(
+            config_name=config_name, overrides=[f"{k}={v}" for k, v in kwargs.items()]
+        )
+        self.cfg.logging.commit_id = get_git_revision_hash()
+        print(OmegaConf.to_yaml(self.cfg))
+
+    def sweep(self) -> None:
+        sweep_cfg = self.cfg.sweep
+        (
+            X,
+            y,
+            numerical_features,
+            categorical_features,
+        ) = load_dataset(split="train")
+        train_rows, val_rows = train_test_split(
+            np.arange(len(X)),
+            test_size=sweep_cfg.validation_fraction,
+            random_state=sweep_cfg.seed,
+        )
+        X_train, X_val = X.iloc[train_rows], X.iloc[val_rows]
+        y_train, y_val = y.iloc[train_rows], y.iloc[val_rows]
+        # The trials share the encoder, which is fitted once
+        encoder = FeatureEncoder.fit(X_train, numerical_features, categorical_features)
+        # The trials slice the artifacts of the whole split, which are prepared here once
+        # per its version rather than by every trial
+        prepared = {
+            "train": PreparedSplit("train", train_rows),
+            "val": PreparedSplit("train", val_rows),
+        }
+        if self.cfg.model.name == "cb":
+            prepared["train"].get_pool_path(
+                categorical_features, self.cfg.model.hyperparams
+            )
+        prepared["train"].get_encoded_path(encoder)
+        # The trials read the data from shared memory instead of loading it again
+        blocks, specs = list(), dict()
+        for name, frame in [
+            ("X_train", X_train),
+            ("y_train", y_train.to_frame("target")),
+            ("X_val", X_val),
+            ("y_val", y_val.to_frame("target")),
+        ]:
+            frame_blocks, frame_specs = share_frame(frame.reset_index(drop=True))
+            blocks.extend(frame_blocks)
+            specs[name] = (frame_specs, len(frame))
+
+        # Every trial gets its share of the cores instead of all of them
+        threads_per_trial = sweep_cfg.threads_per_trial or max(
+            os.cpu_count() // sweep_cfg.n_workers, 1
+        )
+        cfg = OmegaConf.to_container(self.cfg, resolve=True)
+        cfg["model"]["hyperparams"].update(QUIET_PARAMS[self.cfg.model.name])
+        cfg["model"]["hyperparams"][
+            THREAD_COUNT_PARAMS[self.cfg.model.name]
+        ] = threads_per_trial
+
+        rng = np.random.default_rng(sweep_cfg.seed)
+        trials = [
+            sample_hyperparams(sweep_cfg.search_space, rng)
+            for _ in range(sweep_cfg.n_trials)
+        ]
+        scheduler = SuccessiveHalving(
+            sweep_cfg.n_trials,
+            self.cfg.model.hyperparams.n_estimators,
+            sweep_cfg.n_rungs,
+            sweep_cfg.reduction_factor,
+        )
+        print(
+            f"Sweeping {sweep_cfg.n_trials} trials of the {self.cfg.model.name} model "
+            f"with {sweep_cfg.n_workers} workers, {threads_per_trial} threads each, "
+            f"and n_estimators in {scheduler.budgets}..."
+        )
+
+        mlflow_cfg = self.cfg.logging.mlflow
+        mlflow.set_tracking_uri(mlflow_cfg.tracking_uri)
+        exp_id = mlflow.set_experiment(mlflow_cfg.exp_name).experiment_id
+        client = MlflowClient(mlflow_cfg.tracking_uri)
+        loggers: Dict[int, MlflowLogger] = dict()
+        start = time.perf_counter()
+        try:
+            with mlflow.start_run(
+                experiment_id=exp_id, run_name=f"sweep-{self.cfg.model.name}"
+            ) as parent_run, ProcessPoolExecutor(
+                max_workers=sweep_cfg.n_workers,
+                # Forking a process with running CatBoost or OpenMP threads may deadlock
+                mp_context=mp.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(cfg, encoder, prepared, specs),
+            ) as executor:
+                mlflow.log_params({"commit_id": self.cfg.logging.commit_id})
+                running: Dict[Future, Tuple[int, int]] = dict()
+                while True:
+                    while len(running) < sweep_cfg.n_workers:
+                        job = scheduler.next_job()
+                        if job is None:
+                            break
+                        trial_id, rung = job
+                        if trial_id not in loggers:
+                            run = client.create_run(
+                                exp_id,
+                                run_name=f"trial-{trial_id}",
+                                tags={"mlflow.parentRunId": parent_run.info.run_id},
+                            )
+                            loggers[trial_id] = MlflowLogger(
+                                run.info.run_id,
+                                mlflow_cfg.tracking_uri,
+                                **mlflow_cfg.batching,
+                            )
+                            loggers[trial_id].log_params(trials[trial_id])
+                        future = executor.submit(
+                            _run_trial, trials[trial_id], scheduler.budgets[rung]
+                        )
+                        running[future] = job
+                    if not running:
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        trial_id, rung = running.pop(future)
+                        score, fit_time = future.result()
+                        scheduler.report(trial_id, rung, score)
+                        loggers[trial_id].log_metrics(
+                            {"val_R2_metric": score, "fit_time_sec": fit_time},
+                            step=scheduler.budgets[rung],
+                        )
+                        print(
+                            f"Trial {trial_id:>3}, n_estimators "
+                            f"{scheduler.budgets[rung]:>5}: R2 {score:.4f}, "
+                            f"{fit_time:.1f} sec"
+                        )
+
+                best_trial, best_rung = scheduler.best_trial()
+                best_score = scheduler.scores[best_rung][best_trial]
+                mlflow.log_params(
+                    {f"best_{name}": value for name, value in trials[best_trial].items()}
+                )
+                mlflow.log_metrics(
+                    {
+                        "best_val_R2_metric": best_score,
+                        "sweep_time_sec": time.perf_counter() - start,
+                    }
+                )
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+            for logger in loggers.values():
+                logger.close()
+                client.set_terminated(logger.run_id)
+
+        print(
+            f"The sweep took {time.perf_counter() - start:.1f} sec. The best trial is "
+            f"{best_trial} with R2 {best_score:.4f} at n_estimators "
+            f"{scheduler.budgets[best_rung]}. To train it, add:"
+        )
+        print(
+            " ".join(
+                f"--model.hyperparams.{name}={value}"
+                for name, value in trials[best_trial].items()
+            )
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(Sweeper)
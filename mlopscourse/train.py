@@ -1,16 +1,37 @@
+import hashlib
 import os
+import time
+from typing import Any, Dict, Optional
 
 import fire
 import mlflow
+import pandas as pd
 from hydra import compose
 from omegaconf import DictConfig, OmegaConf
-from skl2onnx import to_onnx
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
 
-from .data.prepare_dataset import load_dataset
-from .models.models_zoo import prepare_model
+from .data.prepare_dataset import TARGET, load_dataset
+from .data.prepared import PreparedSplit
+from .mlflow_logger import MlflowLogger
+from .models.encoder import FeatureEncoder
+from .models.models_zoo import load_checkpoint, prepare_model
+from .monitoring import FeatureSketches
+from .prediction_cache import hash_rows
+from .profiling import Tracer, span, tracing
 from .utils import get_git_revision_hash
 
 
+def get_watermark(X_train: pd.DataFrame, y_train: pd.Series) -> Dict[str, Any]:
+    """
+    Identifies the training rows by their number and the hash of their values, which
+    doesn't depend on whether they come from the CSV or the Arrow cache, as `hash_rows`
+    rounds the floats to float32 like the cache.
+    """
+    rows = hash_rows(X_train.assign(**{TARGET: y_train}), [*X_train.columns, TARGET])
+    return {"n_rows": len(X_train), "rows_md5": hashlib.md5(rows.tobytes()).hexdigest()}
+
+
 class Trainer:
     """
     Trains the chosen model on the train split of the dataset and saves the checkpoint.
@@ -30,48 +51,194 @@ class Trainer:
         print(OmegaConf.to_yaml(self.cfg))
 
     def train(self) -> None:
-        (
-            X_train,
-            y_train,
-            numerical_features,
-            categorical_features,
-        ) = load_dataset(split="train")
+        with tracing(self.cfg.profiling, "train", self.cfg.model.name) as tracer:
+            self._train(tracer)
+
+    def _train(self, tracer: Optional[Tracer]) -> None:
+        with span("load_dataset"):
+            (
+                X_train,
+                y_train,
+                numerical_features,
+                categorical_features,
+            ) = load_dataset(split="train")
 
         model = prepare_model(self.cfg, numerical_features, categorical_features)
+        with span("fit_encoder"):
+            model.encoder = FeatureEncoder.fit(
+                X_train, numerical_features, categorical_features
+            )
 
         print(f"Training the {self.cfg.model.name} model...")
-        model.train(X_train, y_train)
+        with span("fit"):
+            model.train(X_train, y_train, prepared=PreparedSplit("train"))
+        model.watermark = get_watermark(X_train, y_train)
+        # The served features are monitored against the train split
+        with span("fit_profile"):
+            model.profile = FeatureSketches.fit(X_train, model.encoder)
+        if self.cfg.model.name in ("rf", "ensemble"):
+            # The export is stored in the checkpoint for the fast inference path
+            with span("export_onnx"):
+                model_onnx = model.export_onnx(X_train[:1])
 
         os.makedirs("checkpoints", exist_ok=True)
-        model.save_checkpoint("checkpoints/")
+        with span("save_checkpoint"):
+            model.save_checkpoint("checkpoints/")
         print("The training was finished successfully!\nCollecting logs...")
 
         # Since there is no easy way to log metrics as functions of time during
-        # the training, they should be collected after it.
+        # the training, they should be collected after it. The logs are sent in
+        # the background while the MLflow model is being saved.
         mlflow_cfg = self.cfg.logging.mlflow
         mlflow.set_tracking_uri(mlflow_cfg.tracking_uri)
         exp_id = mlflow.set_experiment(mlflow_cfg.exp_name).experiment_id
         with mlflow.start_run(
             experiment_id=exp_id, run_name=f"training-{self.cfg.model.name}"
-        ):
+        ) as run, MlflowLogger(
+            run.info.run_id, mlflow_cfg.tracking_uri, **mlflow_cfg.batching
+        ) as logger:
             signature = mlflow.models.infer_signature(X_train, y_train)
             # Unfortunately, logging is model dependent, at least because
             # RandomForestRegressor doesn't provide the target metric progress.
             if self.cfg.model.name == "cb":
-                mlflow.catboost.save_model(
-                    model.model,
-                    f"checkpoints/mlflow_{self.cfg.model.name}_ckpt/",
-                    signature=signature,
-                )
-                model.log_fis_and_metrics(exp_id, X_train.columns)
+                with span("log_metrics"):
+                    model.log_fis_and_metrics(logger, X_train.columns)
+                with span("save_mlflow_model"):
+                    mlflow.catboost.save_model(
+                        model.model,
+                        f"checkpoints/mlflow_{self.cfg.model.name}_ckpt/",
+                        signature=signature,
+                    )
+            elif self.cfg.model.name == "ensemble":
+                # No MLflow flavor fits the blend, the native checkpoint is the model
+                with span("log_metrics"):
+                    model.log_fis_and_metrics(logger)
             else:
-                model_onnx = to_onnx(model.model, X=X_train[:1], verbose=1)
-                mlflow.onnx.save_model(
-                    model_onnx,
-                    f"checkpoints/mlflow_{self.cfg.model.name}_ckpt/",
-                    signature=signature,
-                )
-                model.log_fis_and_metrics(exp_id, X_train, y_train)
+                with span("log_metrics"):
+                    model.log_fis_and_metrics(logger, X_train, y_train)
+                with span("save_mlflow_model"):
+                    mlflow.onnx.save_model(
+                        model_onnx,
+                        f"checkpoints/mlflow_{self.cfg.model.name}_ckpt/",
+                        signature=signature,
+                    )
+            if tracer is not None:
+                # All the spans but the whole command are finished by now
+                tracer.log_metrics(logger)
+
+    def train_incremental(self) -> None:
+        """
+        Continues the training of the saved checkpoint on the rows appended to the train
+        split since it was trained, which are found by the watermark saved with it.
+        Reports the time and the test R^2 against the previous checkpoint and, if
+        `training.incremental.compare_full_refit`, against a model trained from scratch.
+        """
+        with tracing(
+            self.cfg.profiling, "train_incremental", self.cfg.model.name
+        ) as tracer:
+            self._train_incremental(tracer)
+
+    def _train_incremental(self, tracer: Optional[Tracer]) -> None:
+        incremental_cfg = self.cfg.training.incremental
+        with span("load_dataset"):
+            (
+                X_train,
+                y_train,
+                numerical_features,
+                categorical_features,
+            ) = load_dataset(split="train")
+            X_test, y_test, _, _ = load_dataset(split="test")
+        with span("load_checkpoint"):
+            model = load_checkpoint(f"checkpoints/{self.cfg.training.checkpoint_name}")
+
+        watermark = model.watermark
+        assert (
+            watermark is not None
+        ), "The checkpoint has no watermark, it must be trained from scratch first!"
+        n_seen = watermark["n_rows"]
+        if len(X_train) < n_seen or watermark != get_watermark(
+            X_train.iloc[:n_seen], y_train.iloc[:n_seen]
+        ):
+            raise ValueError(
+                "The rows the checkpoint was trained on have changed since, "
+                "it must be trained from scratch!"
+            )
+        X_new, y_new = X_train.iloc[n_seen:], y_train.iloc[n_seen:]
+        if len(X_new) == 0:
+            print(f"No rows were appended since the {n_seen} the checkpoint has seen")
+            return
+
+        report = {"n_seen_rows": n_seen, "n_new_rows": len(X_new)}
+        with span("eval"):
+            report["previous_R2"] = r2_score(y_test, model(X_test))
+        print(
+            f"Training the {self.cfg.model.name} model further on {len(X_new)} new rows "
+            f"with {incremental_cfg.n_estimators} more estimators..."
+        )
+        X_val, y_val = None, None
+        if incremental_cfg.validation_fraction > 0:
+            X_new, X_val, y_new, y_val = train_test_split(
+                X_new,
+                y_new,
+                test_size=incremental_cfg.validation_fraction,
+                random_state=0,
+            )
+        start = time.perf_counter()
+        with span("fit"):
+            model.train_incremental(
+                X_new, y_new, incremental_cfg.n_estimators, X_val, y_val
+            )
+        report["incremental_fit_time_sec"] = time.perf_counter() - start
+        model.watermark = get_watermark(X_train, y_train)
+        with span("fit_profile"):
+            model.profile = FeatureSketches.fit(X_train, model.encoder)
+        with span("eval"):
+            report["incremental_R2"] = r2_score(y_test, model(X_test))
+
+        if incremental_cfg.compare_full_refit:
+            print("Training a model from scratch on all the rows to compare with...")
+            full_model = prepare_model(self.cfg, numerical_features, categorical_features)
+            full_model.encoder = FeatureEncoder.fit(
+                X_train, numerical_features, categorical_features
+            )
+            start = time.perf_counter()
+            with span("full_refit"):
+                full_model.train(X_train, y_train, prepared=PreparedSplit("train"))
+            report["full_refit_time_sec"] = time.perf_counter() - start
+            with span("eval"):
+                report["full_refit_R2"] = r2_score(y_test, full_model(X_test))
+            report["speedup"] = (
+                report["full_refit_time_sec"] / report["incremental_fit_time_sec"]
+            )
+            report["R2_drift"] = report["incremental_R2"] - report["full_refit_R2"]
+
+        if self.cfg.model.name == "ensemble" or (
+            self.cfg.model.name == "rf" and model.model is not None
+        ):
+            with span("export_onnx"):
+                model.export_onnx(X_train[:1])
+        with span("save_checkpoint"):
+            model.save_checkpoint("checkpoints/")
+        for name, value in report.items():
+            print(f"{name}: {value:.4g}")
+
+        mlflow_cfg = self.cfg.logging.mlflow
+        mlflow.set_tracking_uri(mlflow_cfg.tracking_uri)
+        exp_id = mlflow.set_experiment(mlflow_cfg.exp_name).experiment_id
+        with mlflow.start_run(
+            experiment_id=exp_id, run_name=f"incremental-{self.cfg.model.name}"
+        ) as run, MlflowLogger(
+            run.info.run_id, mlflow_cfg.tracking_uri, **mlflow_cfg.batching
+        ) as logger:
+            logger.log_params(
+                {
+                    "commit_id": self.cfg.logging.commit_id,
+                    "n_estimators": incremental_cfg.n_estimators,
+                }
+            )
+            logger.log_metrics(report)
+            if tracer is not None:
+                tracer.log_metrics(logger)
 
 
 if __name__ == "__main__":
@@ -1,65 +1,263 @@
+import asyncio
+import time
+from typing import Any, Dict, Mapping, Optional, Union
+
+import fire
 import numpy as np
-from tritonclient.http import InferenceServerClient, InferInput, InferRequestedOutput
-from tritonclient.utils import np_to_triton_dtype
+import pandas as pd
+import tritonclient.grpc.aio as grpcclient
+import tritonclient.http.aio as httpclient
+from tritonclient.utils import triton_to_np_dtype
 
 
-def test_catboost_with_triton():
-    example = {
-        "season": "spring".encode("utf-8"),
-        "month": 1,
-        "hour": 0,
-        "holiday": 0,
-        "weekday": 6,
-        "workingday": 0,
-        "weather": "clear".encode("utf-8"),
-        "temp": 9.84,
-        "feel_temp": 14.395,
-        "humidity": 0.81,
-        "windspeed": 0.0,
-    }  # This is the first row of the training split
-    input_example = list()
-    for k, v in example.items():
-        if k in ["temp", "feel_temp", "humidity", "windspeed"]:
-            v = np.array(
-                [
-                    v,
-                ],
-                dtype=np.float32,
-            ).reshape(-1, 1)
-        elif k in ["month", "hour", "holiday", "weekday", "workingday"]:
-            v = np.array(
-                [
-                    v,
-                ],
-                dtype=np.int32,
-            ).reshape(-1, 1)
+DEFAULT_URLS = {"http": "localhost:8000", "grpc": "localhost:8001"}
+
+# A frame or a mapping of the names of the features to their columns
+Columns = Union[pd.DataFrame, Mapping[str, Any]]
+
+
+def to_triton_tensor(column: Any, datatype: str) -> np.ndarray:
+    """
+    Converts a column to the `[N, 1]` tensor of the Triton `datatype`. The strings are
+    encoded to UTF-8 once per distinct value.
+    """
+    if datatype != "BYTES":
+        return np.asarray(column, dtype=triton_to_np_dtype(datatype)).reshape(-1, 1)
+    codes, uniques = pd.factorize(
+        column if isinstance(column, pd.Series) else np.asarray(column).ravel()
+    )
+    assert (codes >= 0).all(), "A string feature has missing values!"
+    encoded = np.empty(len(uniques), dtype=np.object_)
+    encoded[:] = [
+        value if isinstance(value, bytes) else str(value).encode("utf-8")
+        for value in uniques
+    ]
+    return encoded[codes].reshape(-1, 1)
+
+
+class AsyncTritonClient:
+    """
+    Scores any number of rows with a model served by Triton. The rows are converted
+    to the `[N, 1]` tensors of the model's inputs, split into requests of at most
+    `max_batch_size` rows, which are sent concurrently in the binary format over one
+    connection pool, and their predictions are concatenated in the order of the rows.
+
+    The inputs and the `max_batch_size` are read from the model's config on the first
+    call, which must happen in the event loop the client is used in.
+
+    Attributes
+    ----------
+    url : str
+        The address of the server.
+    protocol : str
+        `http` or `grpc`.
+    model_name : str
+        The name of the model in the Triton repository.
+    max_batch_size : int, optional
+        The maximum number of rows in a request, the one of the model by default.
+    concurrency : int
+        The maximum number of requests in flight.
+    output_name : str
+        The name of the output with the predictions.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        protocol: str = "http",
+        model_name: str = "catboost",
+        max_batch_size: Optional[int] = None,
+        concurrency: int = 4,
+        output_name: str = "prediction",
+    ) -> None:
+        assert protocol in DEFAULT_URLS, f"Unknown protocol: {protocol}"
+        self.url = url or DEFAULT_URLS[protocol]
+        self.protocol = protocol
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.concurrency = concurrency
+        self.output_name = output_name
+        self._client: Optional[Any] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # The Triton datatypes of the inputs by their names
+        self._datatypes: Dict[str, str] = dict()
+
+    async def _connect(self) -> None:
+        if self._client is not None:
+            return
+        if self.protocol == "http":
+            self._client = httpclient.InferenceServerClient(
+                self.url, conn_limit=self.concurrency
+            )
+            metadata, config = await asyncio.gather(
+                self._client.get_model_metadata(self.model_name),
+                self._client.get_model_config(self.model_name),
+            )
         else:
-            v = np.array(
-                [
-                    v,
-                ]
-            ).reshape(-1, 1)
-        input_example.append(
-            InferInput(
-                name=k, shape=[1, 1], datatype=np_to_triton_dtype(v.dtype)
-            ).set_data_from_numpy(v)
+            self._client = grpcclient.InferenceServerClient(self.url)
+            metadata, response = await asyncio.gather(
+                self._client.get_model_metadata(self.model_name, as_json=True),
+                self._client.get_model_config(self.model_name, as_json=True),
+            )
+            config = response["config"]
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._datatypes = {
+            tensor["name"]: tensor["datatype"] for tensor in metadata["inputs"]
+        }
+        if self.max_batch_size is None:
+            self.max_batch_size = int(config.get("max_batch_size", 0))
+            assert self.max_batch_size > 0, f"{self.model_name} doesn't support batching!"
+
+    async def _infer(
+        self, tensors: Dict[str, np.ndarray], start: int, end: int
+    ) -> np.ndarray:
+        client_module = httpclient if self.protocol == "http" else grpcclient
+        inputs = list()
+        for name, tensor in tensors.items():
+            infer_input = client_module.InferInput(
+                name, [end - start, 1], self._datatypes[name]
+            )
+            if self.protocol == "http":
+                infer_input.set_data_from_numpy(tensor[start:end], binary_data=True)
+            else:
+                infer_input.set_data_from_numpy(tensor[start:end])
+            inputs.append(infer_input)
+        if self.protocol == "http":
+            outputs = [
+                httpclient.InferRequestedOutput(self.output_name, binary_data=True)
+            ]
+        else:
+            outputs = [grpcclient.InferRequestedOutput(self.output_name)]
+        async with self._semaphore:
+            result = await self._client.infer(self.model_name, inputs, outputs=outputs)
+        return result.as_numpy(self.output_name).reshape(-1)
+
+    async def predict(self, X: Columns) -> np.ndarray:
+        """
+        Predicts on the rows.
+
+        Parameters
+        ----------
+        X : pandas.DataFrame or Mapping[str, Any]
+            The features, as a frame or as 1-D or `[N, 1]` columns by their names.
+
+        Returns
+        -------
+        numpy.ndarray
+            The predictions, one per row.
+        """
+        await self._connect()
+        tensors = {
+            name: to_triton_tensor(X[name], datatype)
+            for name, datatype in self._datatypes.items()
+        }
+        n_rows = len(next(iter(tensors.values())))
+        assert all(
+            len(tensor) == n_rows for tensor in tensors.values()
+        ), "The columns have different lengths!"
+        if n_rows == 0:
+            return np.empty(0, dtype=np.float32)
+        chunks = await asyncio.gather(
+            *(
+                self._infer(tensors, start, min(start + self.max_batch_size, n_rows))
+                for start in range(0, n_rows, self.max_batch_size)
+            )
         )
+        return np.concatenate(chunks)
 
-    client = InferenceServerClient(url="localhost:8000")
-    result = client.infer(
-        "catboost",
-        input_example,
-        outputs=[
-            InferRequestedOutput("prediction"),
-        ],
-    )
-    expected_pred = 31.22848957148021  # Is taken from the mlflow inference result
-    assert (
-        expected_pred == result.as_numpy("prediction")[0]
-    ), "Something is wrong with the inference :(("
-    print("Predicted:", result.as_numpy("prediction")[0])
-    print("The test is passed!")
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def __aenter__(self) -> "AsyncTritonClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+
+class TritonClient:
+    """
+    The blocking version of `AsyncTritonClient`, which runs it in an event loop of its
+    own, so the connections are reused between the calls. It takes the same arguments.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._client = AsyncTritonClient(*args, **kwargs)
+
+    def predict(self, X: Columns) -> np.ndarray:
+        """See `AsyncTritonClient.predict`."""
+        return self._loop.run_until_complete(self._client.predict(X))
+
+    def close(self) -> None:
+        self._loop.run_until_complete(self._client.close())
+        self._loop.close()
+
+    def __enter__(self) -> "TritonClient":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def test_catboost_with_triton(
+    url: Optional[str] = None,
+    protocol: str = "http",
+    data_path: Optional[str] = None,
+    concurrency: int = 4,
+    n_copies: int = 1,
+) -> None:
+    """
+    Checks the prediction of the served CatBoost for the first row of the train split
+    and, if `data_path` is set, scores all the rows of the CSV `n_copies` times.
+
+    Parameters
+    ----------
+    url : str, optional
+        The address of the server, the default port of the protocol by default.
+    protocol : str
+        `http` or `grpc`.
+    data_path : str, optional
+        The CSV to score, e.g. `mlopscourse/data/test_split.csv`.
+    concurrency : int
+        The maximum number of requests in flight.
+    n_copies : int
+        The number of times to repeat the rows of the CSV.
+    """
+    example = {
+        "season": ["spring"],
+        "month": [1],
+        "hour": [0],
+        "holiday": [0],
+        "weekday": [6],
+        "workingday": [0],
+        "weather": ["clear"],
+        "temp": [9.84],
+        "feel_temp": [14.395],
+        "humidity": [0.81],
+        "windspeed": [0.0],
+    }  # This is the first row of the training split
+    with TritonClient(url, protocol, concurrency=concurrency) as client:
+        prediction = client.predict(example)[0]
+        expected_pred = 31.22848957148021  # Is taken from the mlflow inference result
+        # The model returns FP32, which is exact to about 1e-7
+        assert np.isclose(
+            prediction, expected_pred, rtol=1e-6
+        ), "Something is wrong with the inference :(("
+        print("Predicted:", prediction)
+        print("The test is passed!")
+
+        if data_path is not None:
+            X = pd.read_csv(data_path, index_col=0)
+            X = pd.concat([X] * n_copies, ignore_index=True)
+            start = time.perf_counter()
+            predictions = client.predict(X)
+            elapsed = time.perf_counter() - start
+            assert len(predictions) == len(X)
+            print(f"Scored {len(X)} rows in {elapsed:.3f} sec")
 
 
 if __name__ == "__main__":
-    test_catboost_with_triton()
+    fire.Fire(test_catboost_with_triton)
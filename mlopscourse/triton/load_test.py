@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import fire
+import numpy as np
+import pandas as pd
+import requests
+import tritonclient.grpc as grpcclient
+import tritonclient.http as httpclient
+from tritonclient.utils import np_to_triton_dtype
+
+
+NUMERICAL_FEATURES = ["temp", "feel_temp", "humidity", "windspeed"]
+DEFAULT_URLS = {
+    "http": "localhost:8000",
+    "grpc": "localhost:8001",
+    "local": "http://127.0.0.1:5002/invocations",
+}
+
+
+def to_triton_columns(X: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Converts the rows to the tensors described in the `catboost` config.pbtxt."""
+    columns = dict()
+    for name in X.columns:
+        if name in NUMERICAL_FEATURES:
+            column = X[name].to_numpy(dtype=np.float32)
+        elif X[name].dtype.kind in "iu":
+            column = X[name].to_numpy(dtype=np.int32)
+        else:
+            column = X[name].astype(str).str.encode("utf-8").to_numpy(dtype=np.object_)
+        columns[name] = column.reshape(-1, 1)
+    return columns
+
+
+def make_sender(protocol: str, url: str, model_name: str) -> Callable[[Any], None]:
+    """Creates a function sending one prebuilt payload, a client per thread."""
+    local = threading.local()
+
+    if protocol == "local":
+
+        def send(payload: Dict[str, Any]) -> None:
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            response = local.session.post(url, json=payload)
+            response.raise_for_status()
+
+        return send
+
+    client_module = httpclient if protocol == "http" else grpcclient
+
+    def send(inputs: List[Any]) -> None:
+        if not hasattr(local, "client"):
+            local.client = client_module.InferenceServerClient(url=url)
+        local.client.infer(
+            model_name,
+            inputs,
+            outputs=[client_module.InferRequestedOutput("prediction")],
+        )
+
+    return send
+
+
+def make_payloads(
+    X: pd.DataFrame, protocol: str, batch_size: int, n_payloads: int
+) -> List[Any]:
+    """Splits the rows into `n_payloads` requests of `batch_size` rows in advance."""
+    payloads = list()
+    for i in range(n_payloads):
+        start = i * batch_size % max(len(X) - batch_size, 1)
+        X_batch = X.iloc[start : start + batch_size]
+        if protocol == "local":
+            payloads.append({"dataframe_split": X_batch.to_dict(orient="split")})
+            continue
+        client_module = httpclient if protocol == "http" else grpcclient
+        inputs = list()
+        for name, column in to_triton_columns(X_batch).items():
+            infer_input = client_module.InferInput(
+                name, list(column.shape), np_to_triton_dtype(column.dtype)
+            )
+            infer_input.set_data_from_numpy(column)
+            inputs.append(infer_input)
+        payloads.append(inputs)
+    return payloads
+
+
+def run_load_test(
+    protocol: str = "http",
+    url: Optional[str] = None,
+    model_name: str = "catboost",
+    data_path: str = "mlopscourse/data/test_split.csv",
+    concurrency: int = 1,
+    qps: Optional[float] = None,
+    batch_size: int = 1,
+    duration: float = 10.0,
+    output: Optional[str] = None,
+) -> None:
+    """
+    Replays the rows of the test split against the model and reports the latency.
+
+    By default, `concurrency` threads send requests one after another (closed loop).
+    If `qps` is set, the requests are issued on a fixed schedule by up to `concurrency`
+    threads instead (open loop), and the latency is measured from the scheduled send
+    time, so the queueing on the client side is accounted for.
+
+    Parameters
+    ----------
+    protocol : str
+        `http` or `grpc` for Triton, `local` for the built-in server
+        (`commands.py serve`), which lets CI run without Triton.
+    url : str, optional
+        The address of the server, the default port of the protocol by default.
+    model_name : str
+        The name of the model in the Triton repository.
+    data_path : str
+        The CSV to take the rows from.
+    concurrency : int
+        The number of requests in flight.
+    qps : float, optional
+        The target number of requests per second.
+    batch_size : int
+        The number of rows in a request.
+    duration : float
+        The duration of the test in seconds.
+    output : str, optional
+        The JSON file to save the report to.
+    """
+    assert protocol in DEFAULT_URLS, f"Unknown protocol: {protocol}"
+    url = url or DEFAULT_URLS[protocol]
+    X = pd.read_csv(data_path, index_col=0).drop(columns=["bikes"])
+    payloads = make_payloads(X, protocol, batch_size, n_payloads=256)
+    send = make_sender(protocol, url, model_name)
+
+    latencies: List[float] = list()
+    n_errors = 0
+    lock = threading.Lock()
+
+    def timed_send(payload: Any, scheduled_time: float) -> None:
+        nonlocal n_errors
+        try:
+            send(payload)
+            latency = time.perf_counter() - scheduled_time
+            with lock:
+                latencies.append(latency)
+        except Exception:
+            with lock:
+                n_errors += 1
+
+    start = time.perf_counter()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        if qps is None:
+
+            def closed_loop(worker_id: int) -> None:
+                i = worker_id
+                while time.perf_counter() < deadline:
+                    timed_send(payloads[i % len(payloads)], time.perf_counter())
+                    i += concurrency
+
+            list(executor.map(closed_loop, range(concurrency)))
+        else:
+            for i in range(int(duration * qps)):
+                scheduled_time = start + i / qps
+                time.sleep(max(scheduled_time - time.perf_counter(), 0))
+                executor.submit(timed_send, payloads[i % len(payloads)], scheduled_time)
+    elapsed = time.perf_counter() - start
+
+    n_requests = len(latencies) + n_errors
+    latencies_ms = np.array(latencies) * 1e3
+    report = {
+        "protocol": protocol,
+        "url": url,
+        "mode": "closed_loop" if qps is None else "open_loop",
+        "concurrency": concurrency,
+        "target_qps": qps,
+        "batch_size": batch_size,
+        "duration_sec": elapsed,
+        "requests": n_requests,
+        "errors": n_errors,
+        "error_rate": n_errors / max(n_requests, 1),
+        "achieved_qps": len(latencies) / elapsed,
+        "rows_per_sec": len(latencies) * batch_size / elapsed,
+        "latency_ms": {
+            "mean": float(np.mean(latencies_ms)),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+        }
+        if latencies
+        else None,
+    }
+    print(json.dumps(report, indent=2))
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    fire.Fire(run_load_test)
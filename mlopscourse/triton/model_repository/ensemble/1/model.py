@@ -0,0 +1,2 @@
+# The backend is shared by the models of the repository
+from mlopscourse.triton.python_model import TritonPythonModel  # noqa: F401
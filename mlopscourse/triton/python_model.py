@@ -0,0 +1,227 @@
+import json
+from typing import Dict, List
+
+import c_python_backend_utils as c_utils
+import numpy as np
+import pandas as pd
+import triton_python_backend_utils as pb_utils
+
+from mlopscourse.models.encoder import decode_strings
+from mlopscourse.models.models_zoo import get_checkpoint_version, load_checkpoint
+from mlopscourse.monitoring import DriftMonitor, DriftReport
+from mlopscourse.prediction_cache import CachedModel, PredictionCache
+from mlopscourse.profiling import Tracer, install_tracer, span
+
+
+# The order of the columns in the training split
+FEATURE_NAMES = [
+    "season",
+    "month",
+    "hour",
+    "holiday",
+    "weekday",
+    "workingday",
+    "weather",
+    "temp",
+    "feel_temp",
+    "humidity",
+    "windspeed",
+]
+# The counters of the prediction cache exported to Triton's metrics endpoint
+CACHE_COUNTERS = ["hits", "misses", "evictions", "expirations"]
+# The drift scores of the features exported to Triton's metrics endpoint
+DRIFT_SCORES = ["psi", "ks"]
+
+
+def to_frame(batch: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Builds the frame of a record batch with the strings decoded from UTF-8."""
+    return pd.DataFrame(
+        {
+            name: decode_strings(column) if column.dtype == np.object_ else column
+            for name, column in batch.items()
+        },
+        copy=False,
+    )
+
+
+class TritonPythonModel:
+    """
+    The Python backend of the models of the repository, e.g. `catboost` or `ensemble`,
+    serving the checkpoint `/assets/<model_name>`. Each model's `1/model.py` imports it.
+    """
+
+    def initialize(self, args):
+        # Either the native checkpoint directory or the pickled `<model_name>.p`
+        self.model_name = args["model_name"]
+        checkpoint_path = f"/assets/{self.model_name}"
+        # The compilation, the cache and the tracing are configured by the
+        # `parameters` of config.pbtxt
+        parameters = {
+            key: value["string_value"]
+            for key, value in json.loads(args["model_config"])
+            .get("parameters", dict())
+            .items()
+        }
+        # Each instance saves its spans to its own trace when it's unloaded
+        self.tracer, self.trace_path = None, None
+        trace_dir = parameters.get("profiling_trace_dir", "")
+        if trace_dir:
+            self.tracer = Tracer("triton")
+            self.trace_path = f"{trace_dir}/{args['model_instance_name']}.json"
+            install_tracer(self.tracer)
+
+        with span("load_checkpoint"):
+            self.model = load_checkpoint(checkpoint_path)
+        if parameters.get("compiled", "false").lower() == "true":
+            with span("compile"):
+                self.model.compile()
+        cache_max_size = int(parameters.get("cache_max_size", 0))
+        self.cache_metrics = None
+        if cache_max_size > 0:
+            cache = PredictionCache(
+                cache_max_size, float(parameters.get("cache_ttl_seconds", 0)) or None
+            )
+            self.model = CachedModel(
+                self.model, cache, get_checkpoint_version(checkpoint_path)
+            )
+            labels = {
+                "model": args["model_name"],
+                "instance": args["model_instance_name"],
+                "checkpoint_version": self.model.version,
+            }
+            self.cache_metrics = {
+                name: pb_utils.MetricFamily(
+                    name=f"prediction_cache_{name}_total",
+                    description=f"The number of the prediction cache {name}",
+                    kind=pb_utils.MetricFamily.COUNTER,
+                ).Metric(labels=labels)
+                for name in CACHE_COUNTERS
+            }
+            self.cache_metrics["size"] = pb_utils.MetricFamily(
+                name="prediction_cache_size",
+                description="The number of the cached predictions",
+                kind=pb_utils.MetricFamily.GAUGE,
+            ).Metric(labels=labels)
+            self.reported_stats = {name: 0 for name in CACHE_COUNTERS}
+
+        # The drift of each window of `monitoring_interval_sec` is exported as gauges
+        self.monitor = None
+        interval_sec = float(parameters.get("monitoring_interval_sec", 0))
+        profile = getattr(self.model, "profile", None)
+        if interval_sec > 0 and profile is not None:
+            self.monitor = DriftMonitor(
+                profile,
+                interval_sec,
+                int(parameters.get("monitoring_min_rows", 1000)),
+                float(parameters.get("monitoring_psi_threshold", 0.2)),
+                float(parameters.get("monitoring_ks_threshold", 0.1)),
+                self.report_drift_metrics,
+            )
+            self.drift_metrics = {
+                score: pb_utils.MetricFamily(
+                    name=f"feature_drift_{score}",
+                    description=f"The {score.upper()} of the last window of a feature "
+                    "against the train split",
+                    kind=pb_utils.MetricFamily.GAUGE,
+                )
+                for score in DRIFT_SCORES
+            }
+            self.drift_gauges = {
+                (score, name): family.Metric(
+                    labels={
+                        "model": self.model_name,
+                        "instance": args["model_instance_name"],
+                        "feature": name,
+                    }
+                )
+                for score, family in self.drift_metrics.items()
+                for name in [*profile.discrete, *profile.edges]
+            }
+
+    def report_cache_metrics(self) -> None:
+        stats = self.model.stats()
+        for name in CACHE_COUNTERS:
+            self.cache_metrics[name].increment(stats[name] - self.reported_stats[name])
+            self.reported_stats[name] = stats[name]
+        self.cache_metrics["size"].set(stats["size"])
+
+    def report_drift_metrics(self, report: DriftReport) -> None:
+        for name, scores in report["features"].items():
+            for score in DRIFT_SCORES:
+                if score in scores:
+                    self.drift_gauges[score, name].set(scores[score])
+
+    @staticmethod
+    def get_column_from_requests(
+        requests: List[c_utils.InferenceRequest], name: str
+    ) -> np.ndarray:
+        """
+        Concatenates the input tensor `name` of all the requests into one column. The
+        string tensors stay arrays of bytes objects, which the encoder looks up as they
+        are.
+        """
+        return np.concatenate(
+            [
+                pb_utils.get_input_tensor_by_name(request, name).as_numpy().reshape(-1)
+                for request in requests
+            ]
+        )
+
+    def execute(
+        self, requests: List[c_utils.InferenceRequest]
+    ) -> List[c_utils.InferenceResponse]:
+        with span("execute"):
+            return self._execute(requests)
+
+    def _execute(
+        self, requests: List[c_utils.InferenceRequest]
+    ) -> List[c_utils.InferenceResponse]:
+        with span("decode"):
+            # Each request may carry several rows, so remember where each one starts
+            # to split the predictions back.
+            offsets = np.cumsum(
+                [0]
+                + [
+                    pb_utils.get_input_tensor_by_name(request, FEATURE_NAMES[0])
+                    .as_numpy()
+                    .shape[0]
+                    for request in requests
+                ]
+            )
+            batch = {
+                name: TritonPythonModel.get_column_from_requests(requests, name)
+                for name in FEATURE_NAMES
+            }
+        if self.model.encoder is None:
+            # The checkpoints saved before the shared encoder predict on a frame
+            with span("predict"):
+                preds = self.model(to_frame(batch))
+            X_encoded = None
+        else:
+            # The batch is encoded once for both the model and the monitor
+            with span("encode_features"):
+                X_encoded = self.model.encoder.transform(batch)
+            with span("predict"):
+                preds = self.model.predict_encoded(batch, X_encoded)
+        # The output is declared as FP32 with dims [1]
+        preds = np.asarray(preds).astype(np.float32).reshape(-1, 1)
+        if self.cache_metrics is not None:
+            self.report_cache_metrics()
+        if self.monitor is not None:
+            with span("monitor"):
+                self.monitor.update(batch, X_encoded)
+
+        with span("encode"):
+            responses = list()
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                responses.append(
+                    c_utils.InferenceResponse(
+                        output_tensors=[c_utils.Tensor("prediction", preds[start:end])]
+                    )
+                )
+        return responses
+
+    def finalize(self) -> None:
+        if self.tracer is not None:
+            install_tracer(None)
+            self.tracer.save(self.trace_path, {"model_name": self.model_name})
@@ -1,6 +1,14 @@
+import os
 import subprocess
 
 
 # Credits to https://stackoverflow.com/a/21901260/12187881
 def get_git_revision_hash() -> str:
-    return subprocess.check_output(["git", "rev-parse", "HEAD"]).decode("ascii").strip()
+    # The commit of the code, wherever it's run from
+    return (
+        subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        .decode("ascii")
+        .strip()
+    )
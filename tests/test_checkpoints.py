@@ -0,0 +1,100 @@
+import pickle
+
+import numpy as np
+import pytest
+from catboost import CatBoostRegressor, Pool
+from omegaconf import OmegaConf
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import OrdinalEncoder
+
+from mlopscourse.data.prepare_dataset import load_dataset
+from mlopscourse.models.catboost import CatboostModel
+from mlopscourse.models.encoder import FeatureEncoder
+from mlopscourse.models.models_zoo import load_checkpoint
+from mlopscourse.models.random_forest import RandomForest
+
+
+class BaselinePickle:
+    """Pickles as an object of `model_class` with only the attributes in `state`."""
+
+    def __init__(self, model_class, state):
+        self.model_class = model_class
+        self.state = state
+
+    def __reduce__(self):
+        return object.__new__, (self.model_class,), self.state
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    X, y, numerical_features, categorical_features = load_dataset(
+        split="train", use_cache=False
+    )
+    return X.iloc[:2000], y.iloc[:2000], numerical_features, categorical_features
+
+
+def test_baseline_forest_pickle_predicts(dataset):
+    X, y, numerical_features, categorical_features = dataset
+    cfg = OmegaConf.create({"model": {"name": "rf", "hyperparams": {"n_estimators": 5}}})
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ("cat", OrdinalEncoder(dtype=np.int64), categorical_features),
+            ("num", "passthrough", numerical_features),
+        ],
+        sparse_threshold=1,
+        verbose_feature_names_out=False,
+    ).set_output(transform="pandas")
+    pipeline = make_pipeline(
+        preprocessor, RandomForestRegressor(n_estimators=5, random_state=0)
+    )
+    pipeline.fit(X, y)
+    state = {"cfg": cfg, "preprocessor": preprocessor, "model": pipeline}
+
+    model = pickle.loads(pickle.dumps(BaselinePickle(RandomForest, state)))
+    assert isinstance(model, RandomForest)
+    assert model.encoder is None and model.compiled is None
+    assert np.array_equal(model(X), pipeline.predict(X))
+
+
+def test_baseline_catboost_pickle_predicts(dataset):
+    X, y, numerical_features, categorical_features = dataset
+    cfg = OmegaConf.create({"model": {"name": "cb", "hyperparams": {"n_estimators": 20}}})
+    catboost = CatBoostRegressor(n_estimators=20, random_seed=0, verbose=0)
+    catboost.fit(Pool(X, y, cat_features=categorical_features))
+    state = {
+        "cfg": cfg,
+        "preprocessor": None,
+        "model": catboost,
+        "numerical_features": numerical_features,
+        "categorical_features": categorical_features,
+    }
+
+    model = pickle.loads(pickle.dumps(BaselinePickle(CatboostModel, state)))
+    assert model.compiled is None and model.cat_values is None
+    assert model.thread_count == -1
+    expected = catboost.predict(Pool(X, cat_features=categorical_features))
+    assert np.array_equal(model(X), expected)
+
+
+def test_native_forest_trained_further_predicts_array(dataset, tmp_path):
+    X, y, numerical_features, categorical_features = dataset
+    cfg = OmegaConf.create(
+        {
+            "model": {
+                "name": "rf",
+                "hyperparams": {"n_estimators": 5, "random_state": 0},
+            },
+            "training": {"checkpoint_name": "rf_model", "checkpoint_format": "native"},
+        }
+    )
+    model = RandomForest(cfg, numerical_features, categorical_features)
+    model.encoder = FeatureEncoder.fit(X, numerical_features, categorical_features)
+    model.train(X.iloc[:1500], y.iloc[:1500])
+    model.save_checkpoint(f"{tmp_path}/")
+
+    model = load_checkpoint(f"{tmp_path}/rf_model")
+    model.train_incremental(X.iloc[1500:], y.iloc[1500:], n_estimators=5)
+    assert model.onnx_model is None and len(model.forest.arrays["roots"]) == 10
+    assert np.array_equal(model.predict_array(X.to_dict("series")), model(X))
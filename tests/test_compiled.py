@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pytest
+from omegaconf import OmegaConf
+
+from mlopscourse.data.prepare_dataset import load_dataset
+from mlopscourse.models.catboost import CatboostModel
+from mlopscourse.models.encoder import FeatureEncoder
+from mlopscourse.models.random_forest import RandomForest
+from mlopscourse.prediction_cache import CachedModel, PredictionCache
+
+
+@pytest.fixture(scope="module")
+def splits():
+    X_train, y_train, numerical_features, categorical_features = load_dataset("train")
+    X_test, _, _, _ = load_dataset("test")
+    encoder = FeatureEncoder.fit(X_train, numerical_features, categorical_features)
+    return X_train, y_train, X_test, encoder
+
+
+def to_record_batch(X):
+    """The columns of the frame as Triton gives them, the strings as UTF-8 bytes."""
+    batch = dict()
+    for name, column in X.items():
+        if column.dtype.kind in "OU" or isinstance(column.dtype, pd.CategoricalDtype):
+            batch[name] = np.array([value.encode("utf-8") for value in column], object)
+        else:
+            batch[name] = column.to_numpy()
+    return batch
+
+
+def create_model(model_class, name, hyperparams, splits):
+    X_train, y_train, _, encoder = splits
+    cfg = OmegaConf.create({"model": {"name": name, "hyperparams": hyperparams}})
+    model = model_class(cfg, encoder.numerical_features, encoder.categorical_features)
+    model.encoder = encoder
+    model.train(X_train, y_train)
+    return model
+
+
+@pytest.fixture(scope="module")
+def catboost_model(splits):
+    hyperparams = {"depth": 6, "n_estimators": 50, "random_seed": 0, "verbose": 0}
+    return create_model(CatboostModel, "cb", hyperparams, splits)
+
+
+@pytest.fixture(scope="module")
+def forest_model(splits):
+    hyperparams = {"n_estimators": 10, "random_state": 0, "n_jobs": 1}
+    return create_model(RandomForest, "rf", hyperparams, splits)
+
+
+def test_compiled_catboost_is_bit_exact(catboost_model, splits):
+    X_test = splits[2]
+    expected = catboost_model.model.predict(X_test)
+    catboost_model.compile()
+    try:
+        X_encoded = catboost_model.encoder.transform(X_test)
+        assert not np.isnan(catboost_model.compiled.predict(X_encoded)).any()
+        assert np.array_equal(catboost_model(X_test), expected)
+    finally:
+        catboost_model.compiled = None
+
+
+def test_compiled_catboost_falls_back_to_catboost(catboost_model, splits):
+    X_test = splits[2].iloc[:100].copy()
+    X_test["season"] = X_test["season"].astype(object)
+    X_test.loc[X_test.index[:10], "season"] = "monsoon"
+    X_test.loc[X_test.index[10:20], "hour"] = 99
+    X_test.loc[X_test.index[20:30], "temp"] = np.nan
+    expected = catboost_model.model.predict(X_test)
+    catboost_model.compile()
+    try:
+        X_encoded = catboost_model.encoder.transform(X_test)
+        # The rows with the unseen categories and the missing values can't be looked up
+        assert np.isnan(catboost_model.compiled.predict(X_encoded)[:30]).all()
+        assert np.array_equal(catboost_model(X_test), expected)
+    finally:
+        catboost_model.compiled = None
+
+
+def test_compiled_forest_is_bit_exact(forest_model, splits):
+    X_test = splits[2]
+    expected = forest_model(X_test)
+    forest_model.compile()
+    try:
+        assert np.array_equal(forest_model(X_test), expected)
+    finally:
+        forest_model.compiled = None
+
+
+def test_compiled_forest_rejects_unseen_categories(forest_model, splits):
+    X_test = splits[2].iloc[:10].copy()
+    X_test["weather"] = X_test["weather"].astype(object)
+    X_test.loc[X_test.index[0], "weather"] = "snow"
+    forest_model.compile()
+    try:
+        with pytest.raises(ValueError, match="weather"):
+            forest_model(X_test)
+    finally:
+        forest_model.compiled = None
+
+
+@pytest.mark.parametrize("compiled", [False, True])
+def test_record_batch_of_bytes_predicts_like_frame(catboost_model, splits, compiled):
+    X_test = splits[2].iloc[:100].copy()
+    X_test["season"] = X_test["season"].astype(object)
+    X_test.loc[X_test.index[:10], "season"] = "monsoon"
+    expected = catboost_model.model.predict(X_test)
+    batch = to_record_batch(X_test)
+    X_encoded = catboost_model.encoder.transform(batch)
+    assert np.array_equal(X_encoded, catboost_model.encoder.transform(X_test))
+    if compiled:
+        catboost_model.compile()
+    try:
+        model = CachedModel(catboost_model, PredictionCache(max_size=1000), "v1")
+        assert np.array_equal(model.predict_encoded(batch, X_encoded), expected)
+        # The rows of the frame are hits, as the bytes hash like the strings
+        assert np.array_equal(model(X_test), expected)
+        assert model.stats()["hits"] == len(X_test)
+    finally:
+        catboost_model.compiled = None
@@ -0,0 +1,74 @@
+import os
+
+from mlflow import MlflowClient
+
+from mlopscourse import mlflow_logger
+from mlopscourse.mlflow_logger import MlflowLogger, replay_spilled_batches
+
+
+def test_logs_to_file_store(tmp_path):
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    client = MlflowClient(tracking_uri)
+    run_id = client.create_run(client.create_experiment("test")).info.run_id
+
+    with MlflowLogger(
+        run_id,
+        tracking_uri,
+        flush_interval=0.1,
+        request_timeout=1,
+        spill_dir=str(tmp_path / "spill"),
+    ) as logger:
+        logger.log_params({"depth": 6, "loss": "RMSE"})
+        for step in range(3):
+            logger.log_metrics({"rmse": 1.0 / (step + 1)}, step=step)
+
+    data = client.get_run(run_id).data
+    assert data.params == {"depth": "6", "loss": "RMSE"}
+    assert data.metrics == {"rmse": 1.0 / 3}
+    history = client.get_metric_history(run_id, "rmse")
+    assert sorted(metric.step for metric in history) == [0, 1, 2]
+    assert not os.path.exists(tmp_path / "spill")
+
+
+def test_spills_and_replays_without_changing_environment(tmp_path, monkeypatch):
+    monkeypatch.delenv("MLFLOW_HTTP_REQUEST_TIMEOUT", raising=False)
+    monkeypatch.delenv("MLFLOW_HTTP_REQUEST_MAX_RETRIES", raising=False)
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    client = MlflowClient(tracking_uri)
+    run_id = client.create_run(client.create_experiment("test")).info.run_id
+
+    # Nothing listens on the port, so every request fails
+    with MlflowLogger(
+        run_id,
+        "http://127.0.0.1:9",
+        flush_interval=0.1,
+        max_retries=1,
+        request_timeout=1,
+        spill_dir=str(tmp_path / "spill"),
+    ) as logger:
+        logger.log_params({"depth": 6})
+        logger.log_metrics({"rmse": 0.5})
+    assert "MLFLOW_HTTP_REQUEST_TIMEOUT" not in os.environ
+    assert "MLFLOW_HTTP_REQUEST_MAX_RETRIES" not in os.environ
+
+    spill_path = tmp_path / "spill" / f"{run_id}.jsonl"
+    replay_spilled_batches(str(spill_path), tracking_uri)
+    data = client.get_run(run_id).data
+    assert data.params == {"depth": "6"}
+    assert data.metrics == {"rmse": 0.5}
+    assert not spill_path.exists()
+
+
+class PublicClient:
+    """Has only the public methods of `MlflowClient`, like another MLflow version."""
+
+    def __init__(self, tracking_uri):
+        self.log_batch = MlflowClient(tracking_uri).log_batch
+
+
+def test_falls_back_without_private_client_attributes(tmp_path, monkeypatch):
+    monkeypatch.setattr(mlflow_logger, "MlflowClient", PublicClient)
+    with MlflowLogger(
+        "run", "http://127.0.0.1:9", request_timeout=1, spill_dir=str(tmp_path)
+    ) as logger:
+        assert logger._rest_store is None
@@ -0,0 +1,71 @@
+import numpy as np
+
+from mlopscourse.data.prepare_dataset import load_dataset
+from mlopscourse.prediction_cache import PredictionCache, hash_rows
+
+
+def test_rows_have_same_keys_from_csv_and_cache():
+    X_csv, _, _, _ = load_dataset(split="test", use_cache=False)
+    X_cached, _, _, _ = load_dataset(split="test")
+    feature_names = list(X_csv.columns)
+    assert (hash_rows(X_csv, feature_names) == hash_rows(X_cached, feature_names)).all()
+
+
+def test_lookup_returns_stored_predictions():
+    cache = PredictionCache(max_size=10)
+    cache.store(np.array([5, 1, 3], dtype=np.uint64), np.array([0.5, 0.1, 0.3]))
+    preds, hits = cache.lookup(np.array([3, 2, 5, 6], dtype=np.uint64))
+    assert hits.tolist() == [True, False, True, False]
+    assert preds[hits].tolist() == [0.3, 0.5]
+    assert np.isnan(preds[~hits]).all()
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_are_evicted():
+    cache = PredictionCache(max_size=3)
+    for key in [1, 2, 3]:
+        cache.store(np.array([key], dtype=np.uint64), np.array([float(key)]))
+    cache.lookup(np.array([1], dtype=np.uint64))
+    cache.store(np.array([4], dtype=np.uint64), np.array([4.0]))
+    _, hits = cache.lookup(np.array([1, 2, 3, 4], dtype=np.uint64))
+    assert hits.tolist() == [True, False, True, True]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_predictions_are_missed(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("mlopscourse.prediction_cache.time.monotonic", lambda: now[0])
+    cache = PredictionCache(max_size=10, ttl_seconds=5)
+    cache.store(np.array([1, 2], dtype=np.uint64), np.array([1.0, 2.0]))
+    now[0] += 3
+    cache.store(np.array([2], dtype=np.uint64), np.array([2.5]))
+    now[0] += 3
+    preds, hits = cache.lookup(np.array([1, 2], dtype=np.uint64))
+    assert hits.tolist() == [False, True]
+    assert preds[1] == 2.5
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["size"] == 1
+
+
+def test_merged_and_recent_keys_are_found():
+    cache = PredictionCache(max_size=100_000)
+    keys = np.arange(10_000, dtype=np.uint64) * 7
+    for start in range(0, len(keys), 1000):
+        cache.store(keys[start : start + 1000], keys[start : start + 1000] / 7)
+    cache.store(keys[:5], np.full(5, -1.0))
+    preds, hits = cache.lookup(np.concatenate([keys, keys[:10] + 1]))
+    assert hits[: len(keys)].all() and not hits[len(keys) :].any()
+    assert (preds[:5] == -1).all()
+    assert (preds[5 : len(keys)] == np.arange(5, len(keys))).all()
+    assert cache.stats()["size"] == len(keys)
+
+
+def test_size_is_bounded():
+    cache = PredictionCache(max_size=5000)
+    keys = np.arange(20_000, dtype=np.uint64)
+    for start in range(0, len(keys), 100):
+        cache.store(keys[start : start + 100], np.zeros(100))
+        assert cache.stats()["size"] <= 5000
+    _, hits = cache.lookup(keys)
+    # The most recent keys are kept
+    assert hits[-4000:].all() and not hits[:10_000].any()
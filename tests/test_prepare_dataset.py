@@ -0,0 +1,115 @@
+import os
+
+import pandas as pd
+import pytest
+
+from mlopscourse.data import prepare_dataset, prepared
+from mlopscourse.data.prepare_dataset import load_dataset
+from mlopscourse.data.prepared import PreparedSplit
+from mlopscourse.models.encoder import FeatureEncoder
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    X, y, _, _ = load_dataset(split="test", use_cache=False)
+    X.assign(bikes=y).iloc[:100].to_csv(tmp_path / "test_split.csv")
+    # The DVC file keeps the md5 of the fetched CSV, whatever is appended to it
+    (tmp_path / "test_split.csv.dvc").write_text(
+        "outs:\n- md5: 33798449\n  path: test_split.csv\n"
+    )
+    monkeypatch.setattr(prepare_dataset, "DATA_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_cache_is_rebuilt_after_append(data_dir):
+    X, _, _, _ = load_dataset(split="test")
+    assert len(X) == 100
+    assert (data_dir / "test_split.arrow").exists()
+
+    appended = pd.read_csv(data_dir / "test_split.csv", index_col=0).iloc[:10]
+    appended.index += 10_000
+    appended.to_csv(data_dir / "test_split.csv", mode="a", header=False)
+    X, _, _, _ = load_dataset(split="test")
+    assert len(X) == 110
+    assert (X.index[-10:] == appended.index).all()
+
+
+def test_cache_is_written_atomically(data_dir):
+    load_dataset(split="test")
+    assert (data_dir / "test_split.arrow").exists()
+    assert not [name for name in os.listdir(data_dir) if name.endswith(".tmp")]
+
+
+def test_prepared_split_is_rebuilt_after_append(data_dir, monkeypatch):
+    monkeypatch.setattr(prepared, "DATA_DIR", str(data_dir))
+    X, _, numerical_features, categorical_features = load_dataset(split="test")
+    encoder = FeatureEncoder.fit(X, numerical_features, categorical_features)
+    path = PreparedSplit("test").get_encoded_path(encoder)
+    assert len(PreparedSplit("test").get_encoded(encoder)) == 100
+
+    appended = pd.read_csv(data_dir / "test_split.csv", index_col=0).iloc[:10]
+    appended.index += 10_000
+    appended.to_csv(data_dir / "test_split.csv", mode="a", header=False)
+    assert PreparedSplit("test").get_encoded_path(encoder) != path
+    assert len(PreparedSplit("test").get_encoded(encoder)) == 110
+    assert not os.path.exists(path)
+
+
+@pytest.fixture
+def raw_path(tmp_path):
+    raw = pd.read_csv(prepare_dataset.RAW_PATH).groupby("year").head(1000)
+    # The first chunks have no rows of the test split
+    raw = raw.sort_values("year", kind="stable")
+    raw.to_csv(tmp_path / "raw.csv", index=False)
+    return str(tmp_path / "raw.csv")
+
+
+def test_splits_with_empty_chunks(tmp_path, raw_path):
+    output_dir = tmp_path / "data"
+    os.makedirs(output_dir)
+    prepare_dataset.prepare_dataset(
+        raw_path, str(output_dir), chunk_size=300, print_info=False
+    )
+    for split in ["train", "test"]:
+        X_csv = pd.read_csv(output_dir / f"{split}_split.csv", index_col=0)
+        X_parquet = pd.read_parquet(output_dir / f"{split}_split.parquet")
+        assert len(X_csv) > 0
+        pd.testing.assert_frame_equal(X_csv, X_parquet, check_index_type=False)
+
+
+def test_preparation_removes_prepared_artifacts(tmp_path, raw_path):
+    output_dir = tmp_path / "data"
+    os.makedirs(output_dir)
+    artifacts = [
+        "train_split.arrow",
+        "train_split.0a1b2c3d-4e5f6a7b.quantized",
+        "test_split.0a1b2c3d-4e5f6a7b.encoded.npy",
+    ]
+    for name in artifacts:
+        (output_dir / name).write_bytes(b"stale")
+    prepare_dataset.prepare_dataset(
+        raw_path, str(output_dir), chunk_size=300, print_info=False
+    )
+    assert not set(artifacts) & set(os.listdir(output_dir))
+
+
+def test_failed_preparation_keeps_previous_splits(tmp_path, raw_path):
+    output_dir = tmp_path / "data"
+    os.makedirs(output_dir)
+    prepare_dataset.prepare_dataset(
+        raw_path, str(output_dir), chunk_size=300, print_info=False
+    )
+    previous = {
+        name: (output_dir / name).read_bytes() for name in sorted(os.listdir(output_dir))
+    }
+    raw = pd.read_csv(raw_path, dtype={"holiday": str})
+    raw.loc[1500, "holiday"] = "maybe"
+    raw.to_csv(raw_path, index=False)
+
+    with pytest.raises(AssertionError, match="holiday"):
+        prepare_dataset.prepare_dataset(
+            raw_path, str(output_dir), chunk_size=300, print_info=False
+        )
+    assert sorted(os.listdir(output_dir)) == list(previous)
+    for name, contents in previous.items():
+        assert (output_dir / name).read_bytes() == contents
@@ -0,0 +1,61 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mlopscourse.server import MicroBatcher, ServingStats
+
+
+class DoublingModel:
+    """Doubles the `x` column or fails, if `fail` is set."""
+
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+
+    def __call__(self, frame: pd.DataFrame) -> np.ndarray:
+        if self.fail:
+            raise ValueError("The model failed")
+        return frame["x"].to_numpy() * 2
+
+
+class FailingMonitor:
+    def update(self, frame: pd.DataFrame) -> None:
+        raise RuntimeError("The monitor failed")
+
+
+async def predict(batcher: MicroBatcher, values: list) -> np.ndarray:
+    # A batcher whose loop has died never answers
+    return await asyncio.wait_for(
+        batcher.predict({"x": np.array(values, dtype=np.float64)}), timeout=5
+    )
+
+
+def test_cancelled_request_doesnt_stop_batcher():
+    async def run() -> None:
+        batcher = MicroBatcher(DoublingModel(), 64, 50_000, ServingStats())
+        cancelled = asyncio.ensure_future(predict(batcher, [1.0]))
+        answered = asyncio.ensure_future(predict(batcher, [2.0, 3.0]))
+        await asyncio.sleep(0.01)
+        # The batch is still being coalesced
+        cancelled.cancel()
+        assert (await answered == [4.0, 6.0]).all()
+        assert (await predict(batcher, [5.0]) == [10.0]).all()
+        await batcher.close()
+
+    asyncio.run(run())
+
+
+def test_failed_batches_dont_stop_batcher():
+    async def run() -> None:
+        model = DoublingModel(fail=True)
+        batcher = MicroBatcher(model, 64, 1000, ServingStats(), FailingMonitor())
+        with pytest.raises(ValueError):
+            await predict(batcher, [1.0])
+        model.fail = False
+        # The monitor fails after the requests are answered
+        assert (await predict(batcher, [2.0]) == [4.0]).all()
+        assert (await predict(batcher, [3.0]) == [6.0]).all()
+        await batcher.close()
+
+    asyncio.run(run())
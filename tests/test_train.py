@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+from hydra import initialize_config_dir
+
+from mlopscourse.data.prepare_dataset import DATA_DIR
+from mlopscourse.models.models_zoo import load_checkpoint
+from mlopscourse.train import Trainer
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_incremental_training_sees_appended_rows(tmp_path, monkeypatch, capsys):
+    X_train = pd.read_csv(
+        os.path.join(REPO_DIR, DATA_DIR, "train_split.csv"), index_col=0
+    )
+    X_test = pd.read_csv(os.path.join(REPO_DIR, DATA_DIR, "test_split.csv"), index_col=0)
+    assert len(X_train) == 6916 + 1729
+    os.makedirs(tmp_path / DATA_DIR)
+    X_train.iloc[:6916].to_csv(tmp_path / DATA_DIR / "train_split.csv")
+    X_test.iloc[:500].to_csv(tmp_path / DATA_DIR / "test_split.csv")
+    # The DVC file keeps the md5 of the fetched CSV, whatever is appended to it
+    (tmp_path / DATA_DIR / "train_split.csv.dvc").write_text(
+        "outs:\n- md5: 37f6c642fdde95926945240a5f573415\n  path: train_split.csv\n"
+    )
+    monkeypatch.chdir(tmp_path)
+    overrides = {
+        "model.hyperparams.n_estimators": 20,
+        "model.hyperparams.logging_level": "Silent",
+        "training.incremental.n_estimators": 10,
+        "logging.mlflow.tracking_uri": (tmp_path / "mlruns").as_uri(),
+    }
+
+    with initialize_config_dir(
+        config_dir=os.path.join(REPO_DIR, "configs"), version_base="1.3"
+    ):
+        Trainer("cb_config", **overrides).train()
+        assert load_checkpoint("checkpoints/cb_model").watermark["n_rows"] == 6916
+
+        X_train.iloc[6916:].to_csv(DATA_DIR + "/train_split.csv", mode="a", header=False)
+        capsys.readouterr()
+        Trainer("cb_config", **overrides).train_incremental()
+
+    assert "n_new_rows: 1729" in capsys.readouterr().out
+    assert load_checkpoint("checkpoints/cb_model").watermark["n_rows"] == 6916 + 1729